@@ -1,4 +1,5 @@
 import os
+import asyncio
 import httpx
 import tempfile
 import shutil
@@ -7,6 +8,9 @@ from fastapi import Request
 from fastapi.responses import StreamingResponse, FileResponse
 from starlette.background import BackgroundTask
 
+# Background downloads filling the cache, by local path
+_cache_fills: dict[str, asyncio.Task] = {}
+
 def _get_file_headers(local_path: str) -> dict:
     headers = {
         "Cross-Origin-Opener-Policy": "same-origin",
@@ -32,6 +36,9 @@ def get_local_file(local_path: str, request: Request = None) -> FileResponse | S
     Get a local file as response. If it's a .br file and client doesn't accept brotli,
     decompress it on the fly.
     
+    FileResponse answers Range requests (single and multi-range) by itself. The
+    on-the-fly decompressed stream has no known size and ignores Range.
+    
     Args:
         local_path: Path to the local file
         request: Optional request object to check Accept-Encoding header
@@ -75,19 +82,62 @@ def _client_accepts_brotli(request: Request) -> bool:
     accept_encoding = request.headers.get("accept-encoding", "")
     return "br" in accept_encoding.lower()
 
-async def proxy_and_cache(request: Request, url: str, local_path: str = None, disable_cache: bool = False):
+def _start_cache_fill(request: Request, url: str, local_path: str) -> None:
+    """Start downloading the whole file into the cache in the background (once per path)."""
+    if local_path in _cache_fills:
+        return
+    headers = {k: v for k, v in request.headers.items()
+               if k.lower() not in ["host", "content-length", "accept-encoding", "range", "if-range"]}
+    task = asyncio.create_task(_fill_cache(url, local_path, headers))
+    _cache_fills[local_path] = task
+    task.add_done_callback(lambda _: _cache_fills.pop(local_path, None))
+
+async def _fill_cache(url: str, local_path: str, headers: dict) -> None:
+    """Download url to local_path through a temp file, keeping the raw (compressed) data."""
+    os.makedirs(os.path.dirname(local_path), exist_ok=True)
+    temp_file = tempfile.NamedTemporaryFile(delete=False, dir=os.path.dirname(local_path))
+    temp_file_path = temp_file.name
+    try:
+        async with httpx.AsyncClient(timeout=None) as client:
+            async with client.stream("GET", url, headers=headers) as r:
+                if r.status_code != 200:
+                    print(f"Cache fill failed: {url} (HTTP {r.status_code})")
+                    return
+                async for chunk in r.aiter_raw():
+                    temp_file.write(chunk)
+        temp_file.close()
+        shutil.move(temp_file_path, local_path)
+        print(f"Cached: {local_path}")
+    except Exception as e:
+        print(f"Cache fill failed: {url} - {e}")
+    finally:
+        temp_file.close()
+        if os.path.exists(temp_file_path):
+            os.remove(temp_file_path)
+
+async def proxy_and_cache(request: Request, url: str, local_path: str = None, disable_cache: bool = False,
+                          lookup: bool = True):
     """
     Proxy request to upstream URL and optionally cache the response.
     
+    Range requests for cached files are answered from the cache. A Range request
+    that misses the cache is proxied as is (upstream answers 206, which isn't
+    cached) while the whole file is downloaded into the cache in the background,
+    so later seeks and resumes are served locally.
+    
     Args:
         request: FastAPI request object
         url: Upstream URL to proxy to
         local_path: Local file path for caching (required if disable_cache is False)
         disable_cache: If True, just proxy without caching or reading from local file
+        lookup: If False, don't serve local_path even if it exists (the caller
+                already looked it up with get_local_file())
     """
     if not disable_cache and local_path:
-        if response := get_local_file(local_path, request):
+        if lookup and (response := get_local_file(local_path, request)):
             return response
+        if request.method == "GET" and "range" in request.headers:
+            _start_cache_fill(request, url, local_path)
     
     # Check if this is a .br file and client doesn't support brotli
     is_br_file = url.endswith(".br")
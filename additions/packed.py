@@ -8,24 +8,83 @@ Supports:
 - On-the-fly decompression when client doesn't support brotli
 - Proper handling of .br files (stored without additional compression)
 - Auto-download from URL if archive file is not present locally
+- Zero-copy serving of stored entries from the memory-mapped archive
+- Cached index sidecar (<archive>.idx) so v1 archives aren't rescanned on restart
+- LRU cache of decoded entries for clients without brotli support
+- Block-compressed entries streamed block by block as they are decoded
+- HTTP Range requests (single and multi-range): .br passthrough ranges cover the
+  stored brotli bytes, all other ranges cover the decoded content
+- Strong ETags from the content digests in the archive index, with 304 answers
+  to If-None-Match that don't read the entry's data
+- Several archives layered as one (e.g. a base archive and patch archives): the
+  last archive holding a path serves it, found with one merged-index lookup;
+  X-Packed-Layer names the archive that served a response
+- Hot reload: a new index is built in the background and swapped in; requests
+  already running finish on the previous archives, which are released once
+  unused. Each swap bumps a generation counter
+- Lazy remote archives ("http" backend): only the index is downloaded at
+  startup, entries are fetched with Range requests when first requested and
+  kept in a local sparse cache file
+- Startup prewarm: hot entries read ahead into the page cache (and optionally
+  decoded into memory) in the background, from a manifest or the index
+- Access trace: archive paths recorded in the order they are first served, so
+  `packer_brotli.py repack` can lay the archive out in that order
 """
 
+import asyncio
+import mmap
 import os
+import re
 import sys
-from typing import Optional
+import time
+from typing import Dict, List, Optional, Set, TextIO, Tuple, Union
 from urllib.parse import urlparse
 
+import aiofiles
 import httpx
-import brotli
 from fastapi import Request
 from fastapi.responses import Response, StreamingResponse
 
 # Import PackedArchive from utils
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'utils'))
-from utils.packer_brotli import PackedArchive
+from utils.packer_brotli import (
+    ArchiveOverlay, DecodedEntryCache, PackedArchive, RemoteArchiveReader, default_prewarm_paths, read_access_trace,
+    read_archive_index, remote_cache_name,
+)
+from additions.ranges import bytes_reader, range_response
 
-# Global archive instance (initialized by init_packed_archive)
-_archive: Optional[PackedArchive] = None
+# Global archive layers (initialized by init_packed_archive, replaced by reload_packed_archive)
+_archive: Optional[ArchiveOverlay] = None
+
+# What reload_packed_archive() rebuilds from
+_archive_paths: List[str] = []
+_backend = "mmap"
+_decoded_cache: Optional[DecodedEntryCache] = None
+
+# Incremented every time a (re)loaded set of archives is swapped in
+_generation = 0
+_reload_lock = asyncio.Lock()
+_last_reload: Optional[dict] = None
+
+# Browsers keep archive files but revalidate them (If-None-Match -> 304) on use
+CACHE_CONTROL = "no-cache"
+
+# Archive downloads: attempts before giving up (each resumes the previous one)
+DOWNLOAD_ATTEMPTS = 5
+
+# Background download of archives given as URLs (see init_packed_archive)
+_download_task: Optional[asyncio.Task] = None
+_download_status: Optional[dict] = None
+# Indexes read while verifying downloads, by archive path; the next load uses them instead of reading again
+_verified_indexes: Dict[str, Tuple[list, list]] = {}
+
+# Last prewarm (see prewarm_packed_archive), reported by get_stats()
+_prewarm_status: Optional[dict] = None
+
+# Access trace (see start_access_trace): archive paths in first-served order
+_trace_file: Optional[TextIO] = None
+_trace_path: Optional[str] = None
+_traced_paths: Set[str] = set()
 
 
 def _is_url(path: str) -> bool:
@@ -43,46 +102,166 @@ def _get_filename_from_url(url: str) -> str:
     return filename
 
 
-async def _download_file(url: str, dest_path: str) -> bool:
+def _new_download_status(url: str, dest_path: str) -> dict:
+    """Progress record of an archive download, as reported by get_stats()."""
+    return {
+        "state": "downloading",  # "downloading", "verifying", "complete" or "failed"
+        "url": url,
+        "path": dest_path,
+        "bytes": 0,
+        "total": None,
+        "percent": None,
+        "attempts": 0,
+        "error": None,
+    }
+
+
+async def _download_attempt(client: httpx.AsyncClient, url: str, part_path: str, status: dict) -> bool:
+    """
+    Download (the rest of) a file into part_path.
+    
+    An existing part file is continued with a Range request; If-Range makes
+    the server send the whole file instead if it changed since the part was
+    started (its validator is kept in "<part>.validator").
+    
+    Returns:
+        True once part_path holds the whole file
+    """
+    validator_path = part_path + ".validator"
+    offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+    headers = {}
+    if offset > 0 and os.path.isfile(validator_path):
+        async with aiofiles.open(validator_path, "r", encoding="utf-8") as f:
+            headers["If-Range"] = (await f.read()).strip()
+        headers["Range"] = f"bytes={offset}-"
+    else:
+        offset = 0
+    
+    async with client.stream("GET", url, headers=headers) as response:
+        if response.status_code == 416 and offset > 0:
+            # Nothing left past the part: it is complete if it has the full size
+            total = response.headers.get("content-range", "").rpartition("/")[2]
+            status["total"] = int(total) if total.isdigit() else None
+            return status["total"] == offset
+        response.raise_for_status()
+        
+        if response.status_code == 206:
+            total = response.headers.get("content-range", "").rpartition("/")[2]
+            total_size = int(total) if total.isdigit() else None
+            mode = "ab"
+        else:
+            # Full response: new download, or the file changed since the part was started
+            content_length = response.headers.get("content-length")
+            total_size = int(content_length) if content_length else None
+            offset = 0
+            mode = "wb"
+        
+        validator = response.headers.get("etag")
+        if validator is None or validator.startswith("W/"):
+            validator = response.headers.get("last-modified")
+        if validator is not None:
+            async with aiofiles.open(validator_path, "w", encoding="utf-8") as f:
+                await f.write(validator)
+        
+        status["bytes"], status["total"] = offset, total_size
+        if offset > 0:
+            print(f"  Resuming at {offset / 1024 / 1024:.1f} MB")
+        next_report = 0
+        async with aiofiles.open(part_path, mode) as f:
+            async for chunk in response.aiter_bytes(65536):
+                await f.write(chunk)
+                status["bytes"] += len(chunk)
+                if total_size:
+                    status["percent"] = round(status["bytes"] / total_size * 100, 1)
+                    if status["percent"] >= next_report:
+                        print(f"  Downloaded: {status['bytes'] / 1024 / 1024:.1f} MB ({status['percent']:.1f}%)")
+                        next_report = int(status["percent"]) // 10 * 10 + 10
+    
+    # Check the final size: a dropped connection can end the body early
+    return total_size is None or status["bytes"] == total_size
+
+
+def _read_archive_file_index(path: str) -> Tuple[list, list]:
     """
-    Download a file from URL to destination path.
+    (folders, entries) of an archive file; raises if it isn't a readable archive.
+    
+    Blocking (a v1 archive is scanned whole): run it in an executor.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return [], []
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            _, folders, entries = read_archive_index(data)
+    return folders, entries
+
+
+async def _download_file(url: str, dest_path: str, status: Optional[dict] = None) -> bool:
+    """
+    Download an archive from URL to destination path.
+    
+    The data goes to "<dest_path>.part", which is resumed with Range requests
+    after a failed attempt (up to DOWNLOAD_ATTEMPTS, with backoff) or a restart,
+    and renamed to dest_path once it has the announced size and its index
+    can be read. That index is kept for the load that follows (see
+    _make_overlay), so the archive isn't read (or, for v1, scanned) twice.
     
     Args:
         url: URL to download from
         dest_path: Local path to save the file
+        status: Progress record (see _new_download_status) updated as it goes
         
     Returns:
         True if download succeeded, False otherwise
     """
+    if status is None:
+        status = _new_download_status(url, dest_path)
+    part_path = dest_path + ".part"
     print(f"Downloading archive from {url}...")
-    try:
-        async with httpx.AsyncClient(timeout=httpx.Timeout(300.0), follow_redirects=True) as client:
-            async with client.stream('GET', url) as response:
-                response.raise_for_status()
-                
-                content_length = response.headers.get('content-length')
-                total_size = int(content_length) if content_length else 0
-                downloaded = 0
-                
-                with open(dest_path, 'wb') as f:
-                    async for chunk in response.aiter_bytes(65536):
-                        f.write(chunk)
-                        downloaded += len(chunk)
-                        if total_size > 0:
-                            percent = (downloaded / total_size) * 100
-                            print(f"\r  Downloaded: {downloaded / 1024 / 1024:.1f} MB ({percent:.1f}%)", end="", flush=True)
-                        else:
-                            print(f"\r  Downloaded: {downloaded / 1024 / 1024:.1f} MB", end="", flush=True)
-                
-                print()  # New line after download complete
-                print(f"  Saved to: {dest_path}")
-                return True
-    except httpx.HTTPStatusError as e:
-        print(f"Failed to download: HTTP {e.response.status_code}")
+    complete = False
+    async with httpx.AsyncClient(timeout=httpx.Timeout(300.0), follow_redirects=True) as client:
+        while status["attempts"] < DOWNLOAD_ATTEMPTS:
+            status["attempts"] += 1
+            try:
+                if await _download_attempt(client, url, part_path, status):
+                    complete = True
+                    break
+                status["error"] = f"Incomplete download: {status['bytes']} of {status['total']} bytes"
+            except httpx.HTTPStatusError as e:
+                status["error"] = f"HTTP {e.response.status_code}"
+                if e.response.status_code < 500:
+                    # Client errors won't go away by retrying
+                    break
+            except (httpx.HTTPError, OSError) as e:
+                status["error"] = str(e) or type(e).__name__
+            print(f"  Download attempt {status['attempts']} failed: {status['error']}")
+            if status["attempts"] < DOWNLOAD_ATTEMPTS:
+                await asyncio.sleep(min(2 ** status["attempts"], 60))
+    
+    if not complete:
+        status["state"] = "failed"
+        print(f"Failed to download: {status['error']}")
         return False
+    
+    # A complete download must also be a readable archive
+    status["state"] = "verifying"
+    try:
+        index = await asyncio.get_running_loop().run_in_executor(None, _read_archive_file_index, part_path)
     except Exception as e:
-        print(f"Error downloading file: {e}")
+        status["state"] = "failed"
+        status["error"] = f"Downloaded file is not a valid archive: {e}"
+        print(f"Failed to download: {status['error']}")
+        os.remove(part_path)
+        if os.path.isfile(part_path + ".validator"):
+            os.remove(part_path + ".validator")
         return False
+    
+    os.replace(part_path, dest_path)
+    if os.path.isfile(part_path + ".validator"):
+        os.remove(part_path + ".validator")
+    _verified_indexes[dest_path] = index
+    status["error"] = None
+    print(f"  Saved to: {dest_path}")
+    return True
 
 
 async def resolve_packed_source(source: str) -> Optional[str]:
@@ -124,45 +303,373 @@ async def resolve_packed_source(source: str) -> Optional[str]:
     return None
 
 
-async def init_packed_archive(source: str) -> Optional[PackedArchive]:
+async def init_packed_archive(sources: Union[str, List[str]], backend: str = "mmap",
+                              cache_mb: int = 0, background_download: bool = False) -> Optional[ArchiveOverlay]:
     """
-    Initialize the packed archive.
+    Initialize the packed archive layers.
     Must be called before using get_packed_file().
     
     Supports both local file paths and URLs.
-    If a URL is provided, the file will be downloaded if not present locally.
+    If a URL is provided, the file will be downloaded if not present locally,
+    except with the "http" backend, which reads the archive from the URL
+    on demand (only the index is downloaded here).
     
     Args:
-        source: Path to the .bin archive file or URL to download from
+        sources: Path to the .bin archive file or URL to download from, or a
+                 list of them, base archive first: for every path, the last
+                 archive holding it is the one served
+        backend: PackedArchive read backend ("mmap", "pread", "aiofiles" or "http")
+        cache_mb: Budget in MB of the decoded entry cache shared by all
+                  archives (0 disables it)
+        background_download: Download missing archives in a background task
+                             (progress in get_stats()) and load them when
+                             done, instead of waiting for them
         
     Returns:
-        Initialized PackedArchive instance, or None if failed
+        Initialized ArchiveOverlay instance, or None if failed or still
+        downloading (see is_downloading())
     """
-    global _archive
+    global _archive, _archive_paths, _backend, _decoded_cache, _generation
     
-    # Resolve source to local path (download if needed)
-    archive_path = await resolve_packed_source(source)
-    if archive_path is None:
-        print(f"Failed to resolve packed archive source: {source}")
-        return None
+    if isinstance(sources, str):
+        sources = [sources]
     
-    if not os.path.isfile(archive_path):
-        print(f"Archive file not found: {archive_path}")
+    if background_download and backend != "http" and _missing_downloads(sources):
+        # Don't hold up startup: requests are proxied upstream until the
+        # archives are downloaded, verified and loaded
+        _start_background_download(sources, backend, cache_mb)
         return None
     
-    _archive = PackedArchive(archive_path)
-    await _archive.init()
-    print(f"Loaded packed archive: {archive_path}")
-    print(f"  Folders: {len(_archive.list_folders())}")
-    print(f"  Files: {len(_archive.list_files())}")
+    archive_paths = []
+    for source in sources:
+        if backend == "http":
+            if not _is_url(source):
+                print(f"The http backend needs an archive URL, got: {source}")
+                return None
+            if _archive is None:
+                _remove_generation_caches(source)
+            archive_paths.append(source)
+            continue
+        
+        # Resolve source to local path (download if needed)
+        archive_path = await resolve_packed_source(source)
+        if archive_path is None:
+            print(f"Failed to resolve packed archive source: {source}")
+            return None
+        
+        if not os.path.isfile(archive_path):
+            print(f"Archive file not found: {archive_path}")
+            return None
+        archive_paths.append(archive_path)
+    
+    decoded_cache = DecodedEntryCache(cache_mb * 1024 * 1024) if cache_mb > 0 else None
+    overlay = _make_overlay(archive_paths, backend, decoded_cache)
+    try:
+        await overlay.init()
+    except Exception as e:
+        print(f"Failed to load packed archive: {e}")
+        return None
+    layers = overlay.layers
+    for layer, archive in enumerate(layers):
+        print(f"Loaded packed archive: {archive.path}" + (f" (layer {layer})" if len(layers) > 1 else ""))
+        print(f"  Folders: {len(archive.list_folders())}")
+        print(f"  Files: {archive.file_count()}")
+        print(f"  Index: {archive.index_source}")
+    if len(layers) > 1:
+        print(f"Merged index: {overlay.file_count()} files")
+    print(f"  Backend: {backend}")
+    if cache_mb > 0:
+        print(f"  Decoded cache: {cache_mb} MB")
+    _archive_paths, _backend, _decoded_cache = archive_paths, backend, decoded_cache
+    _archive = overlay
+    _generation += 1
     return _archive
 
 
-def get_archive() -> Optional[PackedArchive]:
-    """Get the global archive instance."""
+def _remove_generation_caches(url: str) -> None:
+    """Delete the caches left by reloads of a previous run (see remote_cache_name())."""
+    pattern = re.compile(re.escape(remote_cache_name(url)[:-len('.cache')]) + r'\.\d+\.cache(\.chunks)?$')
+    for name in os.listdir('.'):
+        if pattern.match(name):
+            try:
+                os.remove(name)
+            except OSError:
+                pass
+
+
+def _missing_downloads(sources: List[str]) -> List[str]:
+    """Archive URLs whose file isn't in the current directory yet."""
+    missing = []
+    for source in sources:
+        if _is_url(source):
+            local_path = _get_filename_from_url(source)
+            if not (os.path.isfile(local_path) and os.path.getsize(local_path) > 0):
+                missing.append(source)
+    return missing
+
+
+def _start_background_download(sources: List[str], backend: str, cache_mb: int) -> None:
+    """Download the missing archives, then load all of them, without waiting."""
+    global _download_task
+    
+    async def download_and_load():
+        global _download_status
+        for url in _missing_downloads(sources):
+            _download_status = _new_download_status(url, _get_filename_from_url(url))
+            if not await _download_file(url, _download_status["path"], _download_status):
+                print("Packed archive unavailable; requests keep going to the upstream servers")
+                return
+        # Another process may have finished the downloads meanwhile: then there is no status
+        if await init_packed_archive(sources, backend=backend, cache_mb=cache_mb) is None:
+            if _download_status is not None:
+                _download_status["state"] = "failed"
+                _download_status["error"] = "Archive could not be loaded"
+            return
+        if _download_status is not None:
+            _download_status["state"] = "complete"
+        print("Packed archive ready; now serving from it")
+    
+    print("Archive download started in the background; requests go to the upstream servers until it is ready")
+    _download_task = asyncio.create_task(download_and_load())
+
+
+def is_downloading() -> bool:
+    """Check if archives are being downloaded in the background."""
+    return _download_task is not None and not _download_task.done()
+
+
+def _make_overlay(archive_paths: List[str], backend: str,
+                  decoded_cache: Optional[DecodedEntryCache]) -> ArchiveOverlay:
+    """Layer (not yet initialized) archives over each other, sharing the decoded cache."""
+    layers = [PackedArchive(archive_path, backend=backend, decoded_cache=decoded_cache,
+                            index=_verified_indexes.pop(archive_path, None) if backend != "http" else None)
+              for archive_path in archive_paths]
+    return ArchiveOverlay(layers, decoded_cache=decoded_cache)
+
+
+async def _load_next_overlay() -> Tuple[ArchiveOverlay, List[RemoteArchiveReader]]:
+    """
+    Open and index the archives again, for reload_packed_archive().
+    
+    Local archives are indexed on a worker thread. Remote archives that are
+    unchanged keep their reader (and cache) in the new generation; the new
+    generation of a replaced one caches into files of its own.
+    
+    Returns:
+        The initialized overlay, and the readers of replaced remote archives
+    """
+    if _backend != "http":
+        overlay = _make_overlay(_archive_paths, _backend, _decoded_cache)
+        # Index parsing is blocking work; keep the event loop serving
+        await asyncio.get_running_loop().run_in_executor(None, overlay.load)
+        return overlay, []
+    
+    layers = []
+    replaced = []
+    for archive in _archive.layers:
+        remote = archive.remote_reader
+        if await remote.is_current():
+            layers.append(PackedArchive(archive.path, backend=_backend, decoded_cache=_decoded_cache, remote=remote))
+        else:
+            layers.append(PackedArchive(archive.path, backend=_backend, decoded_cache=_decoded_cache,
+                                        remote_cache_path=remote_cache_name(archive.path, _generation + 1)))
+            replaced.append(remote)
+    overlay = ArchiveOverlay(layers, decoded_cache=_decoded_cache)
+    await overlay.init()
+    return overlay, replaced
+
+
+async def reload_packed_archive() -> dict:
+    """
+    Re-read the archive files and swap the new index in.
+    
+    The new archives are opened and indexed on a worker thread (remote
+    archives: their index fetched again if they changed), so requests keep
+    being served meanwhile. The swap is a single assignment: requests
+    that already looked up a file keep reading the previous archives (and
+    their mapping), which are released once the last of them is done. If
+    loading fails, the previous archives stay in service.
+    
+    Archive files should be replaced by renaming a complete file over them;
+    rewriting a file in place changes it under the previous mapping.
+    
+    Concurrent reloads are serialized.
+    
+    Returns:
+        Dict with "reloaded", "generation", "files" and "seconds", or
+        "error" if the archives couldn't be loaded
+    """
+    global _archive, _generation, _last_reload
+    
+    if not is_initialized():
+        return {"reloaded": False, "generation": _generation, "error": "Packed archive not initialized"}
+    
+    async with _reload_lock:
+        start = time.monotonic()
+        print(f"Reloading packed archive: {', '.join(_archive_paths)}")
+        try:
+            overlay, replaced = await _load_next_overlay()
+        except Exception as e:
+            print(f"Failed to reload packed archive: {e}")
+            _last_reload = {"reloaded": False, "generation": _generation, "error": str(e)}
+            return _last_reload
+        
+        # The previous overlay isn't closed: requests may still be reading it
+        _archive = overlay
+        _generation += 1
+        # Cache files of replaced remote archives go once their last reader is released
+        for remote in replaced:
+            remote.discard_cache()
+        _last_reload = {
+            "reloaded": True,
+            "generation": _generation,
+            "files": overlay.file_count(),
+            "seconds": round(time.monotonic() - start, 3),
+        }
+        print(f"Reloaded packed archive: generation {_generation}, {_last_reload['files']} files "
+              f"in {_last_reload['seconds']}s")
+        return _last_reload
+
+
+def _archive_signature() -> List[tuple]:
+    """(size, mtime) of every archive file, None for a missing one."""
+    signature = []
+    for archive_path in _archive_paths:
+        try:
+            st = os.stat(archive_path)
+            signature.append((st.st_size, st.st_mtime_ns))
+        except OSError:
+            signature.append(None)
+    return signature
+
+
+async def watch_packed_archive(interval: float) -> None:
+    """
+    Reload the archives whenever one of their files changes.
+    
+    A change is acted upon once the files have stayed the same for a whole
+    interval (and all exist), so an archive being copied isn't loaded half written.
+    
+    Args:
+        interval: Seconds between checks of the files
+    """
+    # Archives being downloaded are watched once loaded
+    while not is_initialized():
+        await asyncio.sleep(interval)
+    loaded = _archive_signature()
+    seen = loaded
+    while True:
+        await asyncio.sleep(interval)
+        current = _archive_signature()
+        if current != loaded and current == seen and None not in current:
+            await reload_packed_archive()
+            loaded = current
+        seen = current
+
+
+async def prewarm_packed_archive(manifest: Optional[str] = None, decode: bool = False) -> Optional[dict]:
+    """
+    Read hot archive entries ahead so the first players after a restart don't
+    wait on a cold page cache. Meant to run as a background task.
+    
+    Args:
+        manifest: File listing the paths to prewarm, one per line (an access
+                  trace works); None selects the files every game start
+                  requests from the index (.wasm.br, .data.br, sha256sums.txt)
+        decode: Also decode the entries into the decoded entry cache, for
+                clients without brotli support
+    
+    Returns:
+        Prewarm status (also in get_stats()), or None if no archive is loaded
+    """
+    global _prewarm_status
+    if not is_initialized():
+        print("Prewarm skipped: no packed archive loaded")
+        return None
+    archive = _archive
+    
+    try:
+        paths = read_access_trace(manifest) if manifest else default_prewarm_paths(archive.list_files())
+    except OSError as e:
+        print(f"Prewarm failed: {e}")
+        _prewarm_status = {"state": "failed", "manifest": manifest, "error": str(e)}
+        return _prewarm_status
+    
+    if decode and _decoded_cache is None:
+        print("Prewarm: the decoded entry cache is disabled, entries are only read ahead")
+        decode = False
+    _prewarm_status = {"state": "running", "manifest": manifest, "paths": len(paths), "decode": decode}
+    start = time.monotonic()
+    try:
+        counts = await archive.prewarm(paths, decode=decode)
+    except Exception as e:
+        print(f"Prewarm failed: {e}")
+        _prewarm_status.update(state="failed", error=str(e), seconds=round(time.monotonic() - start, 3))
+        return _prewarm_status
+    
+    elapsed = time.monotonic() - start
+    _prewarm_status.update(state="done", seconds=round(elapsed, 3), **counts)
+    decoded = f", {counts['decoded']} decoded" if decode else ""
+    missing = f"; {counts['missing']} paths not in the archive" if counts["missing"] else ""
+    print(f"Prewarmed {counts['entries']} archive entries ({counts['bytes'] / 1024 / 1024:.1f} MB in "
+          f"{counts['regions']} regions{decoded}) in {elapsed:.2f}s{missing}")
+    return _prewarm_status
+
+
+def start_access_trace(trace_path: str) -> None:
+    """
+    Record archive paths to trace_path in the order they are first served.
+    
+    An existing trace is appended to and its paths keep their place, so
+    several sessions (e.g. boots on different machines) can be recorded into
+    one trace for `packer_brotli.py repack`.
+    """
+    global _trace_file, _trace_path
+    _traced_paths.clear()
+    if os.path.isfile(trace_path):
+        _traced_paths.update(read_access_trace(trace_path))
+    if _trace_file is not None:
+        _trace_file.close()
+    _trace_file = open(trace_path, "a", encoding="utf-8")
+    _trace_path = trace_path
+    print(f"Recording archive access trace to {trace_path} ({len(_traced_paths)} paths already traced)")
+
+
+def _record_access(path: str) -> None:
+    """Append a path served for the first time to the access trace."""
+    _traced_paths.add(path)
+    try:
+        _trace_file.write(path + "\n")
+        _trace_file.flush()
+    except OSError as e:
+        print(f"Error writing access trace: {e}")
+
+
+def get_archive() -> Optional[ArchiveOverlay]:
+    """Get the global archive layers."""
     return _archive
 
 
+def get_stats() -> dict:
+    """
+    Get archive and reader metrics for the status endpoint.
+    
+    Returns:
+        Dict with the merged and per-archive stats, or {"initialized": False};
+        plus "download", the progress of a background download, "prewarm",
+        the startup prewarm, and "trace", the access trace being recorded, if any
+    """
+    extra = {"download": _download_status} if _download_status is not None else {}
+    if _prewarm_status is not None:
+        extra["prewarm"] = _prewarm_status
+    if _trace_file is not None:
+        extra["trace"] = {"path": _trace_path, "paths": len(_traced_paths)}
+    if not is_initialized():
+        return {"initialized": False, **extra}
+    return {"initialized": True, "generation": _generation, "last_reload": _last_reload, **extra,
+            **_archive.stats()}
+
+
 def is_initialized() -> bool:
     """Check if the archive is initialized."""
     return _archive is not None and _archive._initialized
@@ -174,20 +681,94 @@ def _client_accepts_brotli(request: Request) -> bool:
     return "br" in accept_encoding.lower()
 
 
-def _get_response_headers(use_brotli: bool, media_type: str) -> dict:
-    """Get response headers, optionally with brotli encoding."""
+def _get_response_headers(use_brotli: bool, media_type: str, etag: Optional[str] = None) -> dict:
+    """Get response headers, optionally with brotli encoding and validators."""
     headers = {
         "Cross-Origin-Opener-Policy": "same-origin",
         "Cross-Origin-Embedder-Policy": "require-corp",
-        "Content-Type": media_type
+        "Content-Type": media_type,
+        "Accept-Ranges": "bytes",
+        "Vary": "Accept-Encoding"
     }
     
     if use_brotli:
         headers["Content-Encoding"] = "br"
     
+    if etag is not None:
+        headers["ETag"] = etag
+        headers["Cache-Control"] = CACHE_CONTROL
+    
     return headers
 
 
+def _make_etag(digest: bytes, use_brotli: bool) -> str:
+    """
+    Strong ETag for a file's content digest.
+    
+    The brotli-encoded and the plain representation are different bytes, so
+    they get different tags.
+    """
+    return f'"{digest.hex()}-br"' if use_brotli else f'"{digest.hex()}"'
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    """Check If-None-Match against an ETag (weak comparison, as for GET/HEAD)."""
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def _not_modified_response(headers: dict) -> Response:
+    """304 response carrying the validators and caching headers of the full response."""
+    keep = ("ETag", "Cache-Control", "Vary", "Cross-Origin-Opener-Policy", "Cross-Origin-Embedder-Policy",
+            "X-Packed-Layer")
+    return Response(status_code=304, headers={k: v for k, v in headers.items() if k in keep})
+
+
+async def _select_representation(archive: PackedArchive, path: str, request: Request) -> tuple:
+    """
+    Choose how a file is sent and compute its validators.
+    
+    Brotli clients get .br files as stored and regular files in the archive's
+    brotli compression, except for block-compressed files (several brotli
+    streams), files stored uncompressed or zstd-compressed (no brotli stream)
+    and Range requests on regular files (ranges of the decoded content are
+    what the client can use). Everyone else gets decoded content.
+    
+    Args:
+        archive: Layer holding the file
+    
+    Returns:
+        (use_brotli, headers) - headers include the representation's ETag and
+        the name of the layer
+    """
+    ranged = "range" in request.headers
+    use_brotli = (_client_accepts_brotli(request) and not archive.is_block_compressed(path)
+                  and not archive.is_stored_uncompressed(path) and not archive.is_zstd_compressed(path)
+                  and (_is_br_file(path) or not ranged))
+    etag = _make_etag(await archive.entry_digest(path), use_brotli)
+    headers = _get_response_headers(use_brotli=use_brotli, media_type=_get_media_type(path), etag=etag)
+    headers["X-Packed-Layer"] = os.path.basename(archive.path)
+    return use_brotli, headers
+
+
+def _find_layer(path: str) -> Optional[PackedArchive]:
+    """Look up the layer serving a path in the merged index and count the request."""
+    found = _archive.find(path)
+    if found is None:
+        return None
+    layer, archive = found
+    _archive.record_served(layer)
+    if _trace_file is not None and path not in _traced_paths:
+        _record_access(path)
+    return archive
+
+
 def _is_br_file(path: str) -> bool:
     """Check if the file is a .br (pre-compressed brotli) file."""
     return path.lower().endswith(".br")
@@ -244,6 +825,42 @@ def _get_media_type(path: str) -> str:
     return "application/octet-stream"
 
 
+async def _get_packed_range(archive: PackedArchive, path: str, request: Request, use_brotli: bool,
+                            headers: dict) -> Optional[Response]:
+    """
+    Answer a Range request for a file in the archive.
+    
+    Ranges of a .br file requested by a brotli client cover the stored .br
+    bytes (sent with Content-Encoding: br). All other ranges cover the decoded
+    content, sent without encoding: ranges of the archive's own brotli stream
+    would be useless to the client. Block-compressed files only decode the
+    blocks covering the requested ranges; files stored uncompressed are read
+    for just those ranges.
+    
+    Args:
+        archive: Layer holding the file
+        use_brotli, headers: Representation chosen by _select_representation()
+    
+    Returns:
+        206/416 response, or None if the request has no usable Range
+    """
+    if "range" not in request.headers:
+        return None
+    
+    etag = headers.get("ETag")
+    if use_brotli:
+        async with archive.open(path, keep_brotli=True) as f:
+            data = f.data
+        return await range_response(request, len(data), bytes_reader(data), headers, etag=etag)
+    
+    size = archive.decoded_size(path)
+    if size is not None:
+        return await range_response(request, size, lambda start, end: archive.iter_decoded(path, start, end),
+                                    headers, etag=etag)
+    data = await archive.read_decoded(path)
+    return await range_response(request, len(data), bytes_reader(data), headers, etag=etag)
+
+
 async def get_packed_file(path: str, request: Request) -> Optional[Response]:
     """
     Get a file from the packed archive.
@@ -251,6 +868,7 @@ async def get_packed_file(path: str, request: Request) -> Optional[Response]:
     How .br files work:
     - .br files are stored in the archive WITHOUT additional brotli compression
     - archive.open(path) returns the raw .br file content (already brotli-compressed)
+      as a memoryview into the archive mapping, so passthrough doesn't copy it
     - If client accepts br: send .br data with Content-Encoding: br
     - If client doesn't accept br: decompress .br data and send plain
     
@@ -259,6 +877,29 @@ async def get_packed_file(path: str, request: Request) -> Optional[Response]:
     - If client accepts br: keep_brotli=True returns compressed data, send with Content-Encoding: br
     - If client doesn't accept br: keep_brotli=False decompresses, send plain
     
+    How block-compressed files work:
+    - Large files packed with --block-size are stored as independent brotli blocks,
+      which can't be sent as one Content-Encoding: br body
+    - They are sent plain to every client, streamed block by block as decoded
+    
+    How files stored uncompressed work:
+    - Files brotli barely shrinks (JPEG, MP3/OGG, ...) are stored as they are
+    - They are sent plain to every client, straight from the archive
+    
+    How zstd-compressed files work:
+    - Files packed with --codec zstd are stored as one zstd frame, which
+      decodes several times faster than brotli
+    - They are sent plain to every client, decoded (and cached) server-side
+    
+    Range requests are answered with 206 Partial Content (see _get_packed_range).
+    
+    Every response carries a strong ETag derived from the content digest in the
+    archive index; a matching If-None-Match is answered with 304 Not Modified
+    without reading the file.
+    
+    With several archive layers, the file comes from the last layer holding it
+    (one lookup in the merged index) and X-Packed-Layer names that archive.
+    
     Args:
         path: Path to the file inside the archive (e.g., "vcsky/fetched/model.txd")
         request: FastAPI request object to check Accept-Encoding header
@@ -269,47 +910,33 @@ async def get_packed_file(path: str, request: Request) -> Optional[Response]:
     if not is_initialized():
         return None
     
-    # Check if file exists in archive
-    if not _archive.exists(path):
+    # Find the layer holding the file
+    archive = _find_layer(path)
+    if archive is None:
         return None
     
-    # Check if client accepts brotli
-    client_accepts_br = _client_accepts_brotli(request)
-    
-    # Check if file is a .br file
-    is_br_file = _is_br_file(path)
-    
-    # Get media type based on file extension
-    media_type = _get_media_type(path)
-    
     try:
-        if is_br_file:
-            # .br files are stored as-is (no archive compression)
-            # archive.open() returns the raw .br content
-            async with _archive.open(path, keep_brotli=False) as f:
-                br_data = f.read()
-            
-            if client_accepts_br:
-                # Send the .br data with Content-Encoding: br
-                headers = _get_response_headers(use_brotli=True, media_type=media_type)
-                return Response(content=br_data, headers=headers)
-            else:
-                # Decompress .br for client
-                decompressed_data = brotli.decompress(br_data)
-                headers = _get_response_headers(use_brotli=False, media_type=media_type)
-                return Response(content=decompressed_data, headers=headers)
+        use_brotli, headers = await _select_representation(archive, path, request)
+        if _etag_matches(request, headers["ETag"]):
+            return _not_modified_response(headers)
+        
+        if response := await _get_packed_range(archive, path, request, use_brotli, headers):
+            return response
+        
+        if archive.is_block_compressed(path):
+            headers["Content-Length"] = str(archive.decoded_size(path))
+            return StreamingResponse(archive.iter_decoded(path), headers=headers)
+        
+        if use_brotli:
+            # .br files: stored as-is, open() returns the raw .br content
+            # Regular files: keep_brotli=True returns the archive's compressed data
+            async with archive.open(path, keep_brotli=True) as f:
+                data = f.read()
         else:
-            # Regular files: use archive's brotli compression
-            if client_accepts_br:
-                async with _archive.open(path, keep_brotli=True) as f:
-                    data = f.read()
-                headers = _get_response_headers(use_brotli=True, media_type=media_type)
-            else:
-                async with _archive.open(path, keep_brotli=False) as f:
-                    data = f.read()
-                headers = _get_response_headers(use_brotli=False, media_type=media_type)
-            
-            return Response(content=data, headers=headers)
+            # Decompress for client (.br files too; cached by the archive)
+            data = await archive.read_decoded(path)
+        
+        return Response(content=data, headers=headers)
     except FileNotFoundError:
         return None
     except Exception as e:
@@ -317,55 +944,59 @@ async def get_packed_file(path: str, request: Request) -> Optional[Response]:
         return None
 
 
-async def get_packed_file_streaming(path: str, request: Request, chunk_size: int = 65536) -> Optional[StreamingResponse]:
+async def get_packed_file_streaming(path: str, request: Request, chunk_size: int = 65536) -> Optional[Response]:
     """
     Get a file from the packed archive as a streaming response.
     
     Args:
         path: Path to the file inside the archive
-        request: FastAPI request object to check Accept-Encoding header
+        request: FastAPI request object to check Accept-Encoding and Range headers
         chunk_size: Size of chunks for streaming (default: 64KB)
         
     Returns:
-        StreamingResponse with file data, or None if file not found
+        StreamingResponse with file data (206/416 for Range requests), or None
+        if file not found
     """
     if not is_initialized():
         return None
     
-    if not _archive.exists(path):
+    archive = _find_layer(path)
+    if archive is None:
         return None
     
-    client_accepts_br = _client_accepts_brotli(request)
-    is_br = _is_br_file(path)
-    media_type = _get_media_type(path)
+    try:
+        use_brotli, headers = await _select_representation(archive, path, request)
+        if _etag_matches(request, headers["ETag"]):
+            return _not_modified_response(headers)
+        if response := await _get_packed_range(archive, path, request, use_brotli, headers):
+            return response
+    except Exception as e:
+        print(f"Error reading file from archive: {path} - {e}")
+        return None
+    
+    block_compressed = archive.is_block_compressed(path)
     
     async def generate():
         try:
-            if is_br:
+            if block_compressed:
+                # Output starts as soon as the first block is decoded
+                async for block in archive.iter_decoded(path):
+                    for i in range(0, len(block), chunk_size):
+                        yield block[i:i + chunk_size]
+                return
+            if use_brotli:
                 # .br file: stored as-is, open returns raw .br data
-                async with _archive.open(path, keep_brotli=False) as f:
-                    br_data = f.data
-                
-                if client_accepts_br:
-                    # Send .br data directly
-                    for i in range(0, len(br_data), chunk_size):
-                        yield br_data[i:i + chunk_size]
-                else:
-                    # Decompress for client
-                    decompressed_data = brotli.decompress(br_data)
-                    for i in range(0, len(decompressed_data), chunk_size):
-                        yield decompressed_data[i:i + chunk_size]
-            else:
-                # Regular file
-                async with _archive.open(path, keep_brotli=client_accepts_br) as f:
+                # Regular file: keep the archive's brotli compression
+                async with archive.open(path, keep_brotli=True) as f:
                     data = f.data
-                    for i in range(0, len(data), chunk_size):
-                        yield data[i:i + chunk_size]
+            else:
+                # Decompress for client (cached by the archive)
+                data = await archive.read_decoded(path)
+            for i in range(0, len(data), chunk_size):
+                yield data[i:i + chunk_size]
         except Exception as e:
             print(f"Error streaming file from archive: {path} - {e}")
     
-    headers = _get_response_headers(use_brotli=client_accepts_br, media_type=media_type)
-    
     return StreamingResponse(generate(), headers=headers)
 
 
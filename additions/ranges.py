@@ -0,0 +1,193 @@
+"""
+HTTP Range request support (RFC 9110, section 14) for responses whose body
+is read from memory or from a packed archive.
+
+Provides:
+- Parsing of "Range: bytes=..." headers, including suffix and open-ended ranges
+- If-Range validation
+- 206 Partial Content responses for a single range
+- multipart/byteranges responses for several ranges
+- 416 Range Not Satisfiable responses
+
+Files on disk don't need this module: Starlette's FileResponse answers Range
+requests by itself.
+"""
+
+import secrets
+from typing import AsyncIterator, Callable, List, Optional, Tuple, Union
+
+from fastapi import Request
+from fastapi.responses import Response, StreamingResponse
+
+# Requests with more ranges than this are answered with the full body
+MAX_RANGES = 32
+
+# Reads the bytes [start, end) of the representation
+RangeReader = Callable[[int, int], AsyncIterator[bytes]]
+
+
+class RangeNotSatisfiable(Exception):
+    """None of the requested ranges overlaps the representation."""
+
+
+def parse_range_header(header: Optional[str], size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    Parse a Range header against a representation of the given size.
+
+    Overlapping or adjacent ranges are coalesced.
+
+    Args:
+        header: Value of the Range header (None if absent)
+        size: Size of the representation in bytes
+
+    Returns:
+        List of (start, end) byte ranges, end exclusive, in ascending order;
+        None if the header is absent, malformed, not in bytes or has too many
+        ranges, in which case it must be ignored
+
+    Raises:
+        RangeNotSatisfiable: If no range overlaps the representation
+    """
+    if not header:
+        return None
+    unit, sep, spec = header.partition("=")
+    if not sep or unit.strip().lower() != "bytes":
+        return None
+    specs = spec.split(",")
+    if len(specs) > MAX_RANGES:
+        return None
+
+    ranges: List[Tuple[int, int]] = []
+    for range_spec in specs:
+        range_spec = range_spec.strip()
+        if not range_spec:
+            continue
+        first, dash, last = range_spec.partition("-")
+        first, last = first.strip(), last.strip()
+        if not dash or (first and not first.isdigit()) or (last and not last.isdigit()):
+            return None
+        if not first:
+            # Suffix range: the last N bytes
+            if not last:
+                return None
+            start, end = max(size - int(last), 0), size
+        else:
+            start = int(first)
+            if last and int(last) < start:
+                return None
+            end = min(int(last) + 1, size) if last else size
+        if start < end:
+            ranges.append((start, end))
+
+    if not ranges:
+        raise RangeNotSatisfiable()
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def if_range_matches(request: Request, etag: Optional[str] = None, last_modified: Optional[str] = None) -> bool:
+    """
+    Check the If-Range precondition.
+
+    Returns:
+        True if the Range header should be honored: If-Range is absent, or it
+        names the current (strong) ETag or the exact Last-Modified date
+    """
+    if_range = request.headers.get("if-range")
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        # Weak validators never match for ranges
+        return etag is not None and not etag.startswith("W/") and if_range == etag
+    return last_modified is not None and if_range == last_modified
+
+
+def bytes_reader(data: Union[bytes, memoryview]) -> RangeReader:
+    """RangeReader over data already in memory (memoryviews are sliced without copying)."""
+    async def read(start: int, end: int) -> AsyncIterator[bytes]:
+        yield data[start:end]
+    return read
+
+
+def not_satisfiable_response(size: int, headers: Optional[dict] = None) -> Response:
+    """416 response telling the client the representation size."""
+    response_headers = {k: v for k, v in (headers or {}).items()
+                        if k.lower() not in ("content-type", "content-encoding", "content-length")}
+    response_headers["Content-Range"] = f"bytes */{size}"
+    return Response(status_code=416, headers=response_headers)
+
+
+async def range_response(request: Request, size: int, read: RangeReader, headers: dict,
+                         etag: Optional[str] = None, last_modified: Optional[str] = None) -> Optional[Response]:
+    """
+    Answer a Range request.
+
+    Args:
+        request: Request that may carry Range and If-Range headers
+        size: Size of the selected representation in bytes
+        read: Reader for byte ranges of the representation
+        headers: Headers of the full response (Content-Type, Content-Encoding, ...)
+        etag: ETag of the representation, for If-Range
+        last_modified: Last-Modified of the representation, for If-Range
+
+    Returns:
+        206 or 416 response, or None if the full representation should be sent
+        (no Range header, failed If-Range, ignorable Range)
+    """
+    if request.method not in ("GET", "HEAD"):
+        return None
+    header = request.headers.get("range")
+    if header is None or not if_range_matches(request, etag, last_modified):
+        return None
+    try:
+        ranges = parse_range_header(header, size)
+    except RangeNotSatisfiable:
+        return not_satisfiable_response(size, headers)
+    if ranges is None:
+        return None
+
+    response_headers = {k: v for k, v in headers.items() if k.lower() != "content-length"}
+    response_headers["Accept-Ranges"] = "bytes"
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        response_headers["Content-Range"] = f"bytes {start}-{end - 1}/{size}"
+        response_headers["Content-Length"] = str(end - start)
+        return StreamingResponse(read(start, end), status_code=206, headers=response_headers)
+
+    # Several ranges: multipart/byteranges body. A Content-Encoding would apply
+    # to the multipart body as a whole, so encoded representations are sent
+    # in full instead (ignoring Range is always allowed)
+    if any(k.lower() == "content-encoding" for k in headers):
+        return None
+    content_type = next((v for k, v in headers.items() if k.lower() == "content-type"), "application/octet-stream")
+    boundary = secrets.token_hex(16)
+    part_heads = [
+        (f"--{boundary}\r\nContent-Type: {content_type}\r\n"
+         f"Content-Range: bytes {start}-{end - 1}/{size}\r\n\r\n").encode("latin-1")
+        for start, end in ranges
+    ]
+    closing = f"--{boundary}--\r\n".encode("latin-1")
+    content_length = sum(len(head) + (end - start) + 2 for head, (start, end) in zip(part_heads, ranges)) + len(closing)
+
+    async def generate():
+        for head, (start, end) in zip(part_heads, ranges):
+            yield head
+            async for chunk in read(start, end):
+                yield chunk
+            yield b"\r\n"
+        yield closing
+
+    response_headers = {k: v for k, v in response_headers.items() if k.lower() != "content-type"}
+    response_headers["Content-Type"] = f"multipart/byteranges; boundary={boundary}"
+    response_headers["Content-Length"] = str(content_length)
+    return StreamingResponse(generate(), status_code=206, headers=response_headers)
@@ -0,0 +1,98 @@
+"""
+Tiered lookup of game assets for the /vcsky and /vcbr routes.
+
+A request is answered by the first tier that has the file:
+1. archive  - the packed archive (--packed): one lookup in its in-memory index
+2. local    - a local directory (--vcsky_local / --vcbr_local, or the folders
+              of --unpacked); in strict local mode a miss is a 404
+3. cache    - files saved earlier by the smart cache
+4. upstream - proxied from the CDN, and saved to the cache when it is enabled
+
+Hits are counted per tier, so /tiers/stats shows whether a deployment still
+depends on the network.
+"""
+
+import os
+from typing import Dict, Optional
+
+from fastapi import HTTPException, Request
+from fastapi.responses import Response
+
+from additions.cache import get_local_file, proxy_and_cache
+from additions.packed import get_packed_file, is_initialized as packed_is_initialized
+
+TIERS = ("archive", "local", "cache", "upstream")
+
+
+class AssetTiers:
+    """
+    Resolver of the files behind one route.
+
+    Usage:
+        vcsky = AssetTiers("vcsky", "https://cdn.dos.zone/vcsky/", cache_dir="vcsky")
+        response = await vcsky.resolve(request, "fetched/data/main.scm")
+        print(vcsky.stats())
+    """
+
+    def __init__(self, name: str, base_url: str, cache_dir: Optional[str] = None,
+                 local_dir: Optional[str] = None, strict_local: bool = False):
+        """
+        Args:
+            name: Route name, also the top folder of its files in the archive
+            base_url: Upstream URL the file paths are appended to
+            cache_dir: Smart cache directory (None: proxy without caching)
+            local_dir: Local directory of the files (None: no local tier)
+            strict_local: Answer 404 when a file isn't in local_dir instead of
+                          trying the cache and upstream
+        """
+        self.name = name
+        self.base_url = base_url
+        self.cache_dir = cache_dir
+        self.local_dir = local_dir
+        self.strict_local = strict_local
+        self.hits: Dict[str, int] = dict.fromkeys(TIERS + ("not_found",), 0)
+
+    async def resolve(self, request: Request, path: str) -> Response:
+        """
+        Answer a request for a file of the route from the first tier holding it.
+
+        Args:
+            request: Incoming request (only GET and HEAD are served from the archive)
+            path: File path below the route
+
+        Raises:
+            HTTPException: 404 if strict local mode doesn't have the file
+        """
+        if request.method in ("GET", "HEAD") and packed_is_initialized():
+            if response := await get_packed_file(f"{self.name}/{path}", request):
+                self.hits["archive"] += 1
+                return response
+
+        if self.local_dir:
+            if response := get_local_file(os.path.join(self.local_dir, path), request):
+                self.hits["local"] += 1
+                return response
+            if self.strict_local:
+                self.hits["not_found"] += 1
+                raise HTTPException(status_code=404, detail="File not found")
+
+        url = f"{self.base_url}{path}"
+        if self.cache_dir:
+            cache_path = os.path.join(self.cache_dir, path)
+            if response := get_local_file(cache_path, request):
+                self.hits["cache"] += 1
+                return response
+            self.hits["upstream"] += 1
+            return await proxy_and_cache(request, url, cache_path, lookup=False)
+
+        self.hits["upstream"] += 1
+        return await proxy_and_cache(request, url, disable_cache=True)
+
+    def stats(self) -> Dict[str, object]:
+        """Configuration and per-tier hit counters."""
+        return {
+            "local_dir": self.local_dir,
+            "strict_local": self.strict_local,
+            "cache_dir": self.cache_dir,
+            "hits": dict(self.hits),
+        }
@@ -9,8 +9,10 @@ from fastapi.responses import Response
 from fastapi.staticfiles import StaticFiles
 import additions.saves as saves
 from additions.auth import BasicAuthMiddleware
-from additions.cache import proxy_and_cache, get_local_file
-from additions.packed import init_packed_archive, get_packed_file, is_initialized as packed_is_initialized
+from additions.tiers import AssetTiers
+from additions.packed import init_packed_archive, get_stats as packed_get_stats, is_initialized as packed_is_initialized
+from additions.packed import reload_packed_archive, watch_packed_archive, is_downloading as packed_is_downloading
+from additions.packed import start_access_trace, prewarm_packed_archive
 
 # Add utils path for imports
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'utils'))
@@ -19,9 +21,6 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), 'utils'))
 VCSKY_BASE_URL = "https://cdn.dos.zone/vcsky/"
 VCBR_BASE_URL = "https://br.cdn.dos.zone/vcsky/"
 
-def request_to_url(request: Request, path: str, base_url: str):
-    return f"{base_url}{path}"
-
 parser = argparse.ArgumentParser()
 parser.add_argument("--port", type=int, default=8000)
 parser.add_argument("--custom_saves", action="store_true")
@@ -36,13 +35,20 @@ parser.add_argument("--vcsky_cache", action="store_true", default=True, help="Ca
 parser.add_argument("--vcbr_cache", action="store_true", default=True, help="Cache vcbr files locally. If files are not found in the local directory, they will be downloaded from the specified URL and saved to the local directory.")
 parser.add_argument("--cheats", action="store_true", help="Enable cheats in URL")
 parser.add_argument("--open", action="store_true", help="Open browser on start")
-parser.add_argument("--packed", type=str, help="Path or URL to packed archive (.bin)")
+parser.add_argument("--packed", type=str, nargs="+", help="Path or URL to packed archive (.bin); several archives are layered, later ones (patches) overriding earlier ones per path")
 parser.add_argument("--unpacked", type=str, help="Path or URL to unpacked archive folder")
+parser.add_argument("--packed_cache_mb", "--packed-cache-mb", type=int, default=128, help="Memory budget (MB) for decoded packed entries served to clients without brotli support (0 disables)")
+parser.add_argument("--packed_watch", "--packed-watch", type=float, default=0, help="Reload the packed archives when their files change, checking every N seconds (0 disables; POST /packed/reload always works)")
+parser.add_argument("--packed_backend", "--packed-backend", type=str, choices=["mmap", "pread", "aiofiles", "http"], default="mmap", help="How the packed archive is read: mmap (zero-copy mapping), pread (shared descriptor pool), aiofiles, or http (--packed is a URL read lazily with Range requests; only the index is downloaded at startup)")
+parser.add_argument("--packed_trace", "--packed-trace", type=str, help="Append the archive paths served, in first-request order, to this file (input of 'packer_brotli.py repack')")
+parser.add_argument("--prewarm", nargs="?", const=True, metavar="MANIFEST", help="After startup, read the hot archive entries ahead into the page cache in the background: the paths listed in MANIFEST (one per line, e.g. a --packed_trace file), or without MANIFEST the .wasm.br/.data.br files and sha256sums.txt")
+parser.add_argument("--prewarm_decode", "--prewarm-decode", action="store_true", help="With --prewarm, also decode the entries into the decoded entry cache (see --packed_cache_mb)")
 args = parser.parse_args()
 
-# Global paths for unpacked mode
-VCSKY_LOCAL_PATH = None
-VCBR_LOCAL_PATH = None
+# Task reloading the packed archives when their files change (--packed_watch)
+PACKED_WATCHER = None
+# Background prewarm of hot archive entries (--prewarm)
+PACKED_PREWARM = None
 
 
 def _md5_hash(text: str) -> str:
@@ -141,9 +147,9 @@ def pack_source(source: str) -> Optional[str]:
     If source is an MD5 hash, uses unpacked/{hash}/ folder.
     Otherwise uses the folder path directly.
     
-    Packs all subfolders (vcsky/, vcbr/, etc.) by:
-    1. Creating archive from first subfolder using pack_folder()
-    2. Adding remaining subfolders using add_folder()
+    Packs all subfolders (vcsky/, vcbr/, etc.) in one pass with
+    pack_folders(): the tree is scanned once, identical files are stored
+    once across subfolders and one worker pool compresses everything.
     
     Args:
         source: Folder path or MD5 hash
@@ -151,7 +157,7 @@ def pack_source(source: str) -> Optional[str]:
     Returns:
         Output filename (e.g., "abc123...def.bin") or None if failed
     """
-    from utils.packer_brotli import pack_folder, add_folder
+    from utils.packer_brotli import pack_folders
     
     # Resolve source to folder path and output hash
     if _is_md5_hash(source):
@@ -179,16 +185,8 @@ def pack_source(source: str) -> Optional[str]:
     print(f"Subfolders: {', '.join(subdirs)}")
     print()
     
-    # Pack first subfolder (creates new archive)
-    first_subdir = os.path.join(folder_path, subdirs[0])
-    print(f"=== Creating archive from {subdirs[0]} ===")
-    pack_folder(first_subdir, output_file)
-    
-    # Add remaining subfolders
-    for subdir_name in subdirs[1:]:
-        subdir_path = os.path.join(folder_path, subdir_name)
-        print(f"\n=== Adding {subdir_name} ===")
-        add_folder(output_file, subdir_path)
+    # Pack all subfolders into a new archive
+    pack_folders([os.path.join(folder_path, subdir_name) for subdir_name in subdirs], output_file)
     
     final_size = os.path.getsize(output_file)
     print(f"\n=== Packing complete ===")
@@ -289,45 +287,44 @@ os.makedirs("vcbr", exist_ok=True)
 os.makedirs("vcsky", exist_ok=True)
 
 
-# vcsky routes - packed archive, local, or proxy
+# vcsky/vcbr routes - packed archive, local directory, smart cache, upstream
+VCSKY_TIERS = AssetTiers("vcsky", args.vcsky_url,
+                         cache_dir="vcsky" if args.vcsky_cache else None,
+                         local_dir="vcsky" if args.vcsky_local else None,
+                         strict_local=args.vcsky_local)
+VCBR_TIERS = AssetTiers("vcbr", args.vcbr_url,
+                        cache_dir="vcbr" if args.vcbr_cache else None,
+                        local_dir="vcbr" if args.vcbr_local else None,
+                        strict_local=args.vcbr_local)
+
+
 @app.api_route("/vcsky/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH", "HEAD", "OPTIONS"])
 async def vc_sky_proxy(request: Request, path: str):
-    local_path = os.path.join("vcsky", path)
-    
-    # 1. Strict Local Mode (No Network)
-    if args.vcsky_local:
-        if response := get_local_file(local_path, request):
-            return response
-        raise HTTPException(status_code=404, detail="File not found")
-        
-    # 2. Smart Cache Mode (Local -> Network -> Cache)
-    # If caching is enabled (default), proxy_and_cache checks local first.
-    url = request_to_url(request, path, args.vcsky_url)
-    if args.vcsky_cache:
-        return await proxy_and_cache(request, url, local_path)
-        
-    # 3. Proxy Only Mode (No Local Cache)
-    return await proxy_and_cache(request, url, disable_cache=True)
+    return await VCSKY_TIERS.resolve(request, path)
 
 @app.api_route("/vcbr/{path:path}", methods=["GET", "POST", "PUT", "DELETE", "PATCH", "HEAD", "OPTIONS"])
 async def vc_br_proxy(request: Request, path: str):
-    # Try packed archive first if enabled
-    if args.packed and packed_is_initialized():
-        packed_path = f"vcbr/{path}"
-        if response := await get_packed_file(packed_path, request):
-            return response
-    
-    # Try local directory
-    if VCBR_LOCAL_PATH:
-        local_path = os.path.join(VCBR_LOCAL_PATH, path)
-        if response := get_local_file(local_path, request):
-            return response
-        raise HTTPException(status_code=404, detail="File not found")
-    url = request_to_url(request, path, args.vcbr_url)
-    if args.vcbr_cache:
-        cache_path = os.path.join("vcbr", path)
-        return await proxy_and_cache(request, url, cache_path)
-    return await proxy_and_cache(request, url, disable_cache=True)
+    return await VCBR_TIERS.resolve(request, path)
+
+
+@app.get("/tiers/stats")
+async def tiers_stats():
+    return {"vcsky": VCSKY_TIERS.stats(), "vcbr": VCBR_TIERS.stats()}
+
+
+@app.get("/packed/stats")
+async def packed_stats():
+    return packed_get_stats()
+
+
+@app.post("/packed/reload")
+async def packed_reload():
+    if not (args.packed and packed_is_initialized()):
+        raise HTTPException(status_code=409, detail="Packed archive not enabled")
+    result = await reload_packed_archive()
+    if not result["reloaded"]:
+        raise HTTPException(status_code=500, detail=result["error"])
+    return result
 
 
 @app.get("/")
@@ -351,23 +348,34 @@ app.mount("/", StaticFiles(directory="dist"), name="root")
 
 async def init_server():
     """Initialize server components that need async init."""
-    global VCSKY_LOCAL_PATH, VCBR_LOCAL_PATH
+    global PACKED_WATCHER, PACKED_PREWARM
     
     # Handle --unpacked mode first (takes precedence)
     if args.unpacked:
         vcsky_path, vcbr_path = await setup_unpacked(args.unpacked)
         if vcsky_path:
-            VCSKY_LOCAL_PATH = vcsky_path
+            VCSKY_TIERS.local_dir, VCSKY_TIERS.strict_local = vcsky_path, True
         if vcbr_path:
-            VCBR_LOCAL_PATH = vcbr_path
+            VCBR_TIERS.local_dir, VCBR_TIERS.strict_local = vcbr_path, True
     
     # Handle --packed mode
     if args.packed:
         # init_packed_archive handles both local paths and URLs
-        # If URL is provided, it will download the file if not present locally
-        result = await init_packed_archive(args.packed)
-        if result is None:
-            print(f"Warning: Failed to initialize packed archive from: {args.packed}")
+        # If URL is provided and the file is not present locally, it is
+        # downloaded in the background; until then requests are proxied
+        result = await init_packed_archive(args.packed, backend=args.packed_backend, cache_mb=args.packed_cache_mb,
+                                           background_download=True)
+        if result is None and not packed_is_downloading():
+            print(f"Warning: Failed to initialize packed archive from: {', '.join(args.packed)}")
+        elif args.packed_watch > 0:
+            PACKED_WATCHER = asyncio.create_task(watch_packed_archive(args.packed_watch))
+        if args.packed_trace:
+            start_access_trace(args.packed_trace)
+        if args.prewarm and result is not None:
+            manifest = None if args.prewarm is True else args.prewarm
+            PACKED_PREWARM = asyncio.create_task(prewarm_packed_archive(manifest, decode=args.prewarm_decode))
+        elif args.prewarm:
+            print("Prewarm skipped: the packed archive is not loaded yet")
 
 
 def start_server(app=app, host="0.0.0.0", port=args.port):
@@ -0,0 +1,57 @@
+"""
+Shared test setup: the repository root on sys.path and a sample game folder.
+
+Run from the repository root:
+    python -m pytest -q
+"""
+
+import os
+import random
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+# A little of everything the packer treats differently: compressible text,
+# incompressible data spanning several remote chunks, a pre-compressed .br
+# file, a duplicate and an empty file
+SAMPLE_FILES = {
+    'data/main.scm': b'SCRIPT ' * 20000,
+    'data/text/american.gxt': b'\n'.join(b'entry %d = some text' % i for i in range(5000)),
+    'models/big.img': random.Random(1).randbytes(1600 * 1024),
+    'models/copy.img': b'SCRIPT ' * 20000,
+    'audio/empty.txt': b'',
+}
+
+
+def write_tree(root: str, files: dict) -> str:
+    """Write {relative path: content} under root; returns root."""
+    for rel_path, data in files.items():
+        path = os.path.join(root, *rel_path.split('/'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+    return root
+
+
+def read_tree(root: str) -> dict:
+    """{relative path: content} of every file under root."""
+    files = {}
+    for directory, _, filenames in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(directory, filename)
+            with open(path, 'rb') as f:
+                files[os.path.relpath(path, root).replace(os.sep, '/')] = f.read()
+    return files
+
+
+@pytest.fixture
+def sample_folder(tmp_path) -> str:
+    """Folder "vcsky" holding SAMPLE_FILES (archive paths "vcsky/<relative path>")."""
+    import brotli
+    files = dict(SAMPLE_FILES)
+    files['fetched/ui.js.br'] = brotli.compress(b'function ui() {}\n' * 3000)
+    return write_tree(str(tmp_path / 'vcsky'), files)
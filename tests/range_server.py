@@ -0,0 +1,109 @@
+"""
+Local stand-in for a static file host that answers HTTP Range requests.
+
+Serves the files of a directory with strong ETags, single byte-range
+requests (206), If-Range (a stale validator gets the whole file, 200) and
+416 past the end, and logs every request, so remote archive reads and
+resumable downloads can be tested without a network.
+
+Usage:
+    with RangeServer(directory) as server:
+        url = server.url('packed.bin')
+        ...
+        server.requests  # [(method, path, headers), ...]
+"""
+
+import hashlib
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional, Tuple
+
+RANGE_PATTERN = re.compile(r'bytes=(\d*)-(\d*)$')
+
+
+def file_etag(path: str) -> str:
+    """Strong ETag of a file (changes whenever its content does)."""
+    with open(path, 'rb') as f:
+        return '"' + hashlib.blake2b(f.read(), digest_size=8).hexdigest() + '"'
+
+
+class RangeRequestHandler(BaseHTTPRequestHandler):
+    server: 'RangeServer'
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        self.server.requests.append(('GET', self.path, dict(self.headers)))
+        path = os.path.join(self.server.directory, self.path.lstrip('/').split('?', 1)[0])
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, 'rb') as f:
+            data = f.read()
+        etag = file_etag(path)
+
+        span: Optional[Tuple[int, int]] = None
+        range_header = self.headers.get('Range')
+        if_range = self.headers.get('If-Range')
+        if range_header is not None and (if_range is None or if_range == etag):
+            match = RANGE_PATTERN.match(range_header)
+            if match is None or not any(match.groups()):
+                self.send_error(400)
+                return
+            first, last = match.groups()
+            if first:
+                start, end = int(first), min(int(last) + 1 if last else len(data), len(data))
+            else:
+                start, end = max(0, len(data) - int(last)), len(data)
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Range', f'bytes */{len(data)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+            span = (start, end)
+
+        if span is None:
+            self.send_response(200)
+            body = data
+        else:
+            self.send_response(206)
+            self.send_header('Content-Range', f'bytes {span[0]}-{span[1] - 1}/{len(data)}')
+            body = data[span[0]:span[1]]
+        self.send_header('ETag', etag)
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class RangeServer(ThreadingHTTPServer):
+    """Threaded HTTP server of a directory on 127.0.0.1 (random port), run in the background."""
+
+    daemon_threads = True
+
+    def __init__(self, directory: str):
+        super().__init__(('127.0.0.1', 0), RangeRequestHandler)
+        self.directory = directory
+        self.requests: List[Tuple[str, str, dict]] = []
+        self._thread: Optional[threading.Thread] = None
+
+    def url(self, name: str) -> str:
+        return f'http://127.0.0.1:{self.server_address[1]}/{name}'
+
+    def range_requests(self) -> List[str]:
+        """Range headers of the requests served so far."""
+        return [headers['Range'] for method, path, headers in self.requests if 'Range' in headers]
+
+    def __enter__(self) -> 'RangeServer':
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.shutdown()
+        self.server_close()
+        self._thread.join()
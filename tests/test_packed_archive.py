@@ -0,0 +1,193 @@
+"""PackedArchive: index loading, lookups, the pread backend and the decoded entry cache."""
+
+import asyncio
+import os
+
+import pytest
+
+from utils import packer_brotli
+from utils.packer_brotli import (ARCHIVE_VERSION_1, DecodedEntryCache, PackedArchive, PreadFilePool,
+                                 default_prewarm_paths, pack_folder, sidecar_path)
+
+
+@pytest.fixture
+def v1_archive(sample_folder, tmp_path):
+    path = str(tmp_path / 'packed.bin')
+    pack_folder(sample_folder, path, max_workers=1, format_version=ARCHIVE_VERSION_1)
+    return path
+
+
+def load(path, **options):
+    archive = PackedArchive(path, **options)
+    asyncio.run(archive.init())
+    return archive
+
+
+def test_sidecar_is_written_by_a_scan_and_reused(v1_archive):
+    first = load(v1_archive)
+    assert first.index_source == 'scan'
+    assert os.path.isfile(sidecar_path(v1_archive))
+
+    second = load(v1_archive)
+    assert second.index_source == 'sidecar'
+    assert second.list_files() == first.list_files()
+    first.close()
+    second.close()
+
+
+def test_stale_sidecar_is_ignored(v1_archive, sample_folder):
+    load(v1_archive).close()
+
+    # Replace the archive: the sidecar no longer describes it
+    with open(os.path.join(sample_folder, 'data', 'new.txt'), 'wb') as f:
+        f.write(b'added later')
+    pack_folder(sample_folder, v1_archive, max_workers=1, format_version=ARCHIVE_VERSION_1)
+
+    archive = load(v1_archive)
+    assert archive.index_source == 'scan'
+    assert asyncio.run(archive.read_decoded('vcsky/data/new.txt')) == b'added later'
+    archive.close()
+    assert load(v1_archive).index_source == 'sidecar'
+
+
+def test_touched_archive_is_rescanned(v1_archive):
+    load(v1_archive).close()
+    st = os.stat(v1_archive)
+    os.utime(v1_archive, ns=(st.st_atime_ns, st.st_mtime_ns + 1_000_000_000))
+
+    assert load(v1_archive).index_source == 'scan'
+
+
+def test_corrupt_sidecar_is_ignored(v1_archive):
+    load(v1_archive).close()
+    with open(sidecar_path(v1_archive), 'r+b') as f:
+        f.truncate(os.path.getsize(sidecar_path(v1_archive)) // 2)
+
+    archive = load(v1_archive)
+    assert archive.index_source == 'scan'
+    assert archive.exists('vcsky/models/big.img')
+
+
+def test_decoded_cache_evicts_least_recently_used():
+    cache = DecodedEntryCache(300, max_entry_bytes=150)
+    cache.put('a', b'a' * 100)
+    cache.put('b', b'b' * 100)
+    cache.put('c', b'c' * 100)
+    assert cache.get('a') == b'a' * 100  # a is now the most recently used
+
+    cache.put('d', b'd' * 100)
+
+    assert 'b' not in cache
+    assert 'a' in cache and 'c' in cache and 'd' in cache
+    assert cache.stats()['bytes'] == 300 and cache.evictions == 1
+
+
+def test_decoded_cache_rejects_large_entries():
+    cache = DecodedEntryCache(1000)  # admits up to a quarter: 250 bytes
+    cache.put('small', b's' * 250)
+
+    assert not cache.put('large', b'l' * 251)
+
+    assert 'large' not in cache and 'small' in cache
+    assert cache.rejected == 1 and cache.evictions == 0
+
+
+def test_archive_decodes_cached_entries_once(sample_folder, tmp_path, monkeypatch):
+    path = str(tmp_path / 'packed.bin')
+    pack_folder(sample_folder, path, max_workers=1)
+    archive = load(path, decoded_cache_bytes=1024 * 1024)
+    decoded = []
+    decompress_brotli = packer_brotli.decompress_brotli
+
+    def counting_decompress_brotli(data):
+        decoded.append(len(data))
+        return decompress_brotli(data)
+
+    monkeypatch.setattr(packer_brotli, 'decompress_brotli', counting_decompress_brotli)
+
+    first = asyncio.run(archive.read_decoded('vcsky/data/main.scm'))
+    second = asyncio.run(archive.read_decoded('vcsky/data/main.scm'))
+
+    assert bytes(first) == bytes(second) == b'SCRIPT ' * 20000
+    assert len(decoded) == 1
+    stats = archive.stats()['decoded_cache']
+    assert stats['hits'] == 1 and stats['entries'] == 1
+    archive.close()
+
+
+@pytest.mark.parametrize('use_pread', [True, False])
+def test_pread_pool_reads(tmp_path, monkeypatch, use_pread):
+    data = os.urandom(10_000)
+    path = tmp_path / 'data.bin'
+    path.write_bytes(data)
+    if not use_pread:
+        monkeypatch.delattr(os, 'pread')  # Windows: lseek() + read() under a lock
+    monkeypatch.setattr(PreadFilePool, 'MAX_READ_CHUNK', 1000)  # Reads over it take several calls
+    pool = PreadFilePool(str(path), num_fds=2)
+    spans = [(0, 10), (123, 4567), (9000, 1000), (9500, 1000), (0, 10_000)]
+
+    async def read_all():
+        return await asyncio.gather(*(pool.read(offset, size) for offset, size in spans))
+
+    results = asyncio.run(read_all())
+
+    assert results == [data[offset:offset + size] for offset, size in spans]
+    stats = pool.stats()
+    assert stats['fds'] == 2 and stats['reads'] == len(spans) and stats['queue_depth'] == 0
+    assert stats['bytes_read'] == sum(len(result) for result in results)
+    pool.close()
+    with pytest.raises(RuntimeError):
+        asyncio.run(pool.read(0, 10))
+
+
+def test_pread_backend_matches_mmap(sample_folder, tmp_path):
+    path = str(tmp_path / 'packed.bin')
+    pack_folder(sample_folder, path, max_workers=1, block_size=64 * 1024)
+    mapped = load(path)
+    pread = load(path, backend='pread', pread_fds=2)
+
+    async def read_all(archive):
+        return {name: bytes(await archive.read_decoded(name)) for name in archive.list_files()}
+
+    assert asyncio.run(read_all(pread)) == asyncio.run(read_all(mapped))
+    assert pread.stats()['reader']['reads'] > 0
+    mapped.close()
+    pread.close()
+
+
+def test_prewarm_counts_shared_and_missing_paths(sample_folder, tmp_path):
+    path = str(tmp_path / 'packed.bin')
+    pack_folder(sample_folder, path, max_workers=1)
+    archive = load(path, decoded_cache_bytes=1024 * 1024)
+    paths = ['vcsky/data/main.scm', 'vcsky/models/copy.img', 'vcsky/data/text/american.gxt', 'vcsky/missing.txt']
+
+    counts = asyncio.run(archive.prewarm(paths))
+
+    assert counts['entries'] == 2  # copy.img shares main.scm's data
+    assert counts['missing'] == 1 and counts['decoded'] == 0
+    assert 1 <= counts['regions'] <= 2 and counts['bytes'] > 0
+    assert archive.stats()['decoded_cache']['entries'] == 0
+
+    counts = asyncio.run(archive.prewarm(paths, decode=True))
+
+    assert counts['decoded'] == 2
+    assert archive.stats()['decoded_cache']['entries'] == 2
+    archive.close()
+
+
+def test_prewarm_without_known_paths_reads_nothing(sample_folder, tmp_path):
+    path = str(tmp_path / 'packed.bin')
+    pack_folder(sample_folder, path, max_workers=1)
+    archive = load(path)
+
+    counts = asyncio.run(archive.prewarm(['vcsky/missing.txt', 'other/main.scm'], decode=True))
+
+    assert counts == {'entries': 0, 'missing': 2, 'regions': 0, 'bytes': 0, 'decoded': 0}
+    archive.close()
+
+
+def test_default_prewarm_paths():
+    paths = ['vcsky/index.html', 'vcsky/game.wasm.br', 'vcsky/game.data.br', 'vcsky/sha256sums.txt',
+             'vcsky/old_sha256sums.txt', 'vcsky/game.wasm']
+
+    assert default_prewarm_paths(paths) == ['vcsky/game.wasm.br', 'vcsky/game.data.br', 'vcsky/sha256sums.txt']
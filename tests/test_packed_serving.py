@@ -0,0 +1,307 @@
+"""Serving files from packed archives: get_packed_file() behind a FastAPI route."""
+
+import asyncio
+import os
+
+import brotli
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
+from fastapi.testclient import TestClient
+
+import additions.packed as packed
+from conftest import write_tree
+from range_server import RangeServer
+from utils.packer_brotli import pack_folder, parse_codec_rules
+
+PLAIN = {'Accept-Encoding': 'identity'}
+BROTLI = {'Accept-Encoding': 'br'}
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    """serve(*archive_paths) -> TestClient answering every path from the archives."""
+    for name, value in (('_archive', None), ('_archive_paths', []), ('_generation', 0), ('_last_reload', None)):
+        monkeypatch.setattr(packed, name, value)
+    app = FastAPI()
+
+    @app.get('/{path:path}')
+    async def get(request: Request, path: str):
+        return await packed.get_packed_file(path, request) or Response(status_code=404)
+
+    def start(*archive_paths, backend='mmap'):
+        assert asyncio.run(packed.init_packed_archive(list(archive_paths), backend=backend)) is not None
+        return TestClient(app)
+
+    yield start
+    if packed._archive is not None:
+        packed._archive.close()
+
+
+@pytest.fixture
+def archive(sample_folder, tmp_path):
+    path = str(tmp_path / 'packed.bin')
+    pack_folder(sample_folder, path, max_workers=1)
+    return path
+
+
+def original(sample_folder, name):
+    with open(os.path.join(sample_folder, *name.split('/')), 'rb') as f:
+        return f.read()
+
+
+def raw_get(client, path, headers):
+    """Response and its body as sent (not decoded by the client)."""
+    with client.stream('GET', path, headers=headers) as response:
+        return response, b''.join(response.iter_raw())
+
+
+@pytest.mark.parametrize('name', ['data/main.scm', 'models/big.img'])
+def test_range_of_decoded_content(serve, archive, sample_folder, name):
+    client = serve(archive)
+    data = original(sample_folder, name)
+    layer = packed._archive.find(f'vcsky/{name}')[1]
+    assert layer.is_stored_uncompressed(f'vcsky/{name}') == (name == 'models/big.img')
+
+    # Brotli clients get ranges of the decoded content too, whether it's stored or brotli-compressed
+    response = client.get(f'/vcsky/{name}', headers={**BROTLI, 'Range': 'bytes=1000-1999'})
+
+    assert response.status_code == 206
+    assert response.headers['content-range'] == f'bytes 1000-1999/{len(data)}'
+    assert 'content-encoding' not in response.headers
+    assert response.content == data[1000:2000]
+
+
+def test_range_across_blocks(serve, sample_folder, tmp_path):
+    path = str(tmp_path / 'blocks.bin')
+    pack_folder(sample_folder, path, max_workers=1, block_size=256 * 1024, store_min_gain=0)
+    client = serve(path)
+    assert packed._archive.find('vcsky/models/big.img')[1].is_block_compressed('vcsky/models/big.img')
+    data = original(sample_folder, 'models/big.img')
+    start, end = 256 * 1024 - 10, 512 * 1024 + 10
+
+    response = client.get('/vcsky/models/big.img', headers={**PLAIN, 'Range': f'bytes={start}-{end - 1}'})
+
+    assert response.status_code == 206
+    assert response.content == data[start:end]
+
+
+def test_suffix_and_multiple_ranges(serve, archive, sample_folder):
+    client = serve(archive)
+    data = original(sample_folder, 'data/text/american.gxt')
+
+    suffix = client.get('/vcsky/data/text/american.gxt', headers={**PLAIN, 'Range': 'bytes=-100'})
+    assert suffix.status_code == 206
+    assert suffix.content == data[-100:]
+
+    multi = client.get('/vcsky/data/text/american.gxt', headers={**PLAIN, 'Range': 'bytes=0-9,100-109'})
+    assert multi.status_code == 206
+    assert multi.headers['content-type'].startswith('multipart/byteranges')
+    assert data[0:10] in multi.content and data[100:110] in multi.content
+
+
+def test_unsatisfiable_range(serve, archive, sample_folder):
+    client = serve(archive)
+    size = len(original(sample_folder, 'data/main.scm'))
+
+    response = client.get('/vcsky/data/main.scm', headers={**PLAIN, 'Range': f'bytes={size}-'})
+
+    assert response.status_code == 416
+    assert response.headers['content-range'] == f'bytes */{size}'
+
+
+def test_range_of_br_file_covers_stored_bytes(serve, archive, sample_folder):
+    client = serve(archive)
+    stored = original(sample_folder, 'fetched/ui.js.br')
+
+    response, body = raw_get(client, '/vcsky/fetched/ui.js.br', {**BROTLI, 'Range': 'bytes=0-9'})
+    assert response.status_code == 206
+    assert response.headers['content-encoding'] == 'br'
+    assert body == stored[:10]
+
+    # Clients without brotli get ranges of the decoded file
+    response = client.get('/vcsky/fetched/ui.js.br', headers={**PLAIN, 'Range': 'bytes=0-9'})
+    assert response.content == brotli.decompress(stored)[:10]
+
+
+def test_etag_per_representation(serve, archive):
+    client = serve(archive)
+
+    plain = client.get('/vcsky/data/main.scm', headers=PLAIN)
+    encoded, _ = raw_get(client, '/vcsky/data/main.scm', BROTLI)
+
+    assert plain.headers['etag'].startswith('"') and not plain.headers['etag'].startswith('W/')
+    assert encoded.headers['content-encoding'] == 'br'
+    assert encoded.headers['etag'] != plain.headers['etag']
+    assert client.get('/vcsky/data/main.scm', headers=PLAIN).headers['etag'] == plain.headers['etag']
+    # Identical content, identical tag (copy.img is a duplicate of main.scm)
+    assert client.get('/vcsky/models/copy.img', headers=PLAIN).headers['etag'] == plain.headers['etag']
+    assert client.get('/vcsky/data/text/american.gxt', headers=PLAIN).headers['etag'] != plain.headers['etag']
+
+
+def test_if_none_match_answers_304_without_reading(serve, archive, monkeypatch):
+    client = serve(archive)
+    etag = client.get('/vcsky/data/main.scm', headers=PLAIN).headers['etag']
+
+    layer = packed._archive.find('vcsky/data/main.scm')[1]
+
+    def fail(*args, **kwargs):
+        raise AssertionError('entry data read for a 304')
+
+    monkeypatch.setattr(layer, 'open', fail)
+    monkeypatch.setattr(layer, 'read_decoded', fail)
+    for if_none_match in (etag, 'W/' + etag, f'"other", {etag}', '*'):
+        response = client.get('/vcsky/data/main.scm', headers={**PLAIN, 'If-None-Match': if_none_match})
+        assert response.status_code == 304
+        assert response.content == b''
+        assert response.headers['etag'] == etag
+        assert response.headers['cache-control'] == packed.CACHE_CONTROL
+
+
+def test_stale_validators_get_the_file(serve, archive, sample_folder):
+    client = serve(archive)
+    data = original(sample_folder, 'data/main.scm')
+    etag = client.get('/vcsky/data/main.scm', headers=PLAIN).headers['etag']
+
+    stale = client.get('/vcsky/data/main.scm', headers={**PLAIN, 'If-None-Match': '"0123"'})
+    assert stale.status_code == 200 and stale.content == data
+
+    # If-Range: a current tag gets the range, a stale one the whole file
+    current = client.get('/vcsky/data/main.scm', headers={**PLAIN, 'Range': 'bytes=0-9', 'If-Range': etag})
+    assert current.status_code == 206 and current.content == data[:10]
+    changed = client.get('/vcsky/data/main.scm', headers={**PLAIN, 'Range': 'bytes=0-9', 'If-Range': '"0123"'})
+    assert changed.status_code == 200 and changed.content == data
+
+
+@pytest.fixture
+def patch_archive(tmp_path):
+    """Archive "patch.bin" replacing main.scm and adding a file."""
+    folder = write_tree(str(tmp_path / 'patch' / 'vcsky'), {
+        'data/main.scm': b'patched script',
+        'data/extra.txt': b'only in the patch',
+    })
+    path = str(tmp_path / 'patch.bin')
+    pack_folder(folder, path, max_workers=1)
+    return path
+
+
+def test_last_layer_wins(serve, archive, patch_archive, sample_folder):
+    client = serve(archive, patch_archive)
+
+    patched = client.get('/vcsky/data/main.scm', headers=PLAIN)
+    assert patched.content == b'patched script'
+    assert patched.headers['x-packed-layer'] == 'patch.bin'
+
+    added = client.get('/vcsky/data/extra.txt', headers=PLAIN)
+    assert added.content == b'only in the patch'
+    assert added.headers['x-packed-layer'] == 'patch.bin'
+
+    # Files of the folder the patch doesn't replace still come from the base
+    base = client.get('/vcsky/data/text/american.gxt', headers=PLAIN)
+    assert base.content == original(sample_folder, 'data/text/american.gxt')
+    assert base.headers['x-packed-layer'] == 'packed.bin'
+    # The base's duplicate of main.scm keeps the base content
+    assert client.get('/vcsky/models/copy.img', headers=PLAIN).content == original(sample_folder, 'models/copy.img')
+
+    assert client.get('/vcsky/data/missing.txt', headers=PLAIN).status_code == 404
+    etag = patched.headers['etag']
+    not_modified = client.get('/vcsky/data/main.scm', headers={**PLAIN, 'If-None-Match': etag})
+    assert not_modified.status_code == 304
+    assert not_modified.headers['x-packed-layer'] == 'patch.bin'
+
+
+def test_merged_index(serve, archive, patch_archive, sample_folder):
+    serve(archive, patch_archive)
+    overlay = packed._archive
+
+    files = overlay.list_files()
+    assert len(files) == len(set(files)) == overlay.file_count() == 7
+    assert sorted(overlay.list_files('vcsky/data')) == ['extra.txt', 'main.scm']
+    assert overlay.find('vcsky/data/main.scm')[0] == 1
+    assert overlay.find('vcsky/models/big.img')[0] == 0
+    assert overlay.find('vcsky/models/nothing.img') is None
+
+
+def replace_archive(folder, path, files):
+    """Repack folder with files changed and rename the new archive over path."""
+    write_tree(folder, files)
+    pack_folder(folder, path + '.new', max_workers=1)
+    os.replace(path + '.new', path)
+
+
+@pytest.mark.parametrize('backend', ['mmap', 'pread', 'aiofiles'])
+def test_reload_swaps_generations(serve, archive, sample_folder, backend):
+    client = serve(archive, backend=backend)
+    assert packed._generation == 1
+    previous = packed._archive
+    old_data = original(sample_folder, 'data/main.scm')
+
+    replace_archive(sample_folder, archive, {'data/main.scm': b'new script', 'data/added.txt': b'added'})
+    result = asyncio.run(packed.reload_packed_archive())
+
+    assert result['reloaded'] and result['generation'] == 2 and result['files'] == 7
+    assert packed._archive is not previous
+    assert client.get('/vcsky/data/main.scm', headers=PLAIN).content == b'new script'
+    assert client.get('/vcsky/data/added.txt', headers=PLAIN).content == b'added'
+    # Requests that looked the file up before the swap still read the previous
+    # archive, or fail rather than read the new file at the old offsets
+    if backend == 'aiofiles':
+        with pytest.raises(IOError):
+            asyncio.run(previous.layers[0].read_decoded('vcsky/data/main.scm'))
+    else:
+        assert bytes(asyncio.run(previous.layers[0].read_decoded('vcsky/data/main.scm'))) == old_data
+    previous.close()
+
+
+def test_failed_reload_keeps_serving(serve, archive):
+    client = serve(archive)
+    with open(archive + '.new', 'wb') as f:
+        f.write(b'not an archive' * 100)
+    os.replace(archive + '.new', archive)
+
+    result = asyncio.run(packed.reload_packed_archive())
+
+    assert not result['reloaded'] and 'error' in result
+    assert packed._generation == 1
+    assert client.get('/vcsky/data/main.scm', headers=PLAIN).status_code == 200
+
+
+def test_remote_reload_shares_unchanged_reader(serve, sample_folder, tmp_path, monkeypatch):
+    root = tmp_path / 'srv'
+    root.mkdir()
+    path = str(root / 'packed.bin')
+    pack_folder(sample_folder, path, max_workers=1)
+    monkeypatch.chdir(tmp_path)
+    with RangeServer(str(root)) as server:
+        serve(server.url('packed.bin'), backend='http')
+        reader = packed._archive.layers[0].remote_reader
+
+        assert asyncio.run(packed.reload_packed_archive())['reloaded']
+        assert packed._archive.layers[0].remote_reader is reader
+
+        # A replaced remote file gets a cache of its own; the previous one goes with its last user
+        replace_archive(sample_folder, path, {'data/main.scm': b'new script'})
+        previous = packed._archive
+        assert asyncio.run(packed.reload_packed_archive())['reloaded']
+        current = packed._archive.layers[0].remote_reader
+        assert current is not reader
+        assert os.path.isfile('packed.bin.cache') and os.path.isfile('packed.bin.3.cache')
+        assert asyncio.run(packed._archive.layers[0].read_decoded('vcsky/data/main.scm')) == b'new script'
+
+        del reader
+        previous.close()
+        assert not os.path.exists('packed.bin.cache') and not os.path.exists('packed.bin.cache.chunks')
+        assert os.path.isfile('packed.bin.3.cache')
+
+
+def test_codecs_without_a_brotli_stream_are_sent_plain(serve, sample_folder, tmp_path):
+    path = str(tmp_path / 'codecs.bin')
+    pack_folder(sample_folder, path, max_workers=1, codecs=parse_codec_rules('zstd:*.gxt'))
+    client = serve(path)
+
+    for name in ['data/text/american.gxt', 'models/big.img']:  # zstd, stored
+        response, body = raw_get(client, f'/vcsky/{name}', BROTLI)
+        assert 'content-encoding' not in response.headers
+        assert body == original(sample_folder, name)
+    response, _ = raw_get(client, '/vcsky/data/main.scm', BROTLI)
+    assert response.headers['content-encoding'] == 'br'
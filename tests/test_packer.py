@@ -0,0 +1,513 @@
+"""
+Packing: archive formats and entry types round-trip through unpack_file()
+and PackedArchive; base reuse, codec rules, scheduling and multi-root packs.
+"""
+
+import asyncio
+import json
+import os
+import re
+import shutil
+
+import brotli
+import pytest
+
+from conftest import SAMPLE_FILES, read_tree, write_tree
+from utils import packer_brotli
+from utils.packer_brotli import (ARCHIVE_VERSION_1, ARCHIVE_VERSION_2, CODEC_BROTLI, CODEC_RAW, CODEC_TARGETS,
+                                 CODEC_ZSTD, FILE_TYPE_REFERENCE, FILE_TYPE_STORED, CompressTask, PackedArchive,
+                                 PackSchedule, add_folder, add_folder_async, check_codec_rules, choose_codec,
+                                 find_duplicates, pack_folder, pack_folders, pack_folders_async, parse_codec_rules,
+                                 read_archive_index, repack_archive, unpack_file)
+
+
+def pack(folder, tmp_path, name='packed.bin', **options):
+    path = str(tmp_path / name)
+    pack_folder(folder, path, max_workers=1, **options)
+    return path
+
+
+def read_archive(path):
+    """{archive path: decoded content} of every file of an archive."""
+    async def read():
+        archive = PackedArchive(path)
+        await archive.init()
+        try:
+            return {name: bytes(await archive.read_decoded(name)) for name in archive.list_files()}
+        finally:
+            archive.close()
+    return asyncio.run(read())
+
+
+def assert_round_trip(path, folder, tmp_path):
+    expected = read_tree(folder)
+    out = tmp_path / 'unpacked'
+    unpack_file(path, str(out))
+    assert read_tree(str(out / os.path.basename(folder))) == expected
+    # read_decoded() decodes the .br files stored as they are
+    assert read_archive(path) == {f'vcsky/{name}': brotli.decompress(data) if name.endswith('.br') else data
+                                  for name, data in expected.items()}
+
+
+@pytest.mark.parametrize('format_version', [ARCHIVE_VERSION_1, ARCHIVE_VERSION_2])
+def test_round_trip(sample_folder, tmp_path, format_version):
+    path = pack(sample_folder, tmp_path, format_version=format_version)
+
+    assert_round_trip(path, sample_folder, tmp_path)
+    archive = PackedArchive(path, index_cache=False)
+    asyncio.run(archive.init())
+    assert archive.index_source == ('scan' if format_version == ARCHIVE_VERSION_1 else 'trailer')
+    archive.close()
+
+
+def test_block_compressed_round_trip(sample_folder, tmp_path):
+    path = pack(sample_folder, tmp_path, block_size=64 * 1024, store_min_gain=0)
+
+    assert_round_trip(path, sample_folder, tmp_path)
+    archive = PackedArchive(path)
+    asyncio.run(archive.init())
+    assert archive.is_block_compressed('vcsky/data/main.scm')
+    assert archive.is_block_compressed('vcsky/models/big.img')
+    assert not archive.is_block_compressed('vcsky/audio/empty.txt')
+
+    async def decoded_range(name, start, end):
+        return b''.join([bytes(chunk) async for chunk in archive.iter_decoded(name, start, end)])
+
+    with open(os.path.join(sample_folder, 'models', 'big.img'), 'rb') as f:
+        original = f.read()
+    # A range across block boundaries decodes only the blocks it covers
+    start, end = 100 * 1024, 300 * 1024 + 5
+    assert asyncio.run(decoded_range('vcsky/models/big.img', start, end)) == original[start:end]
+    archive.close()
+
+
+
+def reuse_counts(output):
+    """(reused, new or changed) from pack_folder(base=...)'s "Reusing ..." line."""
+    match = re.search(r'^Reusing (\d+) files .*, (\d+) new or changed$', output, re.MULTILINE)
+    return int(match.group(1)), int(match.group(2))
+
+
+def read_bytes(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_base_reuses_unchanged_files(sample_folder, tmp_path, capsys):
+    base = pack(sample_folder, tmp_path, name='base.bin')
+    base_totals = re.search(r'^Compression: .*$', capsys.readouterr().out, re.MULTILINE).group()
+
+    path = pack(sample_folder, tmp_path, base=base)
+
+    # Every compressed entry comes from the base (copy.img is a reference)
+    output = capsys.readouterr().out
+    assert reuse_counts(output) == (5, 0)
+    assert read_bytes(path) == read_bytes(base)
+    # Reused entries count towards the compression totals
+    assert re.search(r'^Compression: .*$', output, re.MULTILINE).group() == base_totals
+
+
+def test_base_recompresses_changed_files(sample_folder, tmp_path, capsys):
+    base = pack(sample_folder, tmp_path, name='base.bin')
+    write_tree(sample_folder, {'data/text/american.gxt': b'changed text\n' * 1000, 'data/new.txt': b'new file'})
+    capsys.readouterr()
+
+    path = pack(sample_folder, tmp_path, base=base)
+
+    assert reuse_counts(capsys.readouterr().out) == (4, 2)
+    assert read_bytes(path) == read_bytes(pack(sample_folder, tmp_path, name='fresh.bin'))
+    assert_round_trip(path, sample_folder, tmp_path)
+
+
+def test_base_matches_how_files_are_stored(sample_folder, tmp_path, capsys):
+    # A v1 base has no digests (computed by decoding it), no blocks and no
+    # stored entries: only ui.js.br (kept as-is) and empty.txt match, while
+    # main.scm, american.gxt and big.img are block-compressed now
+    base = pack(sample_folder, tmp_path, name='base.bin', format_version=ARCHIVE_VERSION_1)
+    capsys.readouterr()
+
+    path = pack(sample_folder, tmp_path, base=base, block_size=64 * 1024)
+
+    output = capsys.readouterr().out
+    assert 'Computing content digests of v1 base archive' in output
+    assert reuse_counts(output) == (2, 3)
+    assert_round_trip(path, sample_folder, tmp_path)
+
+
+@pytest.mark.parametrize('block_size', [0, 64 * 1024])
+def test_incompressible_files_are_stored(sample_folder, tmp_path, block_size):
+    path = pack(sample_folder, tmp_path, block_size=block_size)
+
+    assert_round_trip(path, sample_folder, tmp_path)
+    archive = PackedArchive(path)
+    asyncio.run(archive.init())
+    # big.img fails the sample trial and is never compressed, blocks or not
+    assert archive.is_stored_uncompressed('vcsky/models/big.img')
+    assert not archive.is_block_compressed('vcsky/models/big.img')
+    with open(path, 'rb') as f:
+        _, _, entries = read_archive_index(f.read())
+    entry = next(entry for entry in entries if entry.filename == 'big.img')
+    assert entry.file_type == FILE_TYPE_STORED
+    assert entry.compressed_size == len(SAMPLE_FILES['models/big.img'])
+    assert not archive.is_stored_uncompressed('vcsky/data/main.scm')
+    assert not archive.is_stored_uncompressed('vcsky/fetched/ui.js.br')
+    archive.close()
+
+
+def test_store_min_gain_zero_compresses_everything(sample_folder, tmp_path):
+    path = pack(sample_folder, tmp_path, store_min_gain=0)
+
+    assert_round_trip(path, sample_folder, tmp_path)
+    archive = PackedArchive(path)
+    asyncio.run(archive.init())
+    assert not any(archive.is_stored_uncompressed(name) for name in archive.list_files())
+    archive.close()
+
+
+def test_parse_codec_rules():
+    assert parse_codec_rules('zstd') == [('*', 'zstd')]
+    assert parse_codec_rules('raw:*.img,audio/*') == [('*.img', 'raw'), ('audio/*', 'raw')]
+    with pytest.raises(ValueError, match='Unknown codec'):
+        parse_codec_rules('lzma:*.img')
+    with pytest.raises(ValueError, match='v2'):
+        check_codec_rules(parse_codec_rules('raw'), ARCHIVE_VERSION_1)
+    check_codec_rules(parse_codec_rules('raw'), ARCHIVE_VERSION_2)
+
+
+def test_choose_codec_first_match_wins():
+    rules = parse_codec_rules('raw:vcsky/models/big.img') + parse_codec_rules('zstd:*.img')
+
+    assert choose_codec(rules, 'vcsky/models', 'big.img') == CODEC_RAW
+    assert choose_codec(rules, 'vcsky/models', 'copy.img') == CODEC_ZSTD
+    assert choose_codec(rules, 'vcsky/data', 'main.scm') == CODEC_BROTLI
+    assert choose_codec(None, 'vcsky/models', 'big.img') == CODEC_BROTLI
+
+
+def test_raw_codec_rule(sample_folder, tmp_path):
+    path = pack(sample_folder, tmp_path, codecs=parse_codec_rules('raw:*.scm,*.br'))
+
+    assert_round_trip(path, sample_folder, tmp_path)
+    archive = PackedArchive(path)
+    asyncio.run(archive.init())
+    assert archive.is_stored_uncompressed('vcsky/data/main.scm')
+    assert not archive.is_stored_uncompressed('vcsky/data/text/american.gxt')
+    # .br files are kept as they are whatever the rules say
+    assert not archive.is_stored_uncompressed('vcsky/fetched/ui.js.br')
+    archive.close()
+
+
+def test_zstd_codec_rule(sample_folder, tmp_path):
+    path = pack(sample_folder, tmp_path, codecs=parse_codec_rules('zstd:vcsky/data/*'))
+
+    assert_round_trip(path, sample_folder, tmp_path)
+    archive = PackedArchive(path)
+    asyncio.run(archive.init())
+    assert archive.is_zstd_compressed('vcsky/data/main.scm')
+    assert archive.is_zstd_compressed('vcsky/data/text/american.gxt')
+    assert not archive.is_zstd_compressed('vcsky/models/big.img')
+    archive.close()
+
+
+
+def test_unpack_target_uses_zstd(sample_folder, tmp_path):
+    path = pack(sample_folder, tmp_path, codecs=parse_codec_rules('raw:*.scm') + CODEC_TARGETS['unpack'])
+
+    assert_round_trip(path, sample_folder, tmp_path)
+    archive = PackedArchive(path)
+    asyncio.run(archive.init())
+    assert archive.is_zstd_compressed('vcsky/data/text/american.gxt')
+    # Explicit rules come first; incompressible and .br files keep their storage
+    assert archive.is_stored_uncompressed('vcsky/data/main.scm')
+    assert archive.is_stored_uncompressed('vcsky/models/big.img')
+    assert not archive.is_zstd_compressed('vcsky/fetched/ui.js.br')
+    archive.close()
+
+
+def test_zstd_archive_without_zstandard_fails_at_load(sample_folder, tmp_path, monkeypatch):
+    path = pack(sample_folder, tmp_path, codecs=CODEC_TARGETS['unpack'])
+    brotli_only = pack(sample_folder, tmp_path, name='brotli.bin')
+    monkeypatch.setattr(packer_brotli, 'zstandard', None)
+
+    with pytest.raises(RuntimeError, match='zstandard'):
+        asyncio.run(PackedArchive(path).init())
+    archive = PackedArchive(brotli_only)
+    asyncio.run(archive.init())
+    archive.close()
+
+def schedule_tasks(tmp_path, sizes):
+    """CompressTask of a file of each {name: size}, in archive order."""
+    folder = write_tree(str(tmp_path / 'files'), {name: b'x' * size for name, size in sizes.items()})
+    return [CompressTask(os.path.join(folder, name), 'files', name) for name in sizes]
+
+
+def run_schedule(schedule):
+    """Drive a PackSchedule to the end, finishing files in submission order; returns (submissions, peak held bytes)."""
+    submissions = []
+    running = []
+    peak = 0
+    while not schedule.done():
+        admitted = schedule.admit()
+        submissions.append(admitted)
+        running.extend(admitted)
+        peak = max(peak, schedule.held_bytes)
+        assert schedule.running <= schedule.max_pending + 1  # the head may go over
+        schedule.finish(running.pop(0))
+        while schedule.head_ready():
+            schedule.take_head()
+    return submissions, peak
+
+
+def test_schedule_submits_costliest_first(tmp_path):
+    # .br files are copied, not compressed: the big one is cheap
+    tasks = schedule_tasks(tmp_path, {'a.txt': 10_000, 'b.img': 300_000, 'c.js.br': 500_000, 'd.txt': 200_000})
+    schedule = PackSchedule(tasks, max_pending=2)
+
+    submissions, _ = run_schedule(schedule)
+
+    # Two slots go to the costliest files; the head (a.txt) is always submitted
+    assert submissions[0] == [1, 3, 0]
+    order = [index for admitted in submissions for index in admitted]
+    assert sorted(order) == [0, 1, 2, 3]
+    assert order.index(2) == 3
+
+
+def test_schedule_window_bound(tmp_path, monkeypatch):
+    monkeypatch.setattr(packer_brotli, 'PACK_WINDOW_BYTES', 250_000)
+    tasks = schedule_tasks(tmp_path, {'a.txt': 10_000, 'b.img': 300_000, 'c.txt': 100_000, 'd.txt': 200_000})
+    schedule = PackSchedule(tasks, max_pending=8)
+
+    submissions, peak = run_schedule(schedule)
+
+    # b.img exceeds the window alone and still goes first; nothing fits next
+    # to it but the head. Once it's written, d.txt fills the window and
+    # c.txt only goes as the new head.
+    assert submissions == [[1, 0], [], [3, 2], []]
+    assert peak == 300_000 + 10_000
+
+
+def test_pack_folders_deduplicates_across_roots(sample_folder, tmp_path):
+    # A second root holding a copy of big.img and of the whole data folder
+    bonus = write_tree(str(tmp_path / 'bonus'), {
+        'models/shared.img': SAMPLE_FILES['models/big.img'],
+        'data/main.scm': SAMPLE_FILES['data/main.scm'],
+        'data/text/american.gxt': SAMPLE_FILES['data/text/american.gxt'],
+        'readme.txt': b'bonus content',
+    })
+    path = str(tmp_path / 'both.bin')
+    pack_folders([sample_folder, bonus], path, max_workers=1)
+
+    out = tmp_path / 'unpacked'
+    unpack_file(path, str(out))
+    assert read_tree(str(out / 'vcsky')) == read_tree(sample_folder)
+    assert read_tree(str(out / 'bonus')) == read_tree(bonus)
+    # Duplicates in different roots are stored once: vcsky/data is a copy of
+    # bonus/data and big.img a reference to shared.img
+    with open(path, 'rb') as f:
+        _, folders, entries = read_archive_index(f.read())
+    assert ('vcsky/data', 'bonus/data') in folders
+    big = next(entry for entry in entries if entry.filename == 'big.img')
+    assert big.file_type == FILE_TYPE_REFERENCE
+    assert (big.ref_folder, big.ref_filename) == ('bonus/models', 'shared.img')
+    assert sum(entry.compressed_size for entry in entries) < len(SAMPLE_FILES['models/big.img']) + 10_000
+
+    async_path = str(tmp_path / 'both-async.bin')
+    asyncio.run(pack_folders_async([sample_folder, bonus], async_path, max_workers=1))
+    assert read_bytes(async_path) == read_bytes(path)
+
+
+def test_pack_folders_rejects_duplicate_names(sample_folder, tmp_path):
+    other = write_tree(str(tmp_path / 'other' / 'vcsky'), {'readme.txt': b'same name'})
+
+    with pytest.raises(ValueError):
+        pack_folders([sample_folder, other], str(tmp_path / 'both.bin'), max_workers=1)
+
+
+def test_add_folder(sample_folder, tmp_path):
+    extra = write_tree(str(tmp_path / 'extra'), {'maps/level.dat': b'level ' * 5000, 'readme.txt': b'extra'})
+    path = pack(sample_folder, tmp_path)
+    async_path = str(tmp_path / 'async.bin')
+    shutil.copy(path, async_path)
+
+    add_folder(path, extra, max_workers=1)
+    asyncio.run(add_folder_async(async_path, extra, max_workers=1))
+
+    assert read_bytes(async_path) == read_bytes(path)
+    files = read_archive(path)
+    assert files['extra/maps/level.dat'] == b'level ' * 5000
+    assert files['vcsky/data/main.scm'] == SAMPLE_FILES['data/main.scm']
+
+
+def test_failed_pack_stops_compression(sample_folder, tmp_path, monkeypatch):
+    generators = []
+    iter_compressed = packer_brotli.iter_compressed
+    file_data = packer_brotli.ArchiveWriter.file_data
+
+    def recording_iter_compressed(*args, **kwargs):
+        generators.append(iter_compressed(*args, **kwargs))
+        return generators[-1]
+
+    def failing_file_data(self, filename, data, digest=None):
+        if filename == 'main.scm':
+            raise OSError('disk full')
+        return file_data(self, filename, data, digest)
+
+    monkeypatch.setattr(packer_brotli, 'iter_compressed', recording_iter_compressed)
+    monkeypatch.setattr(packer_brotli.ArchiveWriter, 'file_data', failing_file_data)
+
+    previous = tmp_path / 'packed.bin'
+    previous.write_bytes(b'previous archive')
+
+    with pytest.raises(OSError, match='disk full'):
+        pack(sample_folder, tmp_path)
+    # Closed on the way out (its futures cancelled), not left for the garbage collector
+    assert generators[0].gi_frame is None
+    # The archive being replaced is untouched and the partial one removed
+    assert previous.read_bytes() == b'previous archive'
+    assert sorted(os.listdir(tmp_path)) == ['packed.bin', 'vcsky']
+
+
+def test_pack_over_its_base(sample_folder, tmp_path):
+    path = pack(sample_folder, tmp_path)
+    before = read_bytes(path)
+
+    pack(sample_folder, tmp_path, base=path)
+
+    assert read_bytes(path) == before
+
+
+def test_output_does_not_depend_on_window_or_workers(sample_folder, tmp_path, monkeypatch):
+    write_tree(sample_folder, {f'more/file{i}.txt': b'line %d\n' % i * (1000 + 300 * i) for i in range(8)})
+    default = read_bytes(pack(sample_folder, tmp_path, name='default.bin'))
+
+    parallel = str(tmp_path / 'parallel.bin')
+    pack_folder(sample_folder, parallel, max_workers=3)
+    assert read_bytes(parallel) == default
+
+    # The smallest window: one file beside the head, results waiting for their turn
+    monkeypatch.setattr(packer_brotli, 'PACK_WINDOW_PER_WORKER', 1)
+    monkeypatch.setattr(packer_brotli, 'PACK_WINDOW_BYTES', 0)
+    assert read_bytes(pack(sample_folder, tmp_path, name='window1.bin')) == default
+
+
+@pytest.mark.parametrize('store_min_gain', [packer_brotli.STORE_MIN_GAIN, 0])
+def test_segmented_compression_is_byte_identical(sample_folder, tmp_path, monkeypatch, store_min_gain):
+    block_size = 16 * 1024
+    whole = read_bytes(pack(sample_folder, tmp_path, name='whole.bin', block_size=block_size,
+                            store_min_gain=store_min_gain))
+    monkeypatch.setattr(packer_brotli, 'SEGMENT_TASK_BYTES', 2 * block_size)
+    # Segment tasks run in worker processes: count them where they are submitted
+    segment_tasks = []
+    start_compression = packer_brotli._start_compression
+
+    def counting_start_compression(submit, task, size, passed_trial=True):
+        def counting_submit(fn, *args):
+            if fn is packer_brotli.compress_segment_task:
+                segment_tasks.append(task.filename)
+            return submit(fn, *args)
+        return start_compression(counting_submit, task, size, passed_trial)
+
+    monkeypatch.setattr(packer_brotli, '_start_compression', counting_start_compression)
+    path = pack(sample_folder, tmp_path, block_size=block_size, store_min_gain=store_min_gain)
+
+    # main.scm (140000 bytes) is compressed in 5 segments of up to 2 blocks,
+    # and the result is the same as compressing it whole
+    assert segment_tasks.count('main.scm') == 5
+    assert read_bytes(path) == whole
+    assert_round_trip(path, sample_folder, tmp_path)
+    # big.img fails the store trial: stored, not segmented (unless storing is off)
+    assert segment_tasks.count('big.img') == (0 if store_min_gain else 50)
+
+
+def test_find_duplicates(tmp_path, monkeypatch):
+    same_a, same_b = b'A' * 1000, b'B' * 500
+    folder = write_tree(str(tmp_path / 'game'), {
+        'a/x.bin': same_a, 'a/y.bin': same_b, 'a/sub/k.txt': b'k' * 64,
+        'b/x.bin': same_a, 'b/y.bin': same_b, 'b/sub/k.txt': b'k' * 64,  # copy of a, sub included
+        'c/x.bin': b'C' * 1000,  # same size as a/x.bin, different content
+        'c/z.bin': same_a,
+        'd/y2.bin': same_b, 'd/unique.bin': b'U' * 777,
+        'e/x.bin': same_a, 'e/y.bin': same_b, 'e/extra.bin': b'Z' * 3,  # a plus one file: not a copy
+        'f/t.txt': b'q', 'g/t.txt': b'q',
+    })
+    hashed = []
+    hash_files = packer_brotli.hash_files
+
+    def recording_hash_files(paths, max_workers=None):
+        hashed.extend(os.path.relpath(path, folder).replace(os.sep, '/') for path in paths)
+        return hash_files(paths, max_workers)
+
+    monkeypatch.setattr(packer_brotli, 'hash_files', recording_hash_files)
+
+    results = [find_duplicates(folder, str(tmp_path), max_workers) for max_workers in (1, 3)]
+
+    assert results[0] == results[1]
+    folder_duplicates, file_duplicates = results[0]
+    assert folder_duplicates == {'game/b': 'game/a', 'game/b/sub': 'game/a/sub', 'game/g': 'game/f'}
+    assert file_duplicates == {
+        ('game/c', 'z.bin'): ('game/a', 'x.bin'),
+        ('game/d', 'y2.bin'): ('game/a', 'y.bin'),
+        ('game/e', 'x.bin'): ('game/a', 'x.bin'),
+        ('game/e', 'y.bin'): ('game/a', 'y.bin'),
+    }
+    # Files of a size no other file has are never read
+    assert 'd/unique.bin' not in hashed and 'e/extra.bin' not in hashed
+    assert 'c/x.bin' in hashed
+
+
+def archive_layout(path):
+    """(format version, archive paths of the stored entries in file order)."""
+    with open(path, 'rb') as f:
+        version, _, entries = read_archive_index(f.read())
+    stored = sorted((entry for entry in entries if entry.file_type != FILE_TYPE_REFERENCE),
+                    key=lambda entry: entry.data_offset)
+    return version, [f'{entry.folder}/{entry.filename}' for entry in stored]
+
+
+@pytest.mark.parametrize('format_version', [ARCHIVE_VERSION_1, ARCHIVE_VERSION_2])
+def test_repack_in_trace_order(sample_folder, tmp_path, capsys, format_version):
+    path = pack(sample_folder, tmp_path, name='original.bin', format_version=format_version)
+    trace = tmp_path / 'boot.trace'
+    trace.write_text('# boot\n/vcsky/models/big.img\nvcsky/models/copy.img\nvcsky/missing.txt\n\n'
+                     'vcsky/data/text/american.gxt\nvcsky/models/big.img\n')
+    output = str(tmp_path / 'packed.bin')
+    capsys.readouterr()
+
+    repack_archive(path, str(trace), output)
+
+    assert 'Trace: 4 paths, 3 stored entries' in capsys.readouterr().out
+    assert archive_layout(output)[0] == format_version
+    # Traced entries first (copy.img is a reference to main.scm), then the rest in archive order
+    traced = ['vcsky/models/big.img', 'vcsky/data/main.scm', 'vcsky/data/text/american.gxt']
+    assert archive_layout(output)[1] == traced + [name for name in archive_layout(path)[1] if name not in traced]
+    assert_round_trip(output, sample_folder, tmp_path)
+
+
+def entry_sizes(path):
+    """{archive path: compressed size} of the stored entries."""
+    with open(path, 'rb') as f:
+        _, _, entries = read_archive_index(f.read())
+    return {f'{entry.folder}/{entry.filename}': entry.compressed_size
+            for entry in entries if entry.file_type != FILE_TYPE_REFERENCE}
+
+
+def test_profile_is_planned_once_then_reused(sample_folder, tmp_path, capsys):
+    profile = tmp_path / 'vcsky.profile.json'
+    first = pack(sample_folder, tmp_path, name='first.bin', profile=str(profile))
+
+    assert 'Planning compression profiles for 3 extension(s)' in capsys.readouterr().out
+    saved = json.loads(profile.read_text())
+    # .br files are never recompressed; .txt has too little data to plan
+    assert saved['version'] == 1 and sorted(saved['extensions']) == ['.gxt', '.img', '.scm']
+    assert_round_trip(first, sample_folder, tmp_path)
+
+    # Edited choices are kept as they are, not planned again
+    saved['extensions']['.gxt'].update(quality=1, mode='generic')
+    profile.write_text(json.dumps(saved))
+    second = pack(sample_folder, tmp_path, name='second.bin', profile=str(profile))
+
+    assert 'Planning compression profiles' not in capsys.readouterr().out
+    assert json.loads(profile.read_text()) == saved
+    assert entry_sizes(second)['vcsky/data/text/american.gxt'] != entry_sizes(first)['vcsky/data/text/american.gxt']
+    assert entry_sizes(second)['vcsky/data/main.scm'] == entry_sizes(first)['vcsky/data/main.scm']
+    shutil.rmtree(tmp_path / 'unpacked')
+    assert_round_trip(second, sample_folder, tmp_path)
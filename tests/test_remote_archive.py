@@ -0,0 +1,117 @@
+"""Remote archives ("http" backend) served by the local Range server."""
+
+import asyncio
+import os
+import shutil
+
+import pytest
+
+from range_server import RangeServer, file_etag
+from utils.packer_brotli import PackedArchive, RemoteArchiveReader, pack_folder
+
+CHUNK = RemoteArchiveReader.CHUNK_SIZE
+
+
+@pytest.fixture
+def served(sample_folder, tmp_path):
+    """(server, archive URL, served file): the sample folder packed and served over HTTP."""
+    root = tmp_path / 'srv'
+    root.mkdir()
+    pack_folder(sample_folder, str(root / 'packed.bin'), max_workers=1)
+    with RangeServer(str(root)) as server:
+        yield server, server.url('packed.bin'), str(root / 'packed.bin')
+
+
+def spans(server):
+    """(start, end) of every ranged GET, end exclusive."""
+    result = []
+    for header in server.range_requests():
+        first, last = header[len('bytes='):].split('-')
+        result.append((int(first), int(last) + 1))
+    return result
+
+
+def remote_archive(url, tmp_path):
+    return PackedArchive(url, backend='http', remote_cache_path=str(tmp_path / 'cache' / 'packed.bin.cache'))
+
+
+def test_startup_fetches_only_header_and_index(served, tmp_path):
+    server, url, path = served
+    archive = remote_archive(url, tmp_path)
+    asyncio.run(archive.init())
+    size = os.path.getsize(path)
+
+    assert archive.index_source == 'remote'
+    assert archive.exists('vcsky/models/big.img')
+    stats = archive.stats()['remote']
+    # The first chunk (header), then the tail holding the index
+    assert stats['requests'] == 2
+    assert stats['chunks'] >= 7 and stats['chunks_cached'] <= 3
+    assert spans(server)[0] == (0, CHUNK)
+    assert spans(server)[-1][1] == size
+    archive.close()
+
+
+def test_reads_fetch_whole_chunks(served, sample_folder, tmp_path):
+    server, url, path = served
+    archive = remote_archive(url, tmp_path)
+    asyncio.run(archive.init())
+    before = len(server.range_requests())
+
+    data = asyncio.run(archive.read_decoded('vcsky/models/big.img'))
+
+    with open(os.path.join(sample_folder, 'models', 'big.img'), 'rb') as f:
+        assert bytes(data) == f.read()
+    size = os.path.getsize(path)
+    fetched = spans(server)[before:]
+    assert fetched
+    for start, end in fetched:
+        assert start % CHUNK == 0
+        assert end % CHUNK == 0 or end == size
+    archive.close()
+
+
+def test_cache_is_reused_after_restart(served, tmp_path):
+    server, url, path = served
+    archive = remote_archive(url, tmp_path)
+    asyncio.run(archive.init())
+    first = asyncio.run(archive.read_decoded('vcsky/data/main.scm'))
+    archive.close()
+    before = len(server.range_requests())
+
+    restarted = remote_archive(url, tmp_path)
+    asyncio.run(restarted.init())
+    second = asyncio.run(restarted.read_decoded('vcsky/data/main.scm'))
+
+    assert bytes(second) == bytes(first)
+    # Only open()'s check of the first chunk: index and entry come from the cache
+    assert len(server.range_requests()) - before == 1
+    assert restarted.stats()['remote']['chunks_cached'] >= 2
+    restarted.close()
+
+
+def test_changed_remote_file_fails_reads_and_drops_cache(served, tmp_path):
+    server, url, path = served
+    archive = remote_archive(url, tmp_path)
+    asyncio.run(archive.init())
+    etag = file_etag(path)
+
+    # Replace the served archive by another one of the same size
+    with open(path, 'rb') as f:
+        data = bytearray(f.read())
+    data[CHUNK * 2] ^= 0xFF
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data)
+    shutil.move(path + '.tmp', path)
+
+    with pytest.raises(IOError):
+        asyncio.run(archive.read_decoded('vcsky/models/big.img'))
+    # The ranged GET carried the validator seen at startup; the server sent the new file instead
+    assert server.requests[-1][2]['If-Range'] == etag
+    assert not asyncio.run(archive.remote_reader.is_current())
+    archive.close()
+
+    restarted = remote_archive(url, tmp_path)
+    asyncio.run(restarted.init())
+    assert restarted.stats()['remote']['requests'] == 2  # header and index fetched again
+    restarted.close()
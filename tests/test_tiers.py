@@ -0,0 +1,62 @@
+"""AssetTiers: which tier answers, and each tier looked up once."""
+
+import pytest
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
+from fastapi.testclient import TestClient
+
+import additions.tiers as tiers
+from additions.tiers import AssetTiers
+
+
+@pytest.fixture
+def route(tmp_path, monkeypatch):
+    """(client, tiers, lookups, proxied) for a "vcsky" route with a cache directory."""
+    lookups = []
+    proxied = []
+    get_local_file = tiers.get_local_file
+
+    def counting_get_local_file(path, request=None):
+        lookups.append(path)
+        return get_local_file(path, request)
+
+    async def fake_proxy_and_cache(request, url, local_path=None, disable_cache=False, lookup=True):
+        proxied.append((url, local_path, lookup))
+        return Response(b'upstream')
+
+    monkeypatch.setattr(tiers, 'get_local_file', counting_get_local_file)
+    monkeypatch.setattr(tiers, 'proxy_and_cache', fake_proxy_and_cache)
+    vcsky = AssetTiers('vcsky', 'https://cdn.example/vcsky/', cache_dir=str(tmp_path / 'cache'))
+    app = FastAPI()
+
+    @app.get('/vcsky/{path:path}')
+    async def serve(request: Request, path: str):
+        return await vcsky.resolve(request, path)
+
+    return TestClient(app), vcsky, lookups, proxied
+
+
+def test_cached_file_is_served_from_the_cache(route, tmp_path):
+    client, vcsky, lookups, proxied = route
+    (tmp_path / 'cache' / 'data').mkdir(parents=True)
+    (tmp_path / 'cache' / 'data' / 'main.scm').write_bytes(b'cached')
+
+    response = client.get('/vcsky/data/main.scm')
+
+    assert response.content == b'cached'
+    assert vcsky.hits['cache'] == 1 and vcsky.hits['upstream'] == 0
+    assert len(lookups) == 1
+    assert proxied == []
+
+
+def test_cache_miss_is_looked_up_once(route, tmp_path):
+    client, vcsky, lookups, proxied = route
+
+    response = client.get('/vcsky/data/main.scm')
+
+    assert response.content == b'upstream'
+    assert vcsky.hits['upstream'] == 1
+    cache_path = str(tmp_path / 'cache' / 'data' / 'main.scm')
+    assert lookups == [cache_path]
+    # proxy_and_cache() still caches the file, without looking it up again
+    assert proxied == [('https://cdn.example/vcsky/data/main.scm', cache_path, False)]
@@ -0,0 +1,547 @@
+"""
+Benchmarks for packed archives.
+
+Usage:
+    python utils/bench_packed.py index [--files N] [--copies N] [--per-folder N]
+    python utils/bench_packed.py layout [--files N] [--size KB] [--boot N] [--runs N] [--dir PATH]
+    python utils/bench_packed.py scan [--files N] [--dups N] [--size KB] [--workers N] [--dir PATH]
+    python utils/bench_packed.py segments [--size MB] [--block-size KB] [--small N] [--workers N] [--dir PATH]
+
+index: Builds a synthetic v2 archive with many small entries and copy folders,
+then compares the retained memory and load time of PackedArchive's compact
+index with the previous dict-of-FileEntry index (copy folders expanded).
+
+layout: Builds an archive of incompressible files and a boot trace touching a
+random subset of them, repacks the archive in trace order, then replays the
+trace against both archives with a cold page cache (evicted with
+posix_fadvise before every run). --dir should be on the disk to measure;
+tmpfs has no cold cache.
+
+scan: Builds a folder tree of files with mostly distinct sizes plus some
+duplicate files and folders, then times find_duplicates() (size grouping,
+parallel hashing of size-colliding files) against the previous scanner
+(single-core MD5 of every file) and checks that both find the same
+duplicates. Files are read warm from the page cache.
+
+segments: Builds a tree with one giant compressible file and some small
+ones, then packs it block-compressed twice: with the giant file's blocks
+compressed by one worker (the previous scheduling) and split into segments
+compressed across the pool. Both archives must be identical; the speedup
+is bounded by --workers (and the cores available).
+"""
+
+import asyncio
+import contextlib
+import gc
+import hashlib
+import io
+import mmap
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List, Tuple
+
+import brotli
+
+# Script is in /utils, so project root is one level up
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.dirname(SCRIPT_DIR)
+sys.path.insert(0, PROJECT_ROOT)
+
+from utils import packer_brotli
+from utils.packer_brotli import (
+    ArchiveWriter, FileEntry, PackedArchive, TRAILER_STRUCT, FILE_TYPE_REFERENCE,
+    content_digest, decode_index, find_duplicates, pack_folder, parse_trailer, read_archive_index,
+    repack_archive, should_ignore_file, uleb128_size,
+)
+
+
+# ============== SYNTHETIC ARCHIVE ==============
+
+def build_index_archive(path: str, num_files: int, num_copies: int, per_folder: int) -> Tuple[int, int]:
+    """
+    Write a v2 archive of num_files tiny files in folders of per_folder files,
+    plus num_copies copy folders of the first folders.
+
+    Returns:
+        (number of paths in the archive, archive size in bytes)
+    """
+    writer = ArchiveWriter()
+    folders = []
+    with open(path, 'wb') as out:
+        out.write(writer.header())
+        for start in range(0, num_files, per_folder):
+            folder = f"vcsky/fetched/data{len(folders):05d}"
+            folders.append(folder)
+            count = min(per_folder, num_files - start)
+            out.write(writer.begin_folder(folder, count))
+            for i in range(start, start + count):
+                content = f"file {i}\n".encode()
+                # Lowest quality: only the index matters here
+                compressed = brotli.compress(content, quality=0)
+                for chunk in writer.file_data(f"file{i:07d}.dat", compressed, content_digest(content)):
+                    out.write(chunk)
+        for i in range(num_copies):
+            out.write(writer.copy_folder(f"vcsky/fetched/copy{i:05d}", folders[i % len(folders)]))
+        out.write(writer.finish())
+    copied = sum(min(per_folder, num_files - (i % len(folders)) * per_folder) for i in range(num_copies))
+    return num_files + copied, os.path.getsize(path)
+
+
+# ============== LEGACY INDEX ==============
+
+class LegacyIndex:
+    """The index PackedArchive kept before the compact one: a FileEntry per path."""
+
+    def __init__(self, path: str):
+        self._path = path
+        self._entries: Dict[str, FileEntry] = {}
+        self._folders: Dict[str, List[str]] = {}
+        self._folder_copies: Dict[str, str] = {}
+
+    def load(self) -> None:
+        with open(self._path, 'rb') as f:
+            f.seek(-TRAILER_STRUCT.size, os.SEEK_END)
+            index_offset, index_size, _, flags = parse_trailer(f.read(TRAILER_STRUCT.size))
+            f.seek(index_offset)
+            folders, entries = decode_index(f.read(index_size), flags)
+
+        for folder_name, source_name in folders:
+            self._folders[folder_name] = []
+
+        for entry in entries:
+            self._folders[entry.folder].append(entry.filename)
+            self._entries[f"{entry.folder}/{entry.filename}"] = entry
+
+        for folder_name, source_name in folders:
+            if source_name is None:
+                continue
+            self._folder_copies[folder_name] = source_name
+            if source_name not in self._folders:
+                del self._folders[folder_name]
+                continue
+            self._folders[folder_name] = list(self._folders[source_name])
+            for filename in self._folders[source_name]:
+                src_entry = self._entries.get(f"{source_name}/{filename}")
+                if src_entry is not None:
+                    self._entries[f"{folder_name}/{filename}"] = FileEntry(
+                        folder=folder_name,
+                        filename=filename,
+                        file_type=src_entry.file_type,
+                        data_offset=src_entry.data_offset,
+                        compressed_size=src_entry.compressed_size,
+                        ref_folder=src_entry.ref_folder,
+                        ref_filename=src_entry.ref_filename,
+                        blocks=src_entry.blocks,
+                        digest=src_entry.digest
+                    )
+
+    def file_count(self) -> int:
+        return len(self._entries)
+
+
+# ============== MEASUREMENT ==============
+
+def measure(load) -> Tuple[object, int, float]:
+    """
+    Run load() once untraced for timing, then again under tracemalloc.
+
+    Returns:
+        (loaded object, bytes still allocated afterwards, seconds taken)
+    """
+    gc.collect()
+    start = time.perf_counter()
+    load()
+    elapsed = time.perf_counter() - start
+
+    gc.collect()
+    tracemalloc.start()
+    loaded = load()
+    gc.collect()
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return loaded, retained, elapsed
+
+
+def load_compact(path: str) -> PackedArchive:
+    archive = PackedArchive(path)
+    asyncio.run(archive.init())
+    return archive
+
+
+def load_legacy(path: str) -> LegacyIndex:
+    index = LegacyIndex(path)
+    index.load()
+    return index
+
+
+def bench_index(num_files: int, num_copies: int, per_folder: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "index.bin")
+        print(f"Building archive: {num_files} files, {num_copies} copy folders...")
+        num_paths, size = build_index_archive(path, num_files, num_copies, per_folder)
+        print(f"  {num_paths} paths, {size / 1024 / 1024:.1f} MB")
+
+        legacy, legacy_bytes, legacy_time = measure(lambda: load_legacy(path))
+        compact, compact_bytes, compact_time = measure(lambda: load_compact(path))
+        assert legacy.file_count() == compact.file_count() == num_paths
+        compact.close()
+
+        print()
+        print(f"{'index':<10} {'memory':>12} {'per path':>10} {'load':>9}")
+        for name, retained, elapsed in (("legacy", legacy_bytes, legacy_time),
+                                         ("compact", compact_bytes, compact_time)):
+            print(f"{name:<10} {retained / 1024 / 1024:>9.1f} MB {retained / num_paths:>8.0f} B "
+                  f"{elapsed * 1000:>6.0f} ms")
+        print(f"\nMemory reduction: {legacy_bytes / compact_bytes:.1f}x")
+
+
+# ============== LAYOUT (COLD CACHE) ==============
+
+READ_AHEAD_WINDOW = 128 * 1024  # Default Linux read-ahead, for the window count
+
+
+def build_layout_archive(path: str, num_files: int, file_size: int, per_folder: int) -> List[str]:
+    """
+    Write a v2 archive of num_files incompressible files of file_size bytes.
+
+    Returns:
+        The archive paths in archive (os.walk-like) order
+    """
+    rng = random.Random(1)
+    writer = ArchiveWriter()
+    paths = []
+    with open(path, 'wb') as out:
+        out.write(writer.header())
+        for start in range(0, num_files, per_folder):
+            folder = f"vcsky/fetched/data{start // per_folder:04d}"
+            count = min(per_folder, num_files - start)
+            out.write(writer.begin_folder(folder, count))
+            for i in range(start, start + count):
+                content = rng.randbytes(file_size)
+                for chunk in writer.file_data(f"file{i:06d}.dat", brotli.compress(content, quality=0),
+                                              content_digest(content)):
+                    out.write(chunk)
+                paths.append(f"{folder}/file{i:06d}.dat")
+        out.write(writer.finish())
+    return paths
+
+
+def trace_extents(path: str, trace: List[str]) -> List[Tuple[int, int]]:
+    """(offset, size) of the stored data read for each traced path, in trace order."""
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        _, _, entries = read_archive_index(data)
+    by_path = {f"{e.folder}/{e.filename}": e for e in entries if e.file_type != FILE_TYPE_REFERENCE}
+    return [(by_path[p].data_offset, by_path[p].compressed_size) for p in trace]
+
+
+def layout_metrics(extents: List[Tuple[int, int]]) -> Tuple[int, int, int]:
+    """
+    Returns:
+        (seeks: reads starting before the previous one ended or more than a
+        read-ahead window after it, total seek distance in bytes, distinct
+        READ_AHEAD_WINDOW-sized windows touched)
+    """
+    seeks = distance = 0
+    position = None
+    windows = set()
+    for offset, size in extents:
+        if position is not None and not position <= offset <= position + READ_AHEAD_WINDOW:
+            seeks += 1
+            distance += abs(offset - position)
+        position = offset + size
+        windows.update(range(offset // READ_AHEAD_WINDOW, (offset + max(size, 1) - 1) // READ_AHEAD_WINDOW + 1))
+    return seeks, distance, len(windows)
+
+
+def drop_page_cache(path: str) -> bool:
+    """Evict the file from the page cache; False if the platform can't."""
+    if not hasattr(os, 'posix_fadvise'):
+        return False
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return True
+
+
+async def replay_trace(path: str, trace: List[str]) -> float:
+    """Open the archive and read the stored data of every traced path in order; seconds taken."""
+    start = time.perf_counter()
+    archive = PackedArchive(path, backend="pread", index_cache=False)
+    await archive.init()
+    for archive_path in trace:
+        await archive.read_file(archive_path, keep_brotli=True)
+    elapsed = time.perf_counter() - start
+    archive.close()
+    return elapsed
+
+
+def bench_layout(num_files: int, file_size: int, boot_files: int, runs: int, directory: str) -> None:
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        original = os.path.join(tmp, "walk-order.bin")
+        repacked = os.path.join(tmp, "trace-order.bin")
+        trace_file = os.path.join(tmp, "boot.trace")
+
+        print(f"Building archive: {num_files} files of {file_size // 1024} KB in {tmp}...")
+        paths = build_layout_archive(original, num_files, file_size, per_folder=100)
+        trace = random.Random(2).sample(paths, min(boot_files, len(paths)))
+        with open(trace_file, 'w', encoding='utf-8') as f:
+            f.write("\n".join(trace) + "\n")
+        repack_archive(original, trace_file, repacked)
+
+        cold = all(drop_page_cache(path) for path in (original, repacked))
+        if not cold:
+            print("Warning: posix_fadvise is unavailable, timings are warm-cache")
+
+        timings: Dict[str, List[float]] = {original: [], repacked: []}
+        for _ in range(runs):
+            for path in (original, repacked):
+                drop_page_cache(path)
+                timings[path].append(asyncio.run(replay_trace(path, trace)))
+
+        boot_bytes = sum(size for _, size in trace_extents(original, trace))
+        print(f"\nBoot trace: {len(trace)} files, {boot_bytes / 1024 / 1024:.1f} MB, median of {runs} cold runs")
+        print(f"{'layout':<12} {'time':>9} {'MB/s':>8} {'seeks':>7} {'seek dist':>10} {'RA windows':>11}")
+        for name, path in (("walk order", original), ("trace order", repacked)):
+            elapsed = statistics.median(timings[path])
+            seeks, distance, windows = layout_metrics(trace_extents(path, trace))
+            print(f"{name:<12} {elapsed * 1000:>6.0f} ms {boot_bytes / 1024 / 1024 / elapsed:>8.1f} "
+                  f"{seeks:>7} {distance / 1024 / 1024:>7.0f} MB {windows:>11}")
+        print(f"\nSpeedup: {statistics.median(timings[original]) / statistics.median(timings[repacked]):.1f}x")
+
+
+# ============== DUPLICATE SCAN ==============
+
+def build_scan_tree(root: str, num_files: int, num_dups: int, file_size: int, per_folder: int) -> int:
+    """
+    Write num_files files of about file_size bytes (distinct sizes) in
+    folders of per_folder files, num_dups copies of some of them in a
+    separate folder, and one copy of the first folder.
+
+    Returns:
+        Total bytes written
+    """
+    rng = random.Random(3)
+    total = 0
+    contents = []
+    for i in range(num_files):
+        folder = os.path.join(root, "vcsky", "fetched", f"data{i // per_folder:04d}")
+        os.makedirs(folder, exist_ok=True)
+        content = rng.randbytes(file_size + i)
+        with open(os.path.join(folder, f"file{i:06d}.dat"), 'wb') as f:
+            f.write(content)
+        contents.append(content)
+        total += len(content)
+    dup_folder = os.path.join(root, "vcsky", "dups")
+    os.makedirs(dup_folder, exist_ok=True)
+    for i in range(num_dups):
+        content = contents[rng.randrange(num_files)]
+        with open(os.path.join(dup_folder, f"dup{i:06d}.dat"), 'wb') as f:
+            f.write(content)
+        total += len(content)
+    first_folder = os.path.join(root, "vcsky", "fetched", "data0000")
+    copy_folder = os.path.join(root, "vcsky", "copy")
+    os.makedirs(copy_folder, exist_ok=True)
+    for filename in os.listdir(first_folder):
+        with open(os.path.join(first_folder, filename), 'rb') as src, \
+                open(os.path.join(copy_folder, filename), 'wb') as dst:
+            data = src.read()
+            dst.write(data)
+            total += len(data)
+    return total
+
+
+def legacy_find_duplicates(folder_path: str, parent_dir: str) -> Tuple[Dict[str, str], Dict[Tuple[str, str], Tuple[str, str]]]:
+    """The duplicate scan before size grouping: MD5 of every file on one core."""
+    def md5_file(path: str) -> str:
+        hasher = hashlib.md5()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b''):
+                hasher.update(chunk)
+        return hasher.hexdigest()
+
+    signatures: Dict[str, Dict[str, str]] = {}
+    all_files: Dict[str, List[Tuple[str, str, int]]] = {}
+    for root, dirs, files in os.walk(folder_path):
+        if not files:
+            continue
+        rel_path = os.path.relpath(root, parent_dir)
+        hashes = {}
+        for filename in sorted(files):
+            file_path = os.path.join(root, filename)
+            if should_ignore_file(filename) or not os.path.isfile(file_path):
+                continue
+            hashes[filename] = md5_file(file_path)
+            all_files.setdefault(hashes[filename], []).append((rel_path, filename, os.path.getsize(file_path)))
+        signatures[rel_path] = hashes
+
+    folder_duplicates: Dict[str, str] = {}
+    seen: Dict[Tuple, str] = {}
+    for rel_path in sorted(signatures):
+        key = tuple(sorted(signatures[rel_path].items()))
+        if key in seen:
+            folder_duplicates[rel_path] = seen[key]
+        else:
+            seen[key] = rel_path
+
+    file_duplicates: Dict[Tuple[str, str], Tuple[str, str]] = {}
+    for file_list in all_files.values():
+        if len(file_list) <= 1:
+            continue
+        file_list.sort()
+        source_folder, source_filename, _ = file_list[0]
+        if source_folder in folder_duplicates:
+            continue
+        for folder, filename, size in file_list[1:]:
+            if folder in folder_duplicates:
+                continue
+            ref_size = (1 + uleb128_size(len(source_folder.encode('utf-8'))) + len(source_folder.encode('utf-8')) +
+                        uleb128_size(len(source_filename.encode('utf-8'))) + len(source_filename.encode('utf-8')))
+            if ref_size < 1 + uleb128_size(size) + size:
+                file_duplicates[(folder, filename)] = (source_folder, source_filename)
+    return folder_duplicates, file_duplicates
+
+
+def bench_scan(num_files: int, num_dups: int, file_size: int, workers: int, directory: str) -> None:
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        print(f"Building tree: {num_files} files of {file_size // 1024} KB, {num_dups} duplicates in {tmp}...")
+        total = build_scan_tree(tmp, num_files, num_dups, file_size, per_folder=100)
+        root = os.path.join(tmp, "vcsky")
+        legacy_find_duplicates(root, tmp)  # warm the page cache
+
+        start = time.perf_counter()
+        legacy = legacy_find_duplicates(root, tmp)
+        legacy_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        current = find_duplicates(root, tmp, workers)
+        current_time = time.perf_counter() - start
+        assert legacy == current, "scanners disagree"
+
+        print(f"\nTree: {total / 1024 / 1024:.0f} MB, {len(current[0])} duplicate folder(s), "
+              f"{len(current[1])} duplicate file(s)")
+        print(f"{'scanner':<14} {'time':>9} {'MB/s':>8}")
+        for name, elapsed in (("legacy (md5)", legacy_time), ("size-grouped", current_time)):
+            print(f"{name:<14} {elapsed * 1000:>6.0f} ms {total / 1024 / 1024 / elapsed:>8.0f}")
+        print(f"\nSpeedup: {legacy_time / current_time:.1f}x")
+
+
+# ============== SEGMENTED COMPRESSION ==============
+
+def build_segment_tree(root: str, file_size: int, small_files: int) -> int:
+    """
+    Write one giant file of file_size bytes of text-like records (about 4:1
+    under brotli) and small_files small files next to it.
+
+    Returns:
+        Total bytes written
+    """
+    rng = random.Random(4)
+    words = [rng.randbytes(rng.randint(2, 8)).hex().encode('ascii') for _ in range(4000)]
+
+    def records(size: int) -> bytes:
+        out = bytearray()
+        while len(out) < size:
+            out += b' '.join(rng.choice(words) for _ in range(1000)) + b'\n'
+        return bytes(out[:size])
+
+    folder = os.path.join(root, "vcsky", "fetched")
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, "cuts.img"), 'wb') as f:
+        for start in range(0, file_size, 1024 * 1024):
+            f.write(records(min(1024 * 1024, file_size - start)))
+    for i in range(small_files):
+        with open(os.path.join(folder, f"small{i:04d}.dat"), 'wb') as f:
+            f.write(records(64 * 1024))
+    return file_size + small_files * 64 * 1024
+
+
+def bench_segments(file_size: int, block_size: int, small_files: int, workers: int, directory: str) -> None:
+    with tempfile.TemporaryDirectory(dir=directory) as tmp:
+        print(f"Building tree: one {file_size // 1024 // 1024} MB file, {small_files} files of 64 KB in {tmp}...")
+        total = build_segment_tree(tmp, file_size, small_files)
+        root = os.path.join(tmp, "vcsky")
+
+        timings: Dict[str, float] = {}
+        archives: Dict[str, str] = {}
+        segment_task_bytes = packer_brotli.SEGMENT_TASK_BYTES
+        for name, task_bytes in (("whole file", file_size), ("segmented", segment_task_bytes)):
+            archives[name] = os.path.join(tmp, name.replace(' ', '-') + ".bin")
+            packer_brotli.SEGMENT_TASK_BYTES = task_bytes
+            try:
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    pack_folder(root, archives[name], max_workers=workers, block_size=block_size)
+                timings[name] = time.perf_counter() - start
+            finally:
+                packer_brotli.SEGMENT_TASK_BYTES = segment_task_bytes
+        with open(archives["whole file"], 'rb') as a, open(archives["segmented"], 'rb') as b:
+            assert a.read() == b.read(), "archives differ"
+
+        segments = -(-file_size // (block_size * max(1, segment_task_bytes // block_size)))
+        print(f"\nTree: {total / 1024 / 1024:.0f} MB, {workers} workers, {block_size // 1024} KB blocks, "
+              f"{segments} segments for the giant file")
+        print(f"{'scheduling':<12} {'time':>9} {'MB/s':>8}")
+        for name, elapsed in timings.items():
+            print(f"{name:<12} {elapsed:>7.1f} s {total / 1024 / 1024 / elapsed:>8.2f}")
+        print(f"\nSpeedup: {timings['whole file'] / timings['segmented']:.1f}x (archives identical)")
+
+
+def parse_int_option(name: str, default: int) -> int:
+    if name not in sys.argv:
+        return default
+    return int(sys.argv[sys.argv.index(name) + 1])
+
+
+def parse_str_option(name: str, default: str) -> str:
+    if name not in sys.argv:
+        return default
+    return sys.argv[sys.argv.index(name) + 1]
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] not in ('index', 'layout', 'scan', 'segments'):
+        print(__doc__)
+        sys.exit(1)
+
+    if sys.argv[1] == 'index':
+        bench_index(
+            num_files=parse_int_option('--files', 100_000),
+            num_copies=parse_int_option('--copies', 200),
+            per_folder=parse_int_option('--per-folder', 100),
+        )
+    elif sys.argv[1] == 'scan':
+        bench_scan(
+            num_files=parse_int_option('--files', 2000),
+            num_dups=parse_int_option('--dups', 100),
+            file_size=parse_int_option('--size', 256) * 1024,
+            workers=parse_int_option('--workers', os.cpu_count() or 4),
+            directory=parse_str_option('--dir', PROJECT_ROOT),
+        )
+    elif sys.argv[1] == 'segments':
+        bench_segments(
+            file_size=parse_int_option('--size', 64) * 1024 * 1024,
+            block_size=parse_int_option('--block-size', 1024) * 1024,
+            small_files=parse_int_option('--small', 32),
+            workers=parse_int_option('--workers', os.cpu_count() or 4),
+            directory=parse_str_option('--dir', PROJECT_ROOT),
+        )
+    else:
+        bench_layout(
+            num_files=parse_int_option('--files', 4000),
+            file_size=parse_int_option('--size', 64) * 1024,
+            boot_files=parse_int_option('--boot', 400),
+            runs=parse_int_option('--runs', 3),
+            directory=parse_str_option('--dir', PROJECT_ROOT),
+        )
+
+
+if __name__ == "__main__":
+    main()
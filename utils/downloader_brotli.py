@@ -5,8 +5,9 @@ Downloads and unpacks directly to disk without saving intermediate .bin file.
 Shows detailed progress and statistics.
 Uses separate coroutines for downloading and unpacking with asyncio.Queue.
 
-This version uses packer_brotli format where individual files are brotli-compressed.
-The stream_unpack_async from packer_brotli automatically decompresses each file.
+This version uses packer_brotli format where individual files are brotli-compressed
+(or zstd-compressed, or stored raw). The stream_unpack_async from packer_brotli
+automatically decompresses each file with its codec.
 """
 
 import os
@@ -260,8 +261,9 @@ async def download_and_unpack_async(url: str, output_dir: str, chunk_size: int =
     Download a packed file (with brotli-compressed files) and unpack directly to disk (async).
     Uses separate tasks for downloading and unpacking with asyncio.Queue for buffering.
     
-    Individual files in the archive are brotli-compressed and will be decompressed
-    automatically by stream_unpack_async from packer_brotli.
+    Individual files in the archive are brotli- or zstd-compressed and will be
+    decompressed automatically by stream_unpack_async from packer_brotli (zstd
+    entries need the zstandard package).
     
     Args:
         url: URL of the packed .bin file  
@@ -283,10 +285,10 @@ async def download_and_unpack_async(url: str, output_dir: str, chunk_size: int =
                     if content_length:
                         print(f"📥 Downloading from {url}")
                         print(f"   Remote file size: {format_size(int(content_length))}")
-                        print(f"   Files are brotli-compressed (will decompress)")
+                        print(f"   Files are brotli/zstd-compressed (will decompress)")
                     else:
                         print(f"📥 Downloading from {url}")
-                        print(f"   Files are brotli-compressed (will decompress)")
+                        print(f"   Files are brotli/zstd-compressed (will decompress)")
                     print()
                     
                     async for chunk in response.aiter_bytes(chunk_size):
@@ -439,7 +441,7 @@ def main():
         print("Usage: python downloader_brotli.py <url> <output_dir>")
         print()
         print("Downloads a packed file (packer_brotli format) and unpacks directly to disk.")
-        print("Files in the archive are brotli-compressed and will be decompressed automatically.")
+        print("Files in the archive are brotli- or zstd-compressed and will be decompressed automatically.")
         print("Shows detailed progress and statistics during unpacking.")
         print("Downloads and unpacks run in parallel using async queue buffering.")
         print()
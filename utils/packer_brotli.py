@@ -29,28 +29,76 @@ Format:
     - Compressed source folder name length (ULEB128)
     - Compressed source folder name bytes (Brotli)
 
+Format v2 (default for new archives) wraps the same records in a header and
+appends an index block with a fixed-size trailer, so readers can load the
+index without scanning the archive (see ARCHIVE FORMAT below). Headerless v1
+archives are still read everywhere.
+
+Entries can also be zstd-compressed (needs the zstandard package),
+which decodes several times faster than brotli, or stored raw; each entry's
+file type records its codec (see CODEC RULES).
+
 Supports both sync and async operations with parallel Brotli compression.
 Also provides PackedArchive class for reading files directly from archive.
+By default PackedArchive memory-maps the archive and hands out zero-copy
+memoryview slices of stored entries.
 """
 
 import os
 import sys
 import asyncio
 import hashlib
+import json
+import time
 import shutil
 import io
+import mmap
+import struct
+import threading
+import itertools
+import fnmatch
+import functools
+import weakref
 import aiofiles
+from array import array
 import brotli
-from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
-from typing import Iterator, Tuple, Generator, AsyncIterator, AsyncGenerator, Union, Dict, List, Set, Optional, BinaryIO
+try:
+    import zstandard  # Only needed for entries packed with the zstd codec (in requirements.txt)
+except ImportError:
+    zstandard = None
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from typing import Iterable, Iterator, Tuple, Generator, AsyncIterator, AsyncGenerator, Union, Dict, List, Set, Optional, BinaryIO, Callable, NamedTuple
 from dataclasses import dataclass, field
-from contextlib import asynccontextmanager
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager, nullcontext
 
 # Brotli compression settings
 BROTLI_QUALITY = 11  # Maximum compression
 BROTLI_LGWIN = 24    # Window size (max)
 BROTLI_MODE = brotli.MODE_GENERIC
 
+# Codecs an entry's data can be stored with. Brotli is what browsers take
+# as-is (Content-Encoding: br); zstd decodes several times faster, for
+# entries the server or the unpacker decodes itself; raw is stored as it is.
+CODEC_BROTLI = 'brotli'
+CODEC_ZSTD = 'zstd'
+CODEC_RAW = 'raw'
+CODECS = (CODEC_BROTLI, CODEC_ZSTD, CODEC_RAW)
+ZSTD_LEVEL = 19  # zstd decode speed barely depends on the level
+ZSTD_STREAM_READ_SIZE = 1024 * 1024  # Compressed bytes decoded at a time when stream unpacking
+
+# Files brotli shrinks by less than this fraction are stored uncompressed
+# (FILE_TYPE_STORED); 0 compresses every file
+STORE_MIN_GAIN = 0.03
+STORE_SAMPLE_SIZE = 64 * 1024  # Bytes of each sample trial-compressed to spot incompressible files
+STORE_SAMPLES = 3  # Samples taken (start, middle and end of the file)
+# Brotli quality of the sample trial: ~100x cheaper than quality 11 and
+# within about a point of its gain, which is all a check for incompressible
+# data needs (the file itself is still judged on its full compression)
+STORE_TRIAL_QUALITY = 5
+
+DIGEST_SIZE = 16  # Bytes of the per-entry content digest (BLAKE2b)
+
 # Files to ignore during packing (macOS, Windows, etc. junk files)
 IGNORED_FILES = {
     '.DS_Store',
@@ -78,9 +126,19 @@ def is_already_brotli(filename: str) -> bool:
     return filename.lower().endswith('.br')
 
 
-def compress_brotli(data: bytes) -> bytes:
-    """Compress data using Brotli with maximum quality."""
-    return brotli.compress(data, quality=BROTLI_QUALITY, lgwin=BROTLI_LGWIN, mode=BROTLI_MODE)
+@dataclass(frozen=True)
+class BrotliSettings:
+    """Brotli encoder parameters for a group of files (see COMPRESSION PROFILES)."""
+    quality: int = BROTLI_QUALITY
+    lgwin: int = BROTLI_LGWIN
+    mode: int = BROTLI_MODE
+
+
+def compress_brotli(data: bytes, settings: Optional[BrotliSettings] = None) -> bytes:
+    """Compress data using Brotli with maximum quality (or the given settings)."""
+    if settings is None:
+        return brotli.compress(data, quality=BROTLI_QUALITY, lgwin=BROTLI_LGWIN, mode=BROTLI_MODE)
+    return brotli.compress(data, quality=settings.quality, lgwin=settings.lgwin, mode=settings.mode)
 
 
 def decompress_brotli(data: bytes) -> bytes:
@@ -88,6 +146,47 @@ def decompress_brotli(data: bytes) -> bytes:
     return brotli.decompress(data)
 
 
+def require_zstd() -> None:
+    """Raise if the optional zstandard package needed for zstd entries is missing."""
+    if zstandard is None:
+        raise RuntimeError("zstd entries need the zstandard package (pip install -r requirements.txt)")
+
+
+def compress_zstd(data: bytes) -> bytes:
+    """Compress data as one zstd frame (recording the decoded size)."""
+    require_zstd()
+    return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+
+
+def decompress_zstd(data: bytes) -> bytes:
+    """Decompress a zstd frame written by compress_zstd()."""
+    require_zstd()
+    return zstandard.ZstdDecompressor().decompress(data)
+
+
+def compress_codec(codec: str, data: bytes, settings: Optional[BrotliSettings] = None) -> bytes:
+    """Compress data with a codec (settings apply to brotli only)."""
+    if codec == CODEC_ZSTD:
+        return compress_zstd(data)
+    if codec == CODEC_RAW:
+        return bytes(data)
+    return compress_brotli(data, settings)
+
+
+def decompress_codec(codec: str, data: bytes) -> bytes:
+    """Decode data stored with a codec (raw data is returned as is)."""
+    if codec == CODEC_ZSTD:
+        return decompress_zstd(data)
+    if codec == CODEC_RAW:
+        return data
+    return decompress_brotli(data)
+
+
+def content_digest(data: Union[bytes, memoryview]) -> bytes:
+    """Digest identifying a file's content (recorded per entry in the archive index)."""
+    return hashlib.blake2b(data, digest_size=DIGEST_SIZE).digest()
+
+
 def compress_string(s: str) -> bytes:
     """Compress a string (folder/file name) using Brotli."""
     return compress_brotli(s.encode('utf-8'))
@@ -98,28 +197,98 @@ def decompress_string(data: bytes) -> str:
     return decompress_brotli(data).decode('utf-8')
 
 
-def compress_file_task(args: Tuple[str, str, str]) -> Tuple[str, str, str, bytes, int, int, bool]:
+def compression_gain(original_size: int, compressed_size: int) -> float:
+    """Fraction of the original size saved by compression (0 for empty data)."""
+    return 1 - compressed_size / original_size if original_size > 0 else 0.0
+
+
+def trial_sample(content: bytes) -> bytes:
+    """STORE_SAMPLES samples of STORE_SAMPLE_SIZE bytes spread over content (all of it if that's smaller)."""
+    if len(content) <= STORE_SAMPLE_SIZE * STORE_SAMPLES:
+        return content
+    last = len(content) - STORE_SAMPLE_SIZE
+    view = memoryview(content)
+    return b''.join(view[last * i // (STORE_SAMPLES - 1):][:STORE_SAMPLE_SIZE] for i in range(STORE_SAMPLES))
+
+
+class CompressTask(NamedTuple):
+    """A file to compress with compress_file_task()."""
+    file_path: str
+    rel_path: str  # Folder of the file in the archive
+    filename: str
+    block_size: int = 0  # Compress files larger than this in blocks (0: never)
+    min_gain: float = 0.0  # Store files that compress by less than this fraction (0: never)
+    settings: Optional[BrotliSettings] = None  # Brotli encoder parameters (None: the BROTLI_* constants)
+    codec: str = CODEC_BROTLI
+
+
+class CompressResult(NamedTuple):
+    """What compress_file_task() produced for a file."""
+    rel_path: str
+    filename: str
+    file_path: str
+    data: Union[bytes, 'BlockCompressed', 'StoredUncompressed', 'ZstdCompressed']
+    original_size: int
+    final_size: int
+    is_precompressed: bool  # .br file stored as-is
+    digest: bytes  # content_digest() of the original file
+
+
+def store_trial_gain(codec: str, sample: bytes, settings: Optional[BrotliSettings] = None) -> float:
+    """Gain of a codec on a trial_sample(); brotli runs at STORE_TRIAL_QUALITY at most."""
+    if codec == CODEC_BROTLI:
+        settings = settings or BrotliSettings()
+        settings = BrotliSettings(min(settings.quality, STORE_TRIAL_QUALITY), settings.lgwin, settings.mode)
+    return compression_gain(len(sample), len(compress_codec(codec, sample, settings)))
+
+
+def compress_file_task(task: CompressTask) -> CompressResult:
     """
     Compress a file using Brotli (or keep as-is for .br files). Used for parallel processing.
-    Args: (file_path, rel_path, filename)
-    Returns: (rel_path, filename, file_path, data, original_size, final_size, is_precompressed)
     
     For .br files: returns data as-is (already brotli-compressed)
+    With codec CODEC_RAW: returns a StoredUncompressed
+    If min_gain > 0 and the codec saves less than that fraction of the file:
+        returns a StoredUncompressed. Files larger than the trial sample are
+        judged on trial_sample() first, so incompressible ones aren't
+        compressed in full.
+    With codec CODEC_ZSTD: returns a ZstdCompressed (never split in blocks)
+    For files larger than block_size (if given and > 0): returns a BlockCompressed
     For other files: returns brotli-compressed data
+    
+    settings (a BrotliSettings, default: the BROTLI_* constants) are the
+    brotli encoder parameters, e.g. from a compression profile.
     """
-    file_path, rel_path, filename = args
+    file_path, rel_path, filename, block_size, min_gain, settings, codec = task
     with open(file_path, 'rb') as f:
         content = f.read()
     original_size = len(content)
+    digest = content_digest(content)
     
     # .br files are already brotli-compressed - store as-is
     if is_already_brotli(filename):
-        return (rel_path, filename, file_path, content, original_size, original_size, True)
+        return CompressResult(rel_path, filename, file_path, content, original_size, original_size, True, digest)
     
-    # Compress other files
-    compressed = compress_brotli(content)
+    stored = CompressResult(rel_path, filename, file_path, StoredUncompressed(content), original_size, original_size,
+                            False, digest)
+    if codec == CODEC_RAW:
+        return stored
+    if min_gain > 0 and original_size > STORE_SAMPLE_SIZE * STORE_SAMPLES:
+        if store_trial_gain(codec, trial_sample(content), settings) < min_gain:
+            return stored
+    
+    # Large files are compressed in independently decodable blocks (zstd
+    # decodes fast enough to stay one stream)
+    if codec == CODEC_ZSTD:
+        compressed = ZstdCompressed(compress_zstd(content))
+    elif block_size > 0 and original_size > block_size:
+        compressed = compress_blocks(content, block_size, settings)
+    else:
+        compressed = compress_brotli(content, settings)
     compressed_size = len(compressed)
-    return (rel_path, filename, file_path, compressed, original_size, compressed_size, False)
+    if min_gain > 0 and compression_gain(original_size, compressed_size) < min_gain:
+        return stored
+    return CompressResult(rel_path, filename, file_path, compressed, original_size, compressed_size, False, digest)
 
 
 def encode_uleb128(value: int) -> bytes:
@@ -174,12 +343,8 @@ class FolderSignature:
     
     @staticmethod
     def compute_file_hash(file_path: str) -> str:
-        """Compute MD5 hash of a file."""
-        hasher = hashlib.md5()
-        with open(file_path, 'rb') as f:
-            for chunk in iter(lambda: f.read(65536), b''):
-                hasher.update(chunk)
-        return hasher.hexdigest()
+        """Compute the content hash of a file (hex of its content digest)."""
+        return file_digest(file_path).hex()
     
     @classmethod
     def from_folder(cls, folder_path: str, rel_path: str) -> 'FolderSignature':
@@ -195,8 +360,13 @@ class FolderSignature:
             if os.path.isfile(file_path):
                 files[filename] = cls.compute_file_hash(file_path)
         
+        return cls.from_hashes(rel_path, files)
+    
+    @classmethod
+    def from_hashes(cls, rel_path: str, files: Dict[str, str]) -> 'FolderSignature':
+        """Create signature from the content hashes of a folder's files."""
         # Compute total hash from sorted file hashes
-        total_hasher = hashlib.md5()
+        total_hasher = hashlib.blake2b(digest_size=DIGEST_SIZE)
         for filename in sorted(files.keys()):
             total_hasher.update(filename.encode('utf-8'))
             total_hasher.update(files[filename].encode('utf-8'))
@@ -224,50 +394,113 @@ class FileInfo:
     filename: str
     full_path: str
     size: int
-    hash: str
+    hash: Optional[str] = None  # None: not hashed, no other file has its size
+
+
+def hash_files(paths: List[str], max_workers: Optional[int] = None) -> List[str]:
+    """
+    Content hashes (FolderSignature.compute_file_hash) of files, computed in
+    parallel worker processes.
+    """
+    if max_workers is None:
+        max_workers = os.cpu_count() or 4
+    if len(paths) < 2 or max_workers < 2:
+        return [FolderSignature.compute_file_hash(path) for path in paths]
+    chunksize = max(1, len(paths) // (max_workers * 4))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(FolderSignature.compute_file_hash, paths, chunksize=chunksize))
+
+
+def pack_roots(folder_paths: List[str]) -> List[Tuple[str, str]]:
+    """
+    (folder_path, parent_dir) of each folder packed into one archive; the
+    archive path of a folder is its path relative to parent_dir.
+    
+    Raises:
+        ValueError: if two folders would get the same archive path
+    """
+    roots = []
+    names: Set[str] = set()
+    for folder_path in folder_paths:
+        folder_path = folder_path.rstrip('/\\')
+        parent_dir = os.path.dirname(folder_path) or '.'
+        name = os.path.relpath(folder_path, parent_dir)
+        if name in names:
+            raise ValueError(f"Two folders would be packed as {name}")
+        names.add(name)
+        roots.append((folder_path, parent_dir))
+    return roots
+
+
+def walk_roots(roots: List[Tuple[str, str]]) -> Iterator[Tuple[str, List[str], List[str], str]]:
+    """os.walk() of each (folder_path, parent_dir) root in turn, as (root, dirs, files, archive path)."""
+    for folder_path, parent_dir in roots:
+        for root, dirs, files in os.walk(folder_path):
+            yield root, dirs, files, os.path.relpath(root, parent_dir)
+
 
+def find_duplicates(folder_path: str, parent_dir: str,
+                    max_workers: Optional[int] = None) -> Tuple[Dict[str, str], Dict[str, Tuple[str, str]]]:
+    """Scan folder structure and find duplicates (see find_duplicates_across())."""
+    return find_duplicates_across([(folder_path.rstrip('/\\'), parent_dir)], max_workers)
 
-def find_duplicates(folder_path: str, parent_dir: str) -> Tuple[Dict[str, str], Dict[str, Tuple[str, str]]]:
+
+def find_duplicates_across(roots: List[Tuple[str, str]],
+                           max_workers: Optional[int] = None) -> Tuple[Dict[str, str], Dict[str, Tuple[str, str]]]:
     """
-    Scan folder structure and find duplicates.
+    Scan the folder structure of several roots (see pack_roots()) and find
+    duplicates within and across them.
+    
+    Files are grouped by size first: only files sharing their size with
+    another file can have a duplicate, so only those are hashed (in
+    parallel, max_workers processes). A folder with a file of unique size
+    can't be a copy of another folder and gets no signature.
+    
     Returns:
         - folder_duplicates: dict mapping duplicate folder path -> source folder path
         - file_duplicates: dict mapping (folder_path, filename) -> (source_folder, source_filename)
     """
-    folder_path = folder_path.rstrip('/\\')
+    # First pass: list all files with their sizes
+    folder_files: Dict[str, List[FileInfo]] = {}  # rel_path -> files of the folder
+    files_by_size: Dict[int, List[FileInfo]] = {}
     
-    # First pass: collect all folder and file signatures
-    folder_signatures: Dict[str, FolderSignature] = {}
-    all_files: Dict[str, List[FileInfo]] = {}  # hash -> list of files with that hash
-    
-    for root, dirs, files in os.walk(folder_path):
+    for root, dirs, files, rel_path in walk_roots(roots):
         if not files:
             continue
         
-        rel_path = os.path.relpath(root, parent_dir)
-        sig = FolderSignature.from_folder(root, rel_path)
-        folder_signatures[rel_path] = sig
+        folder_infos: List[FileInfo] = []
         
         # Collect individual file info (skip ignored files)
-        for filename in files:
+        for filename in sorted(files):
             if should_ignore_file(filename):
                 continue
             file_path = os.path.join(root, filename)
             if os.path.isfile(file_path):
-                file_size = os.path.getsize(file_path)
-                file_hash = sig.files.get(filename) or FolderSignature.compute_file_hash(file_path)
-                
                 file_info = FileInfo(
                     folder_path=rel_path,
                     filename=filename,
                     full_path=file_path,
-                    size=file_size,
-                    hash=file_hash
+                    size=os.path.getsize(file_path)
                 )
-                
-                if file_hash not in all_files:
-                    all_files[file_hash] = []
-                all_files[file_hash].append(file_info)
+                folder_infos.append(file_info)
+                files_by_size.setdefault(file_info.size, []).append(file_info)
+        folder_files[rel_path] = folder_infos
+    
+    # Second pass: hash the files whose size collides with another file's
+    candidates = [info for infos in files_by_size.values() if len(infos) > 1 for info in infos]
+    for file_info, file_hash in zip(candidates, hash_files([info.full_path for info in candidates], max_workers)):
+        file_info.hash = file_hash
+    
+    folder_signatures: Dict[str, FolderSignature] = {}
+    all_files: Dict[str, List[FileInfo]] = {}  # hash -> list of files with that hash
+    
+    for rel_path, folder_infos in folder_files.items():
+        if all(info.hash is not None for info in folder_infos):
+            folder_signatures[rel_path] = FolderSignature.from_hashes(
+                rel_path, {info.filename: info.hash for info in folder_infos})
+        for file_info in folder_infos:
+            if file_info.hash is not None:
+                all_files.setdefault(file_info.hash, []).append(file_info)
     
     # Find folder duplicates
     folder_duplicates: Dict[str, str] = {}
@@ -326,179 +559,450 @@ def find_duplicates(folder_path: str, parent_dir: str) -> Tuple[Dict[str, str],
     return folder_duplicates, file_duplicates
 
 
-# ============== SYNC FUNCTIONS ==============
+# ============== ARCHIVE FORMAT ==============
 
 # Type constants
 FOLDER_TYPE_NORMAL = 0
 FOLDER_TYPE_COPY = 1
+FOLDER_TYPE_END = 0xFF  # v2+: end of the folder records, the index follows
 FILE_TYPE_CONTENT = 0
 FILE_TYPE_REFERENCE = 1
+FILE_TYPE_BLOCKS = 2  # v2+: content split into independently compressed blocks
+FILE_TYPE_STORED = 3  # v2+: content stored uncompressed (compression didn't pay off)
+FILE_TYPE_ZSTD = 4  # v2+: content compressed as one zstd frame
+MISSING_ENTRY = -1  # PackedArchive entry id of a reference whose target is missing
+
+# v1: headerless stream of folder records (see module docstring).
+#
+# v2: the v1 records wrapped so the index can be loaded without a scan:
+# - Header: ARCHIVE_MAGIC (4 bytes) + format version (1 byte)
+# - Folder records, exactly as in v1
+# - FOLDER_TYPE_END (1 byte)
+# - Index block (ULEB128 encoded):
+#   - Number of folders
+#   - For each folder:
+#     - Folder type (1 byte), folder name length + bytes
+#     - If copy folder: source folder id
+#     - If normal folder: number of files, then for each file:
+#       - Filename length + bytes
+#       - File type (1 byte)
+#       - If content, stored or zstd: data offset (absolute), data size
+#       - If blocks: data offset (absolute), data size, then the block table
+#         (decoded size, block size, number of blocks, and per block its
+#         offset relative to the data offset and its compressed size)
+#       - If reference: id of the content entry it resolves to
+#       - If content, blocks, stored or zstd and the index has INDEX_FLAG_DIGESTS:
+#         the content digest (DIGEST_SIZE bytes) of the original file
+#   Entry ids number the files of normal folders in index order.
+# - Trailer (TRAILER_STRUCT): index offset, index size, version, index flags, magic
+#
+# Block-compressed files (FILE_TYPE_BLOCKS, v2 only) are cut into blocks of
+# block_size decoded bytes (the last one may be shorter), each compressed as
+# its own Brotli stream, so a byte range can be served by decoding only the
+# blocks covering it. Their folder record is:
+# - Filename length + bytes, file type (1 byte)
+# - Decoded size, block size, number of blocks (ULEB128)
+# - For each block: offset relative to the data start, compressed size (ULEB128)
+# - Data size (ULEB128): from the data start to the end of the last block
+# - Lead padding length (BLOCK_PAD_STRUCT), then that many zero bytes
+# - Data: the blocks, each starting on a BLOCK_ALIGNMENT boundary of the
+#   archive file (zero padding in between)
+#
+# Stored files (FILE_TYPE_STORED, v2 only) have a record like content files
+# but hold the original bytes. The packer stores a file this way when brotli
+# saves less than its minimum gain (see compress_file_task()), typically for
+# already-compressed formats (JPEG, MP3/OGG, packed IMG), so they are
+# neither decoded on every read nor sent brotli-encoded.
+#
+# zstd files (FILE_TYPE_ZSTD, v2 only) have a record like content files
+# but hold one zstd frame. The file type is the entry's codec id (see
+# entry_codec()): brotli for content and blocks, raw for stored files and
+# zstd here. zstd suits files that are decoded rather than passed through
+# to browsers (they have no brotli stream to send), as it decodes several
+# times faster; reading them needs the zstandard package.
+
+ARCHIVE_MAGIC = b'RVPK'
+ARCHIVE_VERSION_1 = 1
+ARCHIVE_VERSION_2 = 2
+ARCHIVE_VERSION = ARCHIVE_VERSION_2  # Version written by pack_folder by default
+ARCHIVE_HEADER_SIZE = len(ARCHIVE_MAGIC) + 1
+TRAILER_STRUCT = struct.Struct('<QQHH4s')  # index_offset, index_size, version, index flags, magic
+INDEX_FLAG_DIGESTS = 0x1  # Content entries carry a content digest
+INDEX_TAIL_READ_SIZE = 256 * 1024  # Bytes read from the archive end to get trailer + index at once
+BLOCK_ALIGNMENT = 4096  # Block-compressed data starts on page boundaries
+BLOCK_PAD_STRUCT = struct.Struct('<H')  # Lead padding before the first block
+
+
+@dataclass
+class BlockTable:
+    """Block layout of a block-compressed (FILE_TYPE_BLOCKS) entry."""
+    raw_size: int  # Decoded size of the whole file
+    block_size: int  # Decoded size of every block except possibly the last
+    offsets: List[int]  # Block offsets relative to the entry's data offset
+    sizes: List[int]  # Compressed size of each block
+    
+    def __len__(self) -> int:
+        return len(self.sizes)
+    
+    def blocks_for_range(self, start: int, end: int) -> range:
+        """Indices of the blocks covering decoded bytes [start, end)."""
+        if end <= start:
+            return range(0)
+        return range(start // self.block_size, min((end - 1) // self.block_size + 1, len(self.sizes)))
+
+
+@dataclass
+class BlockCompressed:
+    """A file compressed block by block, as produced by compress_blocks()."""
+    raw_size: int
+    block_size: int
+    blocks: List[bytes]
+    
+    def __len__(self) -> int:
+        return sum(len(block) for block in self.blocks)
+
+
+@dataclass
+class StoredUncompressed:
+    """A file's content kept uncompressed (FILE_TYPE_STORED)."""
+    data: bytes
+    
+    def __len__(self) -> int:
+        return len(self.data)
+
+
+@dataclass
+class ZstdCompressed:
+    """A file's content compressed as one zstd frame (FILE_TYPE_ZSTD)."""
+    data: bytes
+    
+    def __len__(self) -> int:
+        return len(self.data)
+
+
+def entry_codec(file_type: int, filename: str) -> str:
+    """Codec to decode a content entry's data with (.br files are kept as they are)."""
+    if file_type == FILE_TYPE_ZSTD:
+        return CODEC_ZSTD
+    if file_type == FILE_TYPE_STORED or is_already_brotli(filename):
+        return CODEC_RAW
+    return CODEC_BROTLI
+
+
+def compress_blocks(content: bytes, block_size: int, settings: Optional[BrotliSettings] = None) -> BlockCompressed:
+    """Compress content as independent Brotli streams of block_size decoded bytes each."""
+    if block_size <= 0:
+        raise ValueError("block_size must be positive")
+    view = memoryview(content)
+    blocks = [compress_brotli(view[start:start + block_size], settings) for start in range(0, len(content), block_size)]
+    return BlockCompressed(raw_size=len(content), block_size=block_size, blocks=blocks)
+
 
+def iter_decoded_blocks(data: Union[bytes, memoryview], table: BlockTable) -> Iterator[bytes]:
+    """Decode the blocks of a block-compressed entry's data one by one."""
+    for offset, size in zip(table.offsets, table.sizes):
+        yield decompress_brotli(data[offset:offset + size])
 
-def pack_folder(folder_path: str, output_file: str, deduplicate: bool = True, max_workers: int = None) -> None:
+
+def parse_block_record(data: Union[bytes, mmap.mmap, memoryview], offset: int) -> Tuple[BlockTable, int, int]:
     """
-    Pack all files from folder and subfolders into a single file (sync).
-    Uses parallel Brotli compression for maximum speed with quality 11.
+    Parse the block table of a FILE_TYPE_BLOCKS record.
     
     Args:
-        folder_path: Path to folder to pack
-        output_file: Output file path
-        deduplicate: If True, detect and deduplicate identical folders and files
-        max_workers: Maximum number of parallel compression workers (default: CPU count)
+        data: Archive bytes
+        offset: Offset right after the record's file type byte
+    
+    Returns:
+        (table, data_offset, data_size) - the blocks span data_size bytes
+        from data_offset.
     """
-    folder_path = folder_path.rstrip('/\\')
-    parent_dir = os.path.dirname(folder_path) or '.'
+    values = []
+    for _ in range(3):
+        value, bytes_read = decode_uleb128(data, offset)
+        offset += bytes_read
+        values.append(value)
+    raw_size, block_size, num_blocks = values
+    offsets: List[int] = []
+    sizes: List[int] = []
+    for _ in range(num_blocks):
+        block_offset, bytes_read = decode_uleb128(data, offset)
+        offset += bytes_read
+        block_len, bytes_read = decode_uleb128(data, offset)
+        offset += bytes_read
+        offsets.append(block_offset)
+        sizes.append(block_len)
+    data_size, bytes_read = decode_uleb128(data, offset)
+    offset += bytes_read
+    lead_padding, = BLOCK_PAD_STRUCT.unpack(bytes(data[offset:offset + BLOCK_PAD_STRUCT.size]))
+    offset += BLOCK_PAD_STRUCT.size + lead_padding
+    return BlockTable(raw_size, block_size, offsets, sizes), offset, data_size
+
+
+def archive_header(version: int) -> bytes:
+    """Header bytes for a new archive of the given format version (empty for v1)."""
+    if version == ARCHIVE_VERSION_1:
+        return b''
+    if version == ARCHIVE_VERSION_2:
+        return ARCHIVE_MAGIC + bytes([version])
+    raise ValueError(f"Unsupported archive format version: {version}")
+
+
+def detect_archive_version(head: bytes) -> int:
+    """
+    Detect the format version from the first bytes of an archive.
     
-    if max_workers is None:
-        max_workers = os.cpu_count() or 4
+    v1 archives have no header and start straight with a folder type byte.
+    """
+    if not head.startswith(ARCHIVE_MAGIC):
+        return ARCHIVE_VERSION_1
+    if len(head) < ARCHIVE_HEADER_SIZE:
+        raise ValueError("Truncated archive header")
+    version = head[len(ARCHIVE_MAGIC)]
+    if version != ARCHIVE_VERSION_2:
+        raise ValueError(f"Unsupported archive format version: {version}")
+    return version
+
+
+def archive_version(archive_path: str) -> int:
+    """Format version of an archive file."""
+    with open(archive_path, 'rb') as f:
+        return detect_archive_version(f.read(ARCHIVE_HEADER_SIZE))
+
+
+def records_start(version: int) -> int:
+    """Offset of the first folder record for the given format version."""
+    return 0 if version == ARCHIVE_VERSION_1 else ARCHIVE_HEADER_SIZE
+
+
+def parse_trailer(trailer: bytes) -> Tuple[int, int, int, int]:
+    """
+    Parse a v2 trailer.
     
-    # Find duplicates if deduplication is enabled
-    folder_duplicates: Dict[str, str] = {}
-    file_duplicates: Dict[Tuple[str, str], Tuple[str, str]] = {}
+    Returns:
+        (index_offset, index_size, version, index_flags)
+    """
+    if len(trailer) != TRAILER_STRUCT.size:
+        raise ValueError("Truncated archive trailer")
+    index_offset, index_size, version, flags, magic = TRAILER_STRUCT.unpack(trailer)
+    if magic != ARCHIVE_MAGIC:
+        raise ValueError("Archive trailer not found (corrupt or truncated archive)")
+    if version != ARCHIVE_VERSION_2:
+        raise ValueError(f"Unsupported archive format version: {version}")
+    return index_offset, index_size, version, flags
+
+
+def locate_index(tail: Union[bytes, memoryview], tail_start: int) -> Tuple[int, int, int, Optional[bytes]]:
+    """
+    Find the index of a v2 archive in a read of its tail (see INDEX_TAIL_READ_SIZE).
     
-    if deduplicate:
-        print("Scanning for duplicates...")
-        folder_duplicates, file_duplicates = find_duplicates(folder_path, parent_dir)
-        if folder_duplicates or file_duplicates:
-            print(f"Found {len(folder_duplicates)} duplicate folder(s), {len(file_duplicates)} duplicate file(s)")
-        else:
-            print("No duplicates found")
-        print()
+    Args:
+        tail: The last bytes of the archive, trailer included
+        tail_start: Offset of tail in the archive
     
-    folder_bytes_saved = 0
-    file_bytes_saved = 0
-    total_original_size = 0
-    total_compressed_size = 0
+    Returns:
+        (index_offset, index_size, index_flags, index data, or None if the
+        index starts before the tail and needs another read)
+    """
+    index_offset, index_size, _, flags = parse_trailer(tail[-TRAILER_STRUCT.size:])
+    if index_offset < tail_start:
+        return index_offset, index_size, flags, None
+    return index_offset, index_size, flags, tail[index_offset - tail_start:index_offset - tail_start + index_size]
+
+
+def index_flags(entries: List['FileEntry']) -> int:
+    """Index flags for a set of entries: digests are stored only if every content entry has one."""
+    if all(entry.digest is not None for entry in entries if entry.file_type != FILE_TYPE_REFERENCE):
+        return INDEX_FLAG_DIGESTS
+    return 0
+
+
+def encode_index(folders: List[Tuple[str, Optional[str]]], entries: List['FileEntry'], flags: int = 0) -> bytes:
+    """
+    Encode the archive index block.
     
-    # First pass: collect all files that need compression
-    print("Collecting files for compression...")
-    files_to_compress: List[Tuple[str, str, str]] = []  # (file_path, rel_path, filename)
-    folder_structure: List[Tuple[str, List[str], bool, str]] = []  # (rel_path, files, is_duplicate, source_path)
+    Args:
+        folders: (folder_name, copy_source) in record order; copy_source is None
+                 for normal folders
+        entries: Entries of the normal folders. References name their target by
+                 folder/filename and are resolved to entry ids here.
+        flags: Index flags (INDEX_FLAG_DIGESTS to store content digests)
     
-    for root, dirs, files in os.walk(folder_path):
-        # Filter out ignored files
-        files = [f for f in files if not should_ignore_file(f)]
-        if not files:
-            continue
-        
-        rel_path = os.path.relpath(root, parent_dir)
-        
-        if rel_path in folder_duplicates:
-            source_path = folder_duplicates[rel_path]
-            folder_structure.append((rel_path, list(files), True, source_path))
-            for filename in files:
-                file_path = os.path.join(root, filename)
-                folder_bytes_saved += os.path.getsize(file_path)
-        else:
-            folder_structure.append((rel_path, sorted(files), False, None))
-            for filename in sorted(files):
-                file_key = (rel_path, filename)
-                if file_key not in file_duplicates:
-                    file_path = os.path.join(root, filename)
-                    files_to_compress.append((file_path, rel_path, filename))
-                else:
-                    file_path = os.path.join(root, filename)
-                    file_bytes_saved += os.path.getsize(file_path)
+    Returns:
+        Encoded index block.
+    """
+    files_by_folder: Dict[str, List['FileEntry']] = {name: [] for name, source in folders if source is None}
+    for entry in entries:
+        files_by_folder[entry.folder].append(entry)
     
-    print(f"Compressing {len(files_to_compress)} files using {max_workers} workers (Brotli quality {BROTLI_QUALITY})...")
+    # Assign entry ids in index order
+    entry_ids: Dict[Tuple[str, str], int] = {}
+    ordered: List['FileEntry'] = []
+    for name, source in folders:
+        if source is None:
+            for entry in files_by_folder[name]:
+                entry_ids[(entry.folder, entry.filename)] = len(ordered)
+                ordered.append(entry)
+    folder_ids = {name: i for i, (name, source) in enumerate(folders)}
     
-    # Parallel compression of all files
-    compressed_files: Dict[Tuple[str, str], bytes] = {}  # (rel_path, filename) -> compressed_data
-    precompressed_files: Set[Tuple[str, str]] = set()  # Track which files were already .br
+    def resolve(entry: 'FileEntry') -> int:
+        seen = set()
+        while entry.file_type == FILE_TYPE_REFERENCE:
+            key = (entry.ref_folder, entry.ref_filename)
+            if key not in entry_ids or key in seen:
+                raise ValueError(f"Unresolvable reference: {entry.folder}/{entry.filename} -> {key[0]}/{key[1]}")
+            seen.add(key)
+            entry = ordered[entry_ids[key]]
+        return entry_ids[(entry.folder, entry.filename)]
     
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(compress_file_task, args): args for args in files_to_compress}
-        completed = 0
+    out = bytearray()
+    out += encode_uleb128(len(folders))
+    for name, source in folders:
+        name_bytes = name.encode('utf-8')
+        if source is not None:
+            if source not in folder_ids:
+                raise ValueError(f"Copy folder {name} references unknown folder {source}")
+            out.append(FOLDER_TYPE_COPY)
+            out += encode_uleb128(len(name_bytes))
+            out += name_bytes
+            out += encode_uleb128(folder_ids[source])
+            continue
         
-        for future in as_completed(futures):
-            rel_path, filename, file_path, data, original_size, final_size, is_precompressed = future.result()
-            compressed_files[(rel_path, filename)] = data
-            if is_precompressed:
-                precompressed_files.add((rel_path, filename))
-                print(f"  [{completed + 1}/{len(files_to_compress)}] Stored as-is (.br): {rel_path}/{filename} ({original_size} bytes)")
+        out.append(FOLDER_TYPE_NORMAL)
+        out += encode_uleb128(len(name_bytes))
+        out += name_bytes
+        out += encode_uleb128(len(files_by_folder[name]))
+        for entry in files_by_folder[name]:
+            filename_bytes = entry.filename.encode('utf-8')
+            out += encode_uleb128(len(filename_bytes))
+            out += filename_bytes
+            out.append(entry.file_type)
+            if entry.file_type == FILE_TYPE_REFERENCE:
+                out += encode_uleb128(resolve(entry))
             else:
-                total_original_size += original_size
-                total_compressed_size += final_size
-                ratio = (final_size / original_size * 100) if original_size > 0 else 0
-                print(f"  [{completed + 1}/{len(files_to_compress)}] Compressed: {rel_path}/{filename} ({original_size} -> {final_size} bytes, {ratio:.1f}%)")
-            completed += 1
-    
-    print(f"\nWriting packed file...")
-    
-    # Write the packed file
-    with open(output_file, 'wb') as out:
-        for rel_path, files, is_duplicate, source_path in folder_structure:
-            folder_name_bytes = rel_path.encode('utf-8')
-            
-            if is_duplicate:
-                source_path_bytes = source_path.encode('utf-8')
-                
-                # Write copy folder entry
-                out.write(bytes([FOLDER_TYPE_COPY]))
-                out.write(encode_uleb128(len(folder_name_bytes)))
-                out.write(folder_name_bytes)
-                out.write(encode_uleb128(len(source_path_bytes)))
-                out.write(source_path_bytes)
-                
-                print(f"  Copy folder: {rel_path} -> {source_path}")
+                out += encode_uleb128(entry.data_offset)
+                out += encode_uleb128(entry.compressed_size)
+                if entry.file_type == FILE_TYPE_BLOCKS:
+                    table = entry.blocks
+                    out += encode_uleb128(table.raw_size)
+                    out += encode_uleb128(table.block_size)
+                    out += encode_uleb128(len(table))
+                    for block_offset, block_len in zip(table.offsets, table.sizes):
+                        out += encode_uleb128(block_offset)
+                        out += encode_uleb128(block_len)
+                if flags & INDEX_FLAG_DIGESTS:
+                    out += entry.digest
+    return bytes(out)
+
+
+def decode_index(data: Union[bytes, memoryview], flags: int = 0) -> Tuple[List[Tuple[str, Optional[str]]], List['FileEntry']]:
+    """
+    Decode an index block produced by encode_index() with the same flags.
+    
+    Returns:
+        (folders, entries) in the same shape encode_index() accepts. References
+        point straight at the content entry they resolve to.
+    """
+    folders: List[Tuple[str, Optional[str]]] = []
+    entries: List['FileEntry'] = []
+    ref_targets: List[Tuple[int, int]] = []  # (entry index, target entry id)
+    copy_sources: List[Tuple[int, int]] = []  # (folder index, source folder id)
+    
+    offset = 0
+    folder_count, bytes_read = decode_uleb128(data, offset)
+    offset += bytes_read
+    for _ in range(folder_count):
+        folder_type = data[offset]
+        offset += 1
+        name_len, bytes_read = decode_uleb128(data, offset)
+        offset += bytes_read
+        name = bytes(data[offset:offset + name_len]).decode('utf-8')
+        offset += name_len
+        
+        if folder_type == FOLDER_TYPE_COPY:
+            source_id, bytes_read = decode_uleb128(data, offset)
+            offset += bytes_read
+            copy_sources.append((len(folders), source_id))
+            folders.append((name, ''))
+            continue
+        
+        folders.append((name, None))
+        num_files, bytes_read = decode_uleb128(data, offset)
+        offset += bytes_read
+        for _ in range(num_files):
+            filename_len, bytes_read = decode_uleb128(data, offset)
+            offset += bytes_read
+            filename = bytes(data[offset:offset + filename_len]).decode('utf-8')
+            offset += filename_len
+            file_type = data[offset]
+            offset += 1
+            if file_type == FILE_TYPE_REFERENCE:
+                target_id, bytes_read = decode_uleb128(data, offset)
+                offset += bytes_read
+                ref_targets.append((len(entries), target_id))
+                entries.append(FileEntry(folder=name, filename=filename, file_type=file_type,
+                                         data_offset=0, compressed_size=0))
             else:
-                # Write normal folder entry
-                out.write(bytes([FOLDER_TYPE_NORMAL]))
-                out.write(encode_uleb128(len(folder_name_bytes)))
-                out.write(folder_name_bytes)
-                out.write(encode_uleb128(len(files)))
-                
-                for filename in files:
-                    filename_bytes = filename.encode('utf-8')
-                    
-                    out.write(encode_uleb128(len(filename_bytes)))
-                    out.write(filename_bytes)
-                    
-                    # Check if this file is a duplicate
-                    file_key = (rel_path, filename)
-                    if file_key in file_duplicates:
-                        source_folder, source_filename = file_duplicates[file_key]
-                        source_folder_bytes = source_folder.encode('utf-8')
-                        source_filename_bytes = source_filename.encode('utf-8')
-                        
-                        # Write file reference
-                        out.write(bytes([FILE_TYPE_REFERENCE]))
-                        out.write(encode_uleb128(len(source_folder_bytes)))
-                        out.write(source_folder_bytes)
-                        out.write(encode_uleb128(len(source_filename_bytes)))
-                        out.write(source_filename_bytes)
-                        
-                        print(f"    Ref: {rel_path}/{filename} -> {source_folder}/{source_filename}")
-                    else:
-                        # Write compressed file content
-                        compressed_content = compressed_files[(rel_path, filename)]
-                        
-                        out.write(bytes([FILE_TYPE_CONTENT]))
-                        out.write(encode_uleb128(len(compressed_content)))
-                        out.write(compressed_content)
+                data_offset, bytes_read = decode_uleb128(data, offset)
+                offset += bytes_read
+                size, bytes_read = decode_uleb128(data, offset)
+                offset += bytes_read
+                table = None
+                if file_type == FILE_TYPE_BLOCKS:
+                    values = []
+                    for _ in range(3):
+                        value, bytes_read = decode_uleb128(data, offset)
+                        offset += bytes_read
+                        values.append(value)
+                    raw_size, block_size, num_blocks = values
+                    table = BlockTable(raw_size, block_size, [], [])
+                    for _ in range(num_blocks):
+                        block_offset, bytes_read = decode_uleb128(data, offset)
+                        offset += bytes_read
+                        block_len, bytes_read = decode_uleb128(data, offset)
+                        offset += bytes_read
+                        table.offsets.append(block_offset)
+                        table.sizes.append(block_len)
+                digest = None
+                if flags & INDEX_FLAG_DIGESTS:
+                    digest = bytes(data[offset:offset + DIGEST_SIZE])
+                    offset += DIGEST_SIZE
+                entries.append(FileEntry(folder=name, filename=filename, file_type=file_type,
+                                         data_offset=data_offset, compressed_size=size, blocks=table,
+                                         digest=digest))
     
-    total_size = os.path.getsize(output_file)
-    print(f"\nPacked to {output_file} ({total_size} bytes)")
-    if total_original_size > 0:
-        overall_ratio = total_compressed_size / total_original_size * 100
-        print(f"Compression: {total_original_size} -> {total_compressed_size} bytes ({overall_ratio:.1f}%)")
-    if folder_bytes_saved > 0 or file_bytes_saved > 0:
-        print(f"Deduplication saved: {folder_bytes_saved + file_bytes_saved} bytes (folders: {folder_bytes_saved}, files: {file_bytes_saved})")
+    for entry_idx, target_id in ref_targets:
+        target = entries[target_id]
+        entries[entry_idx].ref_folder = target.folder
+        entries[entry_idx].ref_filename = target.filename
+    for folder_idx, source_id in copy_sources:
+        folders[folder_idx] = (folders[folder_idx][0], folders[source_id][0])
+    return folders, entries
 
 
-def unpack_file(input_file: str, output_dir: str) -> None:
-    """Unpack a packed file back to folder structure (sync). Decompresses Brotli-compressed content."""
-    with open(input_file, 'rb') as f:
-        data = f.read()
+def scan_records(data: Union[bytes, mmap.mmap], offset: int = 0) -> Tuple[List[Tuple[str, Optional[str]]], List['FileEntry'], int]:
+    """
+    Walk the folder records of an archive to build its index.
     
-    # Track unpacked folders and files for copy references
-    unpacked_folders: Dict[str, str] = {}  # rel_path -> absolute path
-    unpacked_files: Dict[Tuple[str, str], str] = {}  # (folder, filename) -> absolute path
+    Stops at the end of data or at a FOLDER_TYPE_END marker.
     
-    offset = 0
-    while offset < len(data):
+    Args:
+        data: Archive bytes (or a mapping of the archive)
+        offset: Offset of the first folder record
+    
+    Returns:
+        (folders, entries, end_offset) - folders and entries as for
+        encode_index(); a folder name split over several records is merged.
+    """
+    folders: List[Tuple[str, Optional[str]]] = []
+    entries: List['FileEntry'] = []
+    seen_folders: Set[str] = set()
+    size = len(data)
+    
+    while offset < size:
         # Read folder type
         folder_type = data[offset]
+        if folder_type == FOLDER_TYPE_END:
+            break
         offset += 1
         
         # Read folder name
@@ -507,363 +1011,1313 @@ def unpack_file(input_file: str, output_dir: str) -> None:
         folder_name = data[offset:offset + folder_name_len].decode('utf-8')
         offset += folder_name_len
         
-        folder_path = os.path.join(output_dir, folder_name)
-        os.makedirs(folder_path, exist_ok=True)
-        unpacked_folders[folder_name] = folder_path
-        
         if folder_type == FOLDER_TYPE_COPY:
             # Read source folder name
             source_name_len, bytes_read = decode_uleb128(data, offset)
             offset += bytes_read
             source_name = data[offset:offset + source_name_len].decode('utf-8')
             offset += source_name_len
-            
-            # Copy files from source folder
-            source_path = unpacked_folders.get(source_name)
-            if source_path and os.path.exists(source_path):
-                for filename in os.listdir(source_path):
-                    src_file = os.path.join(source_path, filename)
-                    dst_file = os.path.join(folder_path, filename)
-                    if os.path.isfile(src_file):
-                        shutil.copy2(src_file, dst_file)
-                        unpacked_files[(folder_name, filename)] = dst_file
-                print(f"Copied folder: {folder_name} <- {source_name}")
-            else:
-                print(f"Warning: Source folder not found: {source_name}")
-        else:
-            # Normal folder - read files
-            num_files, bytes_read = decode_uleb128(data, offset)
+            folders.append((folder_name, source_name))
+            continue
+        
+        # Normal folder
+        num_files, bytes_read = decode_uleb128(data, offset)
+        offset += bytes_read
+        if folder_name not in seen_folders:
+            seen_folders.add(folder_name)
+            folders.append((folder_name, None))
+        
+        for _ in range(num_files):
+            filename_len, bytes_read = decode_uleb128(data, offset)
             offset += bytes_read
+            filename = data[offset:offset + filename_len].decode('utf-8')
+            offset += filename_len
             
-            print(f"Folder: {folder_name} ({num_files} files)")
+            file_type = data[offset]
+            offset += 1
             
-            for _ in range(num_files):
-                filename_len, bytes_read = decode_uleb128(data, offset)
+            if file_type == FILE_TYPE_REFERENCE:
+                # Read source reference
+                src_folder_len, bytes_read = decode_uleb128(data, offset)
                 offset += bytes_read
-                filename = data[offset:offset + filename_len].decode('utf-8')
-                offset += filename_len
+                src_folder = data[offset:offset + src_folder_len].decode('utf-8')
+                offset += src_folder_len
                 
-                file_path = os.path.join(folder_path, filename)
+                src_filename_len, bytes_read = decode_uleb128(data, offset)
+                offset += bytes_read
+                src_filename = data[offset:offset + src_filename_len].decode('utf-8')
+                offset += src_filename_len
                 
-                # Read file type
-                file_type = data[offset]
-                offset += 1
+                entries.append(FileEntry(
+                    folder=folder_name,
+                    filename=filename,
+                    file_type=FILE_TYPE_REFERENCE,
+                    data_offset=0,
+                    compressed_size=0,
+                    ref_folder=src_folder,
+                    ref_filename=src_filename
+                ))
+            elif file_type == FILE_TYPE_BLOCKS:
+                table, data_offset, data_size = parse_block_record(data, offset)
+                entries.append(FileEntry(
+                    folder=folder_name,
+                    filename=filename,
+                    file_type=FILE_TYPE_BLOCKS,
+                    data_offset=data_offset,
+                    compressed_size=data_size,
+                    blocks=table
+                ))
+                offset = data_offset + data_size
+            else:
+                # Read content length and record position
+                compressed_len, bytes_read = decode_uleb128(data, offset)
+                offset += bytes_read
                 
-                if file_type == FILE_TYPE_REFERENCE:
-                    # Read source reference
-                    src_folder_len, bytes_read = decode_uleb128(data, offset)
-                    offset += bytes_read
-                    src_folder = data[offset:offset + src_folder_len].decode('utf-8')
-                    offset += src_folder_len
-                    
-                    src_filename_len, bytes_read = decode_uleb128(data, offset)
-                    offset += bytes_read
-                    src_filename = data[offset:offset + src_filename_len].decode('utf-8')
-                    offset += src_filename_len
-                    
-                    # Copy from source file
-                    src_file_path = unpacked_files.get((src_folder, src_filename))
-                    if src_file_path and os.path.exists(src_file_path):
-                        shutil.copy2(src_file_path, file_path)
-                        unpacked_files[(folder_name, filename)] = file_path
-                        print(f"  Copied: {filename} <- {src_folder}/{src_filename}")
-                    else:
-                        print(f"  Warning: Source file not found: {src_folder}/{src_filename}")
-                else:
-                    # Read content
-                    content_len, bytes_read = decode_uleb128(data, offset)
-                    offset += bytes_read
-                    content = data[offset:offset + content_len]
-                    offset += content_len
-                    
-                    # .br files are stored as-is (not brotli-compressed), write directly
-                    if is_already_brotli(filename):
-                        with open(file_path, 'wb') as f:
-                            f.write(content)
-                        unpacked_files[(folder_name, filename)] = file_path
-                        print(f"  Unpacked: {filename} ({content_len} bytes, stored as-is)")
-                    else:
-                        # Decompress with Brotli
-                        decompressed = decompress_brotli(content)
-                        with open(file_path, 'wb') as f:
-                            f.write(decompressed)
-                        unpacked_files[(folder_name, filename)] = file_path
-                        print(f"  Unpacked: {filename} ({content_len} -> {len(decompressed)} bytes)")
+                entries.append(FileEntry(
+                    folder=folder_name,
+                    filename=filename,
+                    file_type=file_type,
+                    data_offset=offset,
+                    compressed_size=compressed_len
+                ))
+                
+                # Skip content
+                offset += compressed_len
     
-    print(f"\nUnpacked to {output_dir}")
+    return folders, entries, offset
 
 
-def stream_unpack(chunks: Iterator[bytes]) -> Generator[Tuple[str, str, int, Generator[bytes, None, None], Tuple[str, str]], None, None]:
+class ArchiveWriter:
     """
-    Stream unpack a packed file from an iterable of byte chunks (sync).
-    Decompresses Brotli-compressed content.
+    Serializes folder records and, for v2, the trailing index.
     
-    Yields tuples of: (folder_name, file_name, decompressed_size, file_chunks_generator, source_ref)
-    - For normal files: (folder_name, filename, size, chunks_gen, None)
-    - For file references: (folder_name, filename, -2, None, (src_folder, src_filename))
-    - For folder copies: (folder_name, source_folder, -1, None, None)
+    The writer does no I/O itself: every method returns the bytes to write
+    next, so the same writer serves the sync and async pack functions. For
+    file_content() the caller writes the returned record prefix followed by
+    exactly `size` bytes of content; file_blocks() and file_data() return
+    the full list of chunks to write.
+    
+    Usage:
+        writer = ArchiveWriter(ARCHIVE_VERSION)
+        out.write(writer.header())
+        out.write(writer.begin_folder('vcsky/data', 2))
+        out.write(writer.file_content('a.dat', len(data)))
+        out.write(data)
+        out.write(writer.file_reference('b.dat', 'vcsky/data', 'a.dat'))
+        out.write(writer.finish())
     """
-    buffer = bytearray()
-    chunk_iter = iter(chunks)
     
-    def read_bytes(n: int) -> bytes:
-        nonlocal buffer
-        while len(buffer) < n:
-            try:
-                chunk = next(chunk_iter)
-                buffer.extend(chunk)
-            except StopIteration:
-                if len(buffer) < n:
-                    raise EOFError(f"Expected {n} bytes, got {len(buffer)}")
-        result = bytes(buffer[:n])
-        del buffer[:n]
-        return result
+    def __init__(self, version: int = ARCHIVE_VERSION, offset: int = 0):
+        """
+        Args:
+            version: Archive format version to write
+            offset: Absolute offset at which the next bytes will be written
+        """
+        archive_header(version)  # validates the version
+        self.version = version
+        self.offset = offset
+        self.folders: List[Tuple[str, Optional[str]]] = []
+        self.entries: List['FileEntry'] = []
+        self._known_folders: Set[str] = set()
+        self._current_folder: Optional[str] = None
+        self.append_start = offset  # Where an append started (see for_append())
+        self.tail = b''  # Bytes from append_start to the end of the archive before the append
     
-    def read_uleb128() -> int:
-        result = 0
-        shift = 0
-        while True:
-            byte_data = read_bytes(1)
-            byte = byte_data[0]
-            result |= (byte & 0x7F) << shift
-            if (byte & 0x80) == 0:
-                break
-            shift += 7
-        return result
+    @classmethod
+    def for_append(cls, archive_path: str) -> 'ArchiveWriter':
+        """
+        Prepare an existing archive for appending folder records.
+        
+        For v2 archives the existing index is loaded; the appended records
+        start at the end marker (writer.offset), overwriting the end marker,
+        index and trailer, and finish() writes them back including the
+        appended folders. v1 archives are appended to as-is. The archive
+        isn't modified here: the bytes the append replaces are kept in
+        writer.tail so restore_tail() can put them back if it fails.
+        """
+        with open(archive_path, 'rb') as f:
+            version = detect_archive_version(f.read(ARCHIVE_HEADER_SIZE))
+            file_size = f.seek(0, os.SEEK_END)
+            if version == ARCHIVE_VERSION_1:
+                return cls(version, offset=file_size)
+            
+            f.seek(file_size - TRAILER_STRUCT.size)
+            index_offset, index_size, version, flags = parse_trailer(f.read(TRAILER_STRUCT.size))
+            f.seek(index_offset)
+            folders, entries = decode_index(f.read(index_size), flags)
+            
+            writer = cls(version, offset=index_offset - 1)  # replace the end marker too
+            writer.folders = folders
+            writer.entries = entries
+            writer._known_folders = {name for name, source in folders}
+            f.seek(writer.offset)
+            writer.tail = f.read()
+        return writer
     
-    def file_chunk_generator_decompressed(compressed_size: int) -> Generator[bytes, None, None]:
-        """Read compressed data, decompress, and yield as single chunk."""
-        compressed_data = read_bytes(compressed_size)
-        decompressed = decompress_brotli(compressed_data)
-        yield decompressed
+    def header(self) -> bytes:
+        """Archive header; call once before any folder."""
+        data = archive_header(self.version)
+        self.offset += len(data)
+        return data
+    
+    def _emit(self, data: bytes) -> bytes:
+        self.offset += len(data)
+        return data
+    
+    def copy_folder(self, folder_name: str, source_folder: str) -> bytes:
+        """Record for a folder that is a copy of source_folder."""
+        folder_name_bytes = folder_name.encode('utf-8')
+        source_bytes = source_folder.encode('utf-8')
+        self.folders.append((folder_name, source_folder))
+        self._known_folders.add(folder_name)
+        self._current_folder = None
+        return self._emit(bytes([FOLDER_TYPE_COPY]) + encode_uleb128(len(folder_name_bytes)) + folder_name_bytes +
+                          encode_uleb128(len(source_bytes)) + source_bytes)
     
+    def begin_folder(self, folder_name: str, num_files: int) -> bytes:
+        """Record header for a normal folder holding num_files files."""
+        folder_name_bytes = folder_name.encode('utf-8')
+        if folder_name not in self._known_folders:
+            self._known_folders.add(folder_name)
+            self.folders.append((folder_name, None))
+        self._current_folder = folder_name
+        return self._emit(bytes([FOLDER_TYPE_NORMAL]) + encode_uleb128(len(folder_name_bytes)) +
+                          folder_name_bytes + encode_uleb128(num_files))
+    
+    def file_content(self, filename: str, size: int, file_type: int = FILE_TYPE_CONTENT,
+                     digest: Optional[bytes] = None) -> bytes:
+        """
+        Record prefix for a stored file; the caller writes `size` content bytes after it.
+        
+        digest is the content digest of the original file, for the v2 index.
+        """
+        filename_bytes = filename.encode('utf-8')
+        prefix = (encode_uleb128(len(filename_bytes)) + filename_bytes +
+                  bytes([file_type]) + encode_uleb128(size))
+        self.entries.append(FileEntry(
+            folder=self._current_folder,
+            filename=filename,
+            file_type=file_type,
+            data_offset=self.offset + len(prefix),
+            compressed_size=size,
+            digest=digest
+        ))
+        self.offset += len(prefix) + size
+        return prefix
+    
+    def file_blocks(self, filename: str, compressed: BlockCompressed, digest: Optional[bytes] = None) -> List[bytes]:
+        """
+        Record for a block-compressed file (v2 only).
+        
+        Returns:
+            Chunks to write in order: the record prefix, then the blocks with
+            the zero padding that puts each one on a BLOCK_ALIGNMENT boundary.
+        """
+        if self.version == ARCHIVE_VERSION_1:
+            raise ValueError("Block-compressed files need archive format v2")
+        
+        # Block offsets are relative to an aligned data start, so they don't
+        # depend on where in the archive the record lands
+        offsets: List[int] = []
+        position = 0
+        for block in compressed.blocks:
+            position += -position % BLOCK_ALIGNMENT
+            offsets.append(position)
+            position += len(block)
+        data_size = position
+        
+        filename_bytes = filename.encode('utf-8')
+        prefix = bytearray(encode_uleb128(len(filename_bytes)) + filename_bytes + bytes([FILE_TYPE_BLOCKS]))
+        prefix += encode_uleb128(compressed.raw_size)
+        prefix += encode_uleb128(compressed.block_size)
+        prefix += encode_uleb128(len(compressed.blocks))
+        for block_offset, block in zip(offsets, compressed.blocks):
+            prefix += encode_uleb128(block_offset)
+            prefix += encode_uleb128(len(block))
+        prefix += encode_uleb128(data_size)
+        lead_padding = -(self.offset + len(prefix) + BLOCK_PAD_STRUCT.size) % BLOCK_ALIGNMENT
+        prefix += BLOCK_PAD_STRUCT.pack(lead_padding)
+        prefix += bytes(lead_padding)
+        
+        self.entries.append(FileEntry(
+            folder=self._current_folder,
+            filename=filename,
+            file_type=FILE_TYPE_BLOCKS,
+            data_offset=self.offset + len(prefix),
+            compressed_size=data_size,
+            blocks=BlockTable(compressed.raw_size, compressed.block_size, offsets,
+                              [len(block) for block in compressed.blocks]),
+            digest=digest
+        ))
+        self.offset += len(prefix) + data_size
+        
+        chunks = [bytes(prefix)]
+        position = 0
+        for block_offset, block in zip(offsets, compressed.blocks):
+            if block_offset > position:
+                chunks.append(bytes(block_offset - position))
+            chunks.append(block)
+            position = block_offset + len(block)
+        return chunks
+    
+    def file_data(self, filename: str, data: Union[bytes, BlockCompressed, StoredUncompressed, ZstdCompressed],
+                  digest: Optional[bytes] = None) -> List[bytes]:
+        """Chunks to write for a file's compressed data, whichever way it was compressed."""
+        if isinstance(data, BlockCompressed):
+            return self.file_blocks(filename, data, digest)
+        if isinstance(data, StoredUncompressed):
+            if self.version == ARCHIVE_VERSION_1:
+                raise ValueError("Uncompressed files need archive format v2")
+            return [self.file_content(filename, len(data), FILE_TYPE_STORED, digest), data.data]
+        if isinstance(data, ZstdCompressed):
+            if self.version == ARCHIVE_VERSION_1:
+                raise ValueError("zstd-compressed files need archive format v2")
+            return [self.file_content(filename, len(data), FILE_TYPE_ZSTD, digest), data.data]
+        return [self.file_content(filename, len(data), digest=digest), data]
+    
+    def file_reference(self, filename: str, source_folder: str, source_filename: str) -> bytes:
+        """Record for a file that references another file in the archive."""
+        filename_bytes = filename.encode('utf-8')
+        source_folder_bytes = source_folder.encode('utf-8')
+        source_filename_bytes = source_filename.encode('utf-8')
+        self.entries.append(FileEntry(
+            folder=self._current_folder,
+            filename=filename,
+            file_type=FILE_TYPE_REFERENCE,
+            data_offset=0,
+            compressed_size=0,
+            ref_folder=source_folder,
+            ref_filename=source_filename
+        ))
+        return self._emit(encode_uleb128(len(filename_bytes)) + filename_bytes + bytes([FILE_TYPE_REFERENCE]) +
+                          encode_uleb128(len(source_folder_bytes)) + source_folder_bytes +
+                          encode_uleb128(len(source_filename_bytes)) + source_filename_bytes)
+    
+    def finish(self) -> bytes:
+        """End marker, index block and trailer (v2); nothing for v1."""
+        if self.version == ARCHIVE_VERSION_1:
+            return b''
+        flags = index_flags(self.entries)
+        index = encode_index(self.folders, self.entries, flags)
+        index_offset = self.offset + 1
+        trailer = TRAILER_STRUCT.pack(index_offset, len(index), self.version, flags, ARCHIVE_MAGIC)
+        return self._emit(bytes([FOLDER_TYPE_END]) + index + trailer)
+
+
+# ============== INDEX SIDECAR ==============
+#
+# v1 archives have no index, so PackedArchive caches the scanned index in a
+# "<archive>.idx" sidecar next to the archive:
+# - SIDECAR_STRUCT: magic, sidecar version, archive size, archive mtime (ns),
+#   hash of the first SIDECAR_HEAD_SIZE bytes of the archive
+# - Index block (same encoding as the v2 index)
+# A sidecar whose key doesn't match the archive is stale and gets rebuilt.
+
+SIDECAR_MAGIC = b'RVIX'
+SIDECAR_VERSION = 1
+SIDECAR_EXTENSION = '.idx'
+SIDECAR_HEAD_SIZE = 64 * 1024
+SIDECAR_STRUCT = struct.Struct('<4sB3xQQ16s')
+
+
+def sidecar_path(archive_path: str) -> str:
+    """Path of the index sidecar for an archive."""
+    return archive_path + SIDECAR_EXTENSION
+
+
+def sidecar_key(head: bytes, size: int, mtime_ns: int) -> bytes:
+    """Key identifying one exact state of an archive file."""
+    head_hash = hashlib.blake2b(head[:SIDECAR_HEAD_SIZE], digest_size=16).digest()
+    return SIDECAR_STRUCT.pack(SIDECAR_MAGIC, SIDECAR_VERSION, size, mtime_ns, head_hash)
+
+
+def read_index_sidecar(path: str, key: bytes) -> Optional[Tuple[List[Tuple[str, Optional[str]]], List['FileEntry']]]:
+    """
+    Load an index sidecar.
+    
+    Returns:
+        (folders, entries) as from decode_index(), or None if the sidecar is
+        missing, stale or unreadable.
+    """
     try:
-        while True:
-            try:
-                folder_type = read_bytes(1)[0]
-            except EOFError:
-                break
-            
-            folder_name_len = read_uleb128()
-            folder_name = read_bytes(folder_name_len).decode('utf-8')
-            
-            if folder_type == FOLDER_TYPE_COPY:
-                source_name_len = read_uleb128()
-                source_name = read_bytes(source_name_len).decode('utf-8')
-                yield (folder_name, source_name, -1, None, None)
-            else:
-                num_files = read_uleb128()
-                
-                for _ in range(num_files):
-                    filename_len = read_uleb128()
-                    filename = read_bytes(filename_len).decode('utf-8')
-                    
-                    file_type = read_bytes(1)[0]
-                    
-                    if file_type == FILE_TYPE_REFERENCE:
-                        src_folder_len = read_uleb128()
-                        src_folder = read_bytes(src_folder_len).decode('utf-8')
-                        src_filename_len = read_uleb128()
-                        src_filename = read_bytes(src_filename_len).decode('utf-8')
-                        yield (folder_name, filename, -2, None, (src_folder, src_filename))
-                    else:
-                        compressed_len = read_uleb128()
-                        # We can't know decompressed size without decompressing,
-                        # so we pass compressed_len and decompress in the generator
-                        yield (folder_name, filename, compressed_len, file_chunk_generator_decompressed(compressed_len), None)
-    except EOFError:
-        pass
+        with open(path, 'rb') as f:
+            if f.read(SIDECAR_STRUCT.size) != key:
+                return None
+            return decode_index(f.read())
+    except (OSError, ValueError, IndexError, UnicodeDecodeError):
+        return None
 
 
-def stream_unpack_to_disk(chunks: Iterator[bytes], output_dir: str) -> None:
-    """Stream unpack directly to disk (sync)."""
-    unpacked_folders: Dict[str, str] = {}
-    unpacked_files: Dict[Tuple[str, str], str] = {}
+def write_index_sidecar(path: str, key: bytes, folders: List[Tuple[str, Optional[str]]], entries: List['FileEntry']) -> bool:
+    """
+    Write an index sidecar atomically.
     
-    for folder_name, filename, file_size, file_chunks, source_ref in stream_unpack(chunks):
-        folder_path = os.path.join(output_dir, folder_name)
-        os.makedirs(folder_path, exist_ok=True)
-        unpacked_folders[folder_name] = folder_path
-        
-        if file_size == -1:
-            # Copy folder
-            source_name = filename
-            source_path = unpacked_folders.get(source_name)
-            if source_path and os.path.exists(source_path):
-                for fname in os.listdir(source_path):
-                    src_file = os.path.join(source_path, fname)
-                    dst_file = os.path.join(folder_path, fname)
-                    if os.path.isfile(src_file):
-                        shutil.copy2(src_file, dst_file)
-                        unpacked_files[(folder_name, fname)] = dst_file
-                print(f"Copied folder: {folder_name} <- {source_name}")
-        elif file_size == -2:
-            # File reference
-            src_folder, src_filename = source_ref
-            src_file_path = unpacked_files.get((src_folder, src_filename))
-            file_path = os.path.join(folder_path, filename)
-            if src_file_path and os.path.exists(src_file_path):
-                shutil.copy2(src_file_path, file_path)
-                unpacked_files[(folder_name, filename)] = file_path
-                print(f"Copied: {folder_name}/{filename} <- {src_folder}/{src_filename}")
-        else:
-            file_path = os.path.join(folder_path, filename)
-            with open(file_path, 'wb') as f:
-                for chunk in file_chunks:
-                    f.write(chunk)
-            unpacked_files[(folder_name, filename)] = file_path
-            print(f"Unpacked: {folder_name}/{filename} ({file_size} bytes)")
+    Returns:
+        True if written, False if the index can't be encoded or the file can't
+        be written (e.g. read-only directory); callers just skip caching then.
+    """
+    try:
+        index = encode_index(folders, entries)
+    except ValueError as e:
+        print(f"Not caching archive index: {e}")
+        return False
     
-    print(f"\nStream unpacked to {output_dir}")
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(key)
+            f.write(index)
+        os.replace(temp_path, path)
+        return True
+    except OSError as e:
+        print(f"Could not write index sidecar {path}: {e}")
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        return False
 
 
-# ============== ASYNC FUNCTIONS ==============
+# ============== COMPRESSION PROFILES ==============
+#
+# pack_folder(profile=...) plans the brotli settings per file extension:
+# samples of each extension's files are compressed with every candidate in
+# PROFILE_CANDIDATES, and the extension gets the candidate that decodes
+# fastest among those within PROFILE_SIZE_TOLERANCE of the smallest output
+# (ties broken by encoding speed). Choices are saved in a JSON profile file
+# and reused as they are by later packs; only extensions missing from it
+# are planned.
+#
+# Profile file:
+#   {"version": 1,
+#    "extensions": {".dat": {"quality": 11, "lgwin": 24, "mode": "text",
+#                            "ratio": 0.21, "decode_mb_s": 410.5}, ...}}
+# ratio and decode_mb_s are what the trial measured, for reference.
+# Extensions are lowercase with the dot; "" is files without one.
+#
+# The window size isn't varied: samples are smaller than any window, so
+# trials can't tell windows apart, and a smaller window only loses ratio on
+# the large files. Edit lgwin in the profile to change it.
+
+PROFILE_VERSION = 1
+PROFILE_MODES = {'generic': brotli.MODE_GENERIC, 'text': brotli.MODE_TEXT, 'font': brotli.MODE_FONT}
+PROFILE_CANDIDATES = [BrotliSettings(quality, BROTLI_LGWIN, mode)
+                      for quality in (11, 9, 6) for mode in (brotli.MODE_GENERIC, brotli.MODE_TEXT)]
+PROFILE_SIZE_TOLERANCE = 0.01  # Candidates at most 1% larger than the smallest are eligible
+PROFILE_DECODE_TOLERANCE = 0.05  # Decode times this close count as a tie
+PROFILE_SAMPLE_FILES = 4  # Files sampled per extension
+PROFILE_MIN_BYTES = 64 * 1024  # Extensions with less data than this keep the default settings
+PROFILE_DECODE_RUNS = 3  # Decode timings per trial (the fastest counts)
+
 
-async def pack_folder_async(folder_path: str, output_file: str, deduplicate: bool = True, max_workers: int = None) -> None:
+def file_extension(filename: str) -> str:
+    """Profile key of a file: its lowercase extension including the dot."""
+    return os.path.splitext(filename)[1].lower()
+
+
+def read_trial_sample(file_path: str) -> bytes:
+    """trial_sample() of a file's content, reading only the sampled ranges."""
+    size = os.path.getsize(file_path)
+    with open(file_path, 'rb') as f:
+        if size <= STORE_SAMPLE_SIZE * STORE_SAMPLES:
+            return f.read()
+        last = size - STORE_SAMPLE_SIZE
+        parts = []
+        for i in range(STORE_SAMPLES):
+            f.seek(last * i // (STORE_SAMPLES - 1))
+            parts.append(f.read(STORE_SAMPLE_SIZE))
+        return b''.join(parts)
+
+
+def profile_trial_task(args: Tuple[List[str], BrotliSettings]) -> Tuple[int, int, float, float]:
     """
-    Pack all files from folder and subfolders into a single file (async).
-    Uses parallel Brotli compression for maximum speed with quality 11.
+    Compress the samples of some files with the given settings. Used for parallel processing.
     
-    Args:
-        folder_path: Path to folder to pack
-        output_file: Output file path
-        deduplicate: If True, detect and deduplicate identical folders and files
-        max_workers: Maximum number of parallel compression workers (default: CPU count)
+    Returns:
+        (original bytes, compressed bytes, seconds encoding, seconds decoding)
     """
-    folder_path = folder_path.rstrip('/\\')
-    parent_dir = os.path.dirname(folder_path) or '.'
+    file_paths, settings = args
+    original = compressed = 0
+    encode_time = decode_time = 0.0
+    for file_path in file_paths:
+        sample = read_trial_sample(file_path)
+        start = time.perf_counter()
+        data = compress_brotli(sample, settings)
+        encode_time += time.perf_counter() - start
+        runs = []
+        for _ in range(PROFILE_DECODE_RUNS):
+            start = time.perf_counter()
+            decompress_brotli(data)
+            runs.append(time.perf_counter() - start)
+        decode_time += min(runs)
+        original += len(sample)
+        compressed += len(data)
+    return original, compressed, encode_time, decode_time
+
+
+def choose_profile(trials: List[Tuple[BrotliSettings, Tuple[int, int, float, float]]]) -> Tuple[BrotliSettings, Tuple[int, int, float, float]]:
+    """Pick the fastest decoding candidate whose output is within PROFILE_SIZE_TOLERANCE of the smallest."""
+    smallest = min(result[1] for settings, result in trials)
+    eligible = [trial for trial in trials if trial[1][1] <= smallest * (1 + PROFILE_SIZE_TOLERANCE)]
+    fastest = min(result[3] for settings, result in eligible)
+    ties = [trial for trial in eligible if trial[1][3] <= fastest * (1 + PROFILE_DECODE_TOLERANCE)]
+    return min(ties, key=lambda trial: trial[1][2])
+
+
+def load_profiles(profile_file: str) -> Dict[str, BrotliSettings]:
+    """Settings per extension recorded in a profile file ({} if it doesn't exist)."""
+    if not os.path.exists(profile_file):
+        return {}
+    with open(profile_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    if data.get('version') != PROFILE_VERSION:
+        raise ValueError(f"Unsupported compression profile version in {profile_file}: {data.get('version')}")
+    profiles = {}
+    for extension, entry in data.get('extensions', {}).items():
+        if entry['mode'] not in PROFILE_MODES:
+            raise ValueError(f"Unknown brotli mode in {profile_file}: {entry['mode']}")
+        profiles[extension] = BrotliSettings(int(entry['quality']), int(entry['lgwin']), PROFILE_MODES[entry['mode']])
+    return profiles
+
+
+def save_profiles(profile_file: str, profiles: Dict[str, BrotliSettings],
+                  measured: Optional[Dict[str, Dict[str, float]]] = None) -> None:
+    """Write settings per extension (plus what their trials measured) to a profile file."""
+    mode_names = {mode: name for name, mode in PROFILE_MODES.items()}
+    previous = {}
+    if os.path.exists(profile_file):
+        with open(profile_file, 'r', encoding='utf-8') as f:
+            previous = json.load(f).get('extensions', {})
+    extensions = {}
+    for extension in sorted(profiles):
+        settings = profiles[extension]
+        entry = {'quality': settings.quality, 'lgwin': settings.lgwin, 'mode': mode_names[settings.mode]}
+        entry.update((measured or {}).get(extension) or
+                     {k: v for k, v in previous.get(extension, {}).items() if k not in entry})
+        extensions[extension] = entry
+    tmp_file = profile_file + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump({'version': PROFILE_VERSION, 'extensions': extensions}, f, indent=2)
+        f.write('\n')
+    os.replace(tmp_file, profile_file)
+
+
+def plan_profiles(files_to_compress: List[CompressTask], profile_file: str, max_workers: int) -> Dict[str, BrotliSettings]:
+    """
+    Load a profile file and plan the extensions of files_to_compress it lacks.
     
-    if max_workers is None:
-        max_workers = os.cpu_count() or 4
+    Args:
+        files_to_compress: Tasks as passed to compress_file_task()
+        profile_file: JSON profile; created or extended with the new choices
+        max_workers: Processes running the trials
     
-    # Find duplicates if deduplication is enabled
-    folder_duplicates: Dict[str, str] = {}
-    file_duplicates: Dict[Tuple[str, str], Tuple[str, str]] = {}
+    Returns:
+        Settings per extension (extensions without any keep the defaults)
+    """
+    profiles = load_profiles(profile_file)
+    paths_by_extension: Dict[str, List[str]] = {}
+    for task in files_to_compress:
+        if not is_already_brotli(task.filename):
+            paths_by_extension.setdefault(file_extension(task.filename), []).append(task.file_path)
     
-    if deduplicate:
-        print("Scanning for duplicates...")
-        folder_duplicates, file_duplicates = await asyncio.get_event_loop().run_in_executor(
-            None, find_duplicates, folder_path, parent_dir
-        )
-        if folder_duplicates or file_duplicates:
-            print(f"Found {len(folder_duplicates)} duplicate folder(s), {len(file_duplicates)} duplicate file(s)")
-        else:
-            print("No duplicates found")
-        print()
+    to_plan: Dict[str, List[str]] = {}
+    for extension in sorted(paths_by_extension):
+        paths = sorted(paths_by_extension[extension])
+        if extension in profiles or sum(os.path.getsize(path) for path in paths) < PROFILE_MIN_BYTES:
+            continue
+        # Files spread over the sorted list, so one folder doesn't decide
+        count = min(PROFILE_SAMPLE_FILES, len(paths))
+        to_plan[extension] = [paths[i * len(paths) // count] for i in range(count)]
+    if not to_plan:
+        return profiles
     
-    folder_bytes_saved = 0
-    file_bytes_saved = 0
-    total_original_size = 0
-    total_compressed_size = 0
+    print(f"Planning compression profiles for {len(to_plan)} extension(s) "
+          f"({len(PROFILE_CANDIDATES)} candidates each)...")
+    trials = [(extension, settings) for extension in to_plan for settings in PROFILE_CANDIDATES]
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(profile_trial_task, [(to_plan[extension], settings)
+                                                         for extension, settings in trials]))
     
-    # First pass: collect all files that need compression
-    print("Collecting files for compression...")
-    files_to_compress: List[Tuple[str, str, str]] = []  # (file_path, rel_path, filename)
-    folder_structure: List[Tuple[str, List[str], bool, str]] = []  # (rel_path, files, is_duplicate, source_path)
+    measured: Dict[str, Dict[str, float]] = {}
+    for extension in to_plan:
+        candidates = [(settings, result) for (ext, settings), result in zip(trials, results) if ext == extension]
+        settings, (original, compressed, encode_time, decode_time) = choose_profile(candidates)
+        profiles[extension] = settings
+        measured[extension] = {
+            'ratio': round(compressed / original, 4) if original else 1.0,
+            'decode_mb_s': round(original / 1024 / 1024 / decode_time, 1) if decode_time > 0 else 0.0,
+        }
+        mode_name = next(name for name, mode in PROFILE_MODES.items() if mode == settings.mode)
+        print(f"  {extension or '(none)'}: quality {settings.quality}, lgwin {settings.lgwin}, {mode_name} "
+              f"({measured[extension]['ratio'] * 100:.1f}%, decodes at {measured[extension]['decode_mb_s']} MB/s)")
+    save_profiles(profile_file, profiles, measured)
+    print(f"Saved compression profiles to {profile_file}")
+    return profiles
+
+
+# ============== CODEC RULES ==============
+#
+# pack_folder(codecs=...) picks each file's codec by rules: (pattern, codec)
+# pairs tried in order against the file's archive path with fnmatch, e.g.
+# ('vcsky/data/*.dat', 'zstd'); the first match wins and unmatched files
+# use brotli. Keep brotli for what browsers fetch whole (it is passed
+# through as Content-Encoding: br) and use zstd for what gets decoded
+# anyway: files requested by range or by clients without brotli, and every
+# file of an archive that is only ever unpacked ([('*', 'zstd')]). Files
+# that don't compress are still stored raw whatever their codec (see
+# STORE_MIN_GAIN), and .br files stay as they are.
+#
+# CODEC_TARGETS holds the default rules per target of an archive (pack
+# --target): "serve" keeps brotli for every file, "unpack" uses zstd for
+# every file. Explicit --codec rules come first, so they override them.
+
+CODEC_TARGETS = {
+    'serve': [],  # Browsers get the brotli streams as they are
+    'unpack': [('*', CODEC_ZSTD)],  # Every file is decoded (unpack, downloader)
+}
+
+def parse_codec_rules(spec: str) -> List[Tuple[str, str]]:
+    """Parse 'CODEC' (every file) or 'CODEC:PATTERN[,PATTERN...]' into codec rules."""
+    codec, _, patterns = spec.partition(':')
+    if codec not in CODECS:
+        raise ValueError(f"Unknown codec: {codec} (expected one of {', '.join(CODECS)})")
+    return [(pattern, codec) for pattern in (patterns.split(',') if patterns else ['*']) if pattern]
+
+
+def check_codec_rules(codecs: Optional[List[Tuple[str, str]]], format_version: int) -> None:
+    """Raise if codec rules can't be packed into an archive of this format version."""
+    used = {codec for pattern, codec in codecs or []}
+    unknown = used - set(CODECS)
+    if unknown:
+        raise ValueError(f"Unknown codec: {', '.join(sorted(unknown))}")
+    if used - {CODEC_BROTLI} and format_version == ARCHIVE_VERSION_1:
+        raise ValueError("zstd and raw entries need archive format v2")
+    if CODEC_ZSTD in used:
+        require_zstd()
+
+
+def choose_codec(codecs: Optional[List[Tuple[str, str]]], rel_path: str, filename: str) -> str:
+    """Codec of the first rule matching a file's archive path (brotli if none does)."""
+    path = f"{rel_path}/{filename}".replace(os.sep, '/')
+    for pattern, codec in codecs or []:
+        if fnmatch.fnmatchcase(path, pattern):
+            return codec
+    return CODEC_BROTLI
+
+
+# ============== INCREMENTAL PACKING ==============
+#
+# pack_folder(base=...) copies the compressed data of files whose content
+# is unchanged from a previous archive instead of compressing them again.
+# Entries are matched on the content digest of the original file and on how
+# the new archive would store it (as-is for .br files, as one zstd frame,
+# block-compressed with the same block size, or as one brotli stream), so
+# the copied bytes are exactly what compressing the file again would
+# produce, up to encoder settings. Files the base stored uncompressed (FILE_TYPE_STORED) match
+# however they would be compressed, unless storing is disabled.
+
+HASH_CHUNK_SIZE = 1024 * 1024  # Files are hashed in chunks of this size
+
+
+def file_digest(file_path: str) -> bytes:
+    """content_digest() of a file, read in chunks."""
+    hasher = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.digest()
+
+
+def storage_kind(filename: str, size: int, block_size: int, codec: str = CODEC_BROTLI) -> Tuple:
+    """How a file of this name and size is stored with the given block size and codec."""
+    if is_already_brotli(filename):
+        return ('raw',)
+    if codec == CODEC_RAW:
+        return ('stored',)
+    if codec == CODEC_ZSTD:
+        return ('zstd',)
+    if block_size > 0 and size > block_size:
+        return ('blocks', block_size)
+    return ('brotli',)
+
+
+class BaseArchiveBlobs:
+    """
+    The stored data of a previous archive, looked up by content digest.
     
-    for root, dirs, files in os.walk(folder_path):
-        # Filter out ignored files
-        files = [f for f in files if not should_ignore_file(f)]
-        if not files:
-            continue
+    v2 archives record the digests in their index. v1 archives don't, so
+    their entries are decoded once to compute them.
+    
+    Usage:
+        with BaseArchiveBlobs('previous.bin') as base:
+            entry = base.find(file_digest(path), filename, size, block_size)
+            if entry is not None:
+                data = base.read(entry)
+    """
+    
+    def __init__(self, archive_path: str):
+        self._path = archive_path
+        self._file: Optional[BinaryIO] = open(archive_path, 'rb')
+        self._entries: Dict[Tuple[bytes, Tuple], 'FileEntry'] = {}
+        
+        if os.fstat(self._file.fileno()).st_size == 0:
+            return
+        with mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            version, _, entries = read_archive_index(data)
+            if version == ARCHIVE_VERSION_1:
+                print(f"Computing content digests of v1 base archive {archive_path}...")
+            for entry in entries:
+                if entry.file_type == FILE_TYPE_REFERENCE:
+                    continue
+                if entry.digest is None:
+                    stored = data[entry.data_offset:entry.data_offset + entry.compressed_size]
+                    if entry.file_type == FILE_TYPE_BLOCKS:
+                        content = b''.join(iter_decoded_blocks(stored, entry.blocks))
+                    else:
+                        content = decompress_codec(entry_codec(entry.file_type, entry.filename), stored)
+                    entry.digest = content_digest(content)
+                if entry.file_type == FILE_TYPE_BLOCKS:
+                    kind = ('blocks', entry.blocks.block_size)
+                elif entry.file_type == FILE_TYPE_STORED:
+                    kind = ('stored',)
+                elif entry.file_type == FILE_TYPE_ZSTD:
+                    kind = ('zstd',)
+                else:
+                    kind = ('raw',) if is_already_brotli(entry.filename) else ('brotli',)
+                self._entries.setdefault((entry.digest, kind), entry)
+    
+    @property
+    def path(self) -> str:
+        return self._path
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+    
+    def __enter__(self) -> 'BaseArchiveBlobs':
+        return self
+    
+    def __exit__(self, *exc) -> None:
+        self.close()
+    
+    def _read(self, offset: int, size: int) -> bytes:
+        self._file.seek(offset)
+        return self._file.read(size)
+    
+    def find(self, digest: bytes, filename: str, size: int, block_size: int = 0,
+             store: bool = True, codec: str = CODEC_BROTLI) -> Optional['FileEntry']:
+        """
+        Find the base entry holding a file's data as the new archive would store it.
         
-        rel_path = os.path.relpath(root, parent_dir)
+        Args:
+            digest: Content digest of the file
+            filename: Its name (.br files are stored as-is)
+            size: Its size
+            block_size: Block size of the archive being packed (0: none)
+            store: Whether the archive being packed stores incompressible
+                   files uncompressed (FILE_TYPE_STORED)
+            codec: Codec the file is packed with
         
-        if rel_path in folder_duplicates:
-            source_path = folder_duplicates[rel_path]
-            folder_structure.append((rel_path, list(files), True, source_path))
-            for filename in files:
-                file_path = os.path.join(root, filename)
-                folder_bytes_saved += os.path.getsize(file_path)
+        Returns:
+            The entry, or None if the base has no such entry
+        """
+        kind = storage_kind(filename, size, block_size, codec)
+        if store and kind != ('raw',):
+            entry = self._entries.get((digest, ('stored',)))
+            if entry is not None:
+                return entry
+        return self._entries.get((digest, kind))
+    
+    def read(self, entry: 'FileEntry') -> Union[bytes, BlockCompressed, StoredUncompressed, ZstdCompressed]:
+        """Stored data of an entry found with find(), in the form compress_file_task() returns it."""
+        if entry.file_type == FILE_TYPE_STORED:
+            return StoredUncompressed(self._read(entry.data_offset, entry.compressed_size))
+        if entry.file_type == FILE_TYPE_ZSTD:
+            return ZstdCompressed(self._read(entry.data_offset, entry.compressed_size))
+        if entry.file_type == FILE_TYPE_BLOCKS:
+            table = entry.blocks
+            blocks = [self._read(entry.data_offset + offset, block_len)
+                      for offset, block_len in zip(table.offsets, table.sizes)]
+            return BlockCompressed(table.raw_size, table.block_size, blocks)
+        return self._read(entry.data_offset, entry.compressed_size)
+    
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def reuse_base_blobs(base: BaseArchiveBlobs, files_to_compress: List[CompressTask],
+                     max_workers: int) -> Tuple[List[CompressTask], Dict[Tuple[str, str], Tuple['FileEntry', bytes]]]:
+    """
+    Take the files whose compressed data a base archive already holds out of
+    a compression work list.
+    
+    Args:
+        base: Previous archive
+        files_to_compress: Tasks as passed to compress_file_task()
+        max_workers: Threads hashing the files
+    
+    Returns:
+        (files still to compress, {(rel_path, filename): (base entry, digest)}
+        for the files found in the base; read their data with base.read())
+    """
+    print(f"Matching files against base archive {base.path}...")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        digests = list(executor.map(lambda task: file_digest(task.file_path), files_to_compress))
+    
+    remaining: List[CompressTask] = []
+    reused: Dict[Tuple[str, str], Tuple['FileEntry', bytes]] = {}
+    reused_bytes = 0
+    for task, digest in zip(files_to_compress, digests):
+        file_path, rel_path, filename, block_size, min_gain, settings, codec = task
+        entry = base.find(digest, filename, os.path.getsize(file_path), block_size, store=min_gain > 0, codec=codec)
+        if entry is None:
+            remaining.append(task)
         else:
-            folder_structure.append((rel_path, sorted(files), False, None))
-            for filename in sorted(files):
-                file_key = (rel_path, filename)
-                if file_key not in file_duplicates:
-                    file_path = os.path.join(root, filename)
-                    files_to_compress.append((file_path, rel_path, filename))
+            reused[(rel_path, filename)] = (entry, digest)
+            reused_bytes += entry.compressed_size
+    print(f"Reusing {len(reused)} files ({reused_bytes} bytes) from the base archive, "
+          f"{len(remaining)} new or changed")
+    return remaining, reused
+
+
+# ============== SEGMENTED COMPRESSION ==============
+#
+# A block-compressed file (see FILE_TYPE_BLOCKS) doesn't have to be
+# compressed by one worker: its blocks are independent streams. Files
+# spanning more than SEGMENT_TASK_BYTES are cut into segments of whole
+# blocks, each compressed by its own task on the pool (next to one hashing
+# the file), and the blocks are put back together in order, so a giant
+# file (cuts.img, the big .data payloads) keeps every worker busy instead
+# of one. The result is exactly what compress_file_task() produces, the
+# STORE_MIN_GAIN trial included: it runs as a task of its own before the
+# segments are submitted. Pack with --block-size to split giant files this
+# way; files without blocks (block_size 0, zstd, .br) are always
+# compressed whole.
+
+SEGMENT_TASK_BYTES = 8 * 1024 * 1024  # Decoded bytes of the blocks compressed by one task
+
+
+def segment_ranges(task: CompressTask,
+                   size: int) -> Optional[List[Tuple[int, int]]]:
+    """
+    (start, length) of the segments a file is compressed in by separate tasks.
+    
+    Returns:
+        None if the file is compressed whole by compress_file_task()
+    """
+    if task.block_size <= 0 or task.codec != CODEC_BROTLI or is_already_brotli(task.filename):
+        return None
+    span = task.block_size * max(1, SEGMENT_TASK_BYTES // task.block_size)
+    if size <= span:
+        return None
+    return [(start, min(span, size - start)) for start in range(0, size, span)]
+
+
+def passes_store_trial(task: CompressTask) -> bool:
+    """Whether a large file passes the trial_sample() check of compress_file_task() (or has none)."""
+    if task.min_gain <= 0:
+        return True
+    return store_trial_gain(task.codec, read_trial_sample(task.file_path), task.settings) >= task.min_gain
+
+
+def compress_segment_task(args: Tuple[str, int, int, int, Optional[BrotliSettings]]) -> List[bytes]:
+    """
+    Compress one segment of a file into blocks. Used for parallel processing.
+    Args: (file_path, start, length, block_size, settings); start is a multiple of block_size
+    Returns: the compressed blocks
+    """
+    file_path, start, length, block_size, settings = args
+    with open(file_path, 'rb') as f:
+        f.seek(start)
+        content = f.read(length)
+    return compress_blocks(content, block_size, settings).blocks
+
+
+def join_segments(task: CompressTask, size: int,
+                  digest: bytes, segments: List[List[bytes]]) -> CompressResult:
+    """compress_file_task() result for a file compressed segment by segment."""
+    file_path, rel_path, filename, block_size, min_gain, settings, codec = task
+    compressed = BlockCompressed(raw_size=size, block_size=block_size,
+                                 blocks=[block for blocks in segments for block in blocks])
+    if min_gain > 0 and compression_gain(size, len(compressed)) < min_gain:
+        with open(file_path, 'rb') as f:
+            return CompressResult(rel_path, filename, file_path, StoredUncompressed(f.read()), size, size, False, digest)
+    return CompressResult(rel_path, filename, file_path, compressed, size, len(compressed), False, digest)
+
+
+# ============== PACK SCHEDULING ==============
+#
+# Files are compressed in order of estimated cost (size times a per-codec
+# factor), largest first, not in os.walk order: a big file submitted last
+# would leave one worker grinding through it while the others sit idle.
+# The archive is still written in its own order (see STREAMING PACK WRITER),
+# so results that finish early wait for their turn; the bytes held that
+# way count against PACK_WINDOW_BYTES like those in flight. PackProgress
+# turns finished work into a rate and an ETA for the progress lines, and
+# PackTimings records where a pack spends its time (--timings saves it as
+# JSON).
+
+COMPRESS_COST = {CODEC_BROTLI: 1.0, CODEC_ZSTD: 0.2, CODEC_RAW: 0.01}  # Relative compression time per byte
+BROTLI_FAST_COST = 0.1  # Brotli qualities below 10 (profiles) skip the slow block search
+TIMING_PHASES = ('scan', 'hash', 'compress', 'write')
+
+
+def compression_cost(task: CompressTask, size: int) -> float:
+    """Estimated time to compress a file, in units of brotli quality 11 bytes."""
+    if is_already_brotli(task.filename):
+        return size * COMPRESS_COST[CODEC_RAW]
+    if task.codec == CODEC_BROTLI and task.settings is not None and task.settings.quality < 10:
+        return size * BROTLI_FAST_COST
+    return size * COMPRESS_COST[task.codec]
+
+
+class PackSchedule:
+    """
+    Order in which iter_compressed() submits files: largest estimated cost
+    first, while the window has room.
+    
+    At most max_pending files are compressing at a time, and the files
+    submitted but not yet taken hold at most PACK_WINDOW_BYTES of original
+    data (one file may exceed it alone). The head file (the next one in
+    archive order) is always submitted, so the window can't stall.
+    """
+    
+    def __init__(self, tasks: List[CompressTask], max_pending: int):
+        self.sizes = [os.path.getsize(task.file_path) for task in tasks]
+        self.costs = [compression_cost(task, size) for task, size in zip(tasks, self.sizes)]
+        self.max_pending = max_pending
+        self.head = 0  # Next file in archive order
+        self.running = 0  # Files submitted and not finished
+        self.held = 0  # Files submitted and not yet taken
+        self.held_bytes = 0
+        self._by_cost = sorted(range(len(tasks)), key=lambda index: (-self.costs[index], index))
+        self._next = 0
+        self._submitted = [False] * len(tasks)
+        self._finished = [False] * len(tasks)
+    
+    def done(self) -> bool:
+        return self.head == len(self.sizes)
+    
+    def _admits(self, size: int) -> bool:
+        if self.held == 0:
+            return True
+        return self.running < self.max_pending and self.held_bytes + size <= PACK_WINDOW_BYTES
+    
+    def _submit(self, index: int) -> int:
+        self._submitted[index] = True
+        self.running += 1
+        self.held += 1
+        self.held_bytes += self.sizes[index]
+        return index
+    
+    def admit(self) -> List[int]:
+        """Files to submit now, costliest first."""
+        admitted = []
+        while self._next < len(self._by_cost):
+            index = self._by_cost[self._next]
+            if self._submitted[index]:
+                self._next += 1
+                continue
+            if not self._admits(self.sizes[index]):
+                break
+            admitted.append(self._submit(index))
+            self._next += 1
+        if not self.done() and not self._submitted[self.head]:
+            admitted.append(self._submit(self.head))
+        return admitted
+    
+    def finish(self, index: int) -> None:
+        """Record that all tasks of a file are done."""
+        self._finished[index] = True
+        self.running -= 1
+    
+    def head_ready(self) -> bool:
+        return not self.done() and self._finished[self.head]
+    
+    def take_head(self) -> int:
+        """Advance past the head file (its result is being written)."""
+        index = self.head
+        self.head += 1
+        self.held -= 1
+        self.held_bytes -= self.sizes[index]
+        return index
+
+
+class PackProgress:
+    """Throughput and ETA of a pack, from the files finished so far."""
+    
+    def __init__(self):
+        self.total_cost = 0.0
+        self.done_bytes = 0
+        self.done_cost = 0.0
+        self.started = time.perf_counter()
+    
+    def start(self, costs: List[float]) -> None:
+        """Set the work ahead (compression_cost() of every file) and restart the clock."""
+        self.total_cost = sum(costs)
+        self.started = time.perf_counter()
+    
+    def finish(self, size: int, cost: float) -> None:
+        self.done_bytes += size
+        self.done_cost += cost
+    
+    def status(self) -> str:
+        """'12.3 MB/s, ETA 1m05s' (the ETA scales elapsed time by the cost still to go)."""
+        elapsed = time.perf_counter() - self.started
+        if elapsed <= 0 or self.done_cost <= 0:
+            return "ETA unknown"
+        rate = self.done_bytes / elapsed / (1024 * 1024)
+        eta = int(elapsed * max(0.0, self.total_cost - self.done_cost) / self.done_cost)
+        return f"{rate:.1f} MB/s, ETA {eta // 60}m{eta % 60:02d}s"
+
+
+class PackTimings:
+    """
+    Wall-clock seconds a pack spends in each phase.
+    
+    Phases don't overlap: entering a phase inside another pauses the outer
+    one (time outside every phase isn't counted). 'compress' is the time spent
+    waiting for compression results; the pool keeps compressing while the
+    archive is written, so that part is counted as 'write'.
+    """
+    
+    def __init__(self):
+        self.seconds: Dict[str, float] = dict.fromkeys(TIMING_PHASES, 0.0)
+        self.started = time.perf_counter()
+        self._current: Optional[str] = None
+        self._since = self.started
+    
+    def _switch(self, name: Optional[str]) -> None:
+        now = time.perf_counter()
+        if self._current is not None:
+            self.seconds[self._current] = self.seconds.get(self._current, 0.0) + now - self._since
+        self._current, self._since = name, now
+    
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        outer = self._current
+        self._switch(name)
+        try:
+            yield
+        finally:
+            self._switch(outer)
+    
+    def report(self) -> str:
+        return ", ".join(f"{name} {seconds:.1f}s" for name, seconds in self.seconds.items())
+    
+    def save(self, timings_file: str, files: int, original_bytes: int, max_workers: int) -> None:
+        """Write the phase times and totals as JSON."""
+        total = time.perf_counter() - self.started
+        with open(timings_file, 'w', encoding='utf-8') as f:
+            json.dump({'phases': {name: round(seconds, 3) for name, seconds in self.seconds.items()},
+                       'total': round(total, 3),
+                       'files': files,
+                       'original_bytes': original_bytes,
+                       'bytes_per_second': round(original_bytes / total) if total > 0 else 0,
+                       'workers': max_workers}, f, indent=2)
+            f.write('\n')
+
+
+# ============== STREAMING PACK WRITER ==============
+#
+# pack_folder() writes each file as soon as its compressed data is ready, in
+# the archive's (deterministic) order, instead of holding the whole
+# compressed corpus until every worker is done. Compression tasks are
+# submitted through a bounded window (in the order PackSchedule picks):
+# when the file at the head of the archive order is done it is written and
+# more tasks are submitted, so files finished out of order wait for their
+# turn inside the window. Peak memory is bounded by the window, not by the
+# size of the tree, and the output is identical to writing everything at
+# the end.
+
+PACK_WINDOW_PER_WORKER = 4  # Compression tasks in flight per worker
+PACK_WINDOW_BYTES = 256 * 1024 * 1024  # Original bytes of the files in flight or waiting (beyond the first)
+
+
+def _start_compression(submit: Callable, task: CompressTask, size: int,
+                       passed_trial: bool = True) -> Tuple[Optional[List[Tuple[int, int]]], list]:
+    """
+    Submit the compression of one file: the whole file, or its digest and
+    segments (see segment_ranges()).
+    
+    Args:
+        passed_trial: False if the file failed passes_store_trial(); it is
+                      then stored without running the trial again
+    
+    Returns:
+        (segments or None, futures)
+    """
+    if not passed_trial:
+        return None, [submit(compress_file_task, task._replace(codec=CODEC_RAW))]
+    segments = segment_ranges(task, size)
+    if segments is None:
+        return None, [submit(compress_file_task, task)]
+    futures = [submit(file_digest, task.file_path)]
+    futures += [submit(compress_segment_task, (task.file_path, start, length, task.block_size, task.settings))
+                for start, length in segments]
+    return segments, futures
+
+
+def _compressed_result(task: CompressTask, size: int,
+                       segments: Optional[List[Tuple[int, int]]], results: list) -> CompressResult:
+    """compress_file_task() result from the results of _start_compression()'s futures."""
+    if segments is None:
+        return results[0]
+    return join_segments(task, size, results[0], results[1:])
+
+
+def iter_compressed(executor: ProcessPoolExecutor, files_to_compress: Iterable[CompressTask],
+                    max_pending: int, progress: Optional[PackProgress] = None) -> Iterator[CompressResult]:
+    """
+    compress_file_task() results for files_to_compress, in order.
+    
+    Files are submitted costliest first as PackSchedule admits them; a
+    result is yielded once it and every file before it are done. Files
+    split by segment_ranges() are compressed by several tasks.
+    """
+    tasks = list(files_to_compress)
+    schedule = PackSchedule(tasks, max_pending)
+    if progress is not None:
+        progress.start(schedule.costs)
+    jobs: Dict[int, Tuple[Optional[List[Tuple[int, int]]], list]] = {}  # file index -> (segments or None, futures)
+    running: Dict[Future, int] = {}
+    trials: Dict[Future, int] = {}  # passes_store_trial() of a file to segment -> file index
+    
+    def start(index: int, passed_trial: bool = True) -> None:
+        jobs[index] = _start_compression(executor.submit, tasks[index], schedule.sizes[index], passed_trial)
+        running.update((future, index) for future in jobs[index][1])
+    
+    try:
+        while not schedule.done():
+            for index in schedule.admit():
+                if segment_ranges(tasks[index], schedule.sizes[index]) is not None and tasks[index].min_gain > 0:
+                    # The store trial decides whether the file is segmented; it runs on the pool too
+                    trials[executor.submit(passes_store_trial, tasks[index])] = index
                 else:
-                    file_path = os.path.join(root, filename)
-                    file_bytes_saved += os.path.getsize(file_path)
+                    start(index)
+            if schedule.head_ready():
+                index = schedule.take_head()
+                segments, futures = jobs.pop(index)
+                yield _compressed_result(tasks[index], schedule.sizes[index], segments,
+                                         [future.result() for future in futures])
+                continue
+            finished, _ = wait(list(running) + list(trials), return_when=FIRST_COMPLETED)
+            for future in finished:
+                if future in trials:
+                    index = trials.pop(future)
+                    start(index, future.result())
+                    continue
+                index = running.pop(future)
+                if not any(other in running for other in jobs[index][1]):
+                    schedule.finish(index)
+                    if progress is not None:
+                        progress.finish(schedule.sizes[index], schedule.costs[index])
+    finally:
+        for future in itertools.chain(running, trials):
+            future.cancel()
+
+
+def report_compressed(result: CompressResult, completed: int, total: int, progress: Optional[PackProgress] = None) -> None:
+    """Progress line for a compress_file_task() result (with throughput and ETA if progress is given)."""
+    rel_path, filename, file_path, data, original_size, final_size, is_precompressed, digest = result
+    status = f" - {progress.status()}" if progress is not None else ""
+    if is_precompressed:
+        print(f"  [{completed}/{total}] Stored as-is (.br): {rel_path}/{filename} ({original_size} bytes){status}")
+    elif isinstance(data, StoredUncompressed):
+        print(f"  [{completed}/{total}] Stored uncompressed: {rel_path}/{filename} ({original_size} bytes){status}")
+    else:
+        ratio = (final_size / original_size * 100) if original_size > 0 else 0
+        codec_note = " (zstd)" if isinstance(data, ZstdCompressed) else ""
+        print(f"  [{completed}/{total}] Compressed{codec_note}: {rel_path}/{filename} ({original_size} -> {final_size} bytes, {ratio:.1f}%){status}")
+
+
+# ============== SYNC FUNCTIONS ==============
+
+
+def pack_folders(folder_paths: List[str], output_file: str, deduplicate: bool = True, max_workers: int = None,
+                 format_version: int = ARCHIVE_VERSION, block_size: int = 0,
+                 base: Optional[str] = None, store_min_gain: float = STORE_MIN_GAIN,
+                 profile: Optional[str] = None, codecs: Optional[List[Tuple[str, str]]] = None,
+                 timings: Optional[str] = None) -> None:
+    """
+    Pack all files from several folders and their subfolders into a single
+    file (sync). Each folder becomes a top-level folder of the archive; the
+    folders are scanned once, deduplicated against each other and compressed
+    by one worker pool. Uses parallel Brotli compression for maximum speed
+    with quality 11.
     
-    print(f"Compressing {len(files_to_compress)} files using {max_workers} workers (Brotli quality {BROTLI_QUALITY})...")
+    Args:
+        folder_paths: Paths to the folders to pack (their names must differ)
+        output_file: Output file path
+        deduplicate: If True, detect and deduplicate identical folders and files
+                     (across all folders)
+        max_workers: Maximum number of parallel compression workers (default: CPU count)
+        format_version: Archive format to write (ARCHIVE_VERSION_2 adds the
+                        trailing index, ARCHIVE_VERSION_1 is the legacy stream)
+        block_size: If > 0, files larger than this are compressed in blocks of
+                    this many decoded bytes so ranges can be decoded on their
+                    own (format v2 only); the blocks of giant files are
+                    compressed in parallel (see SEGMENTED COMPRESSION)
+        base: Previous archive; files it already holds (same content) are
+              copied from it instead of being compressed again
+        store_min_gain: Files brotli shrinks by less than this fraction are
+                        stored uncompressed (0 disables; format v2 only)
+        profile: Compression profile file (JSON); brotli settings are planned
+                 per file extension, recorded there and reused by later packs
+        codecs: (pattern, codec) rules choosing each file's codec by its
+                archive path (see CODEC RULES; default: brotli; format v2
+                only for zstd and raw)
+        timings: JSON file to write the time spent per phase to (see
+                 PackTimings); files are compressed largest first either way
+    """
+    roots = pack_roots(folder_paths)
     
-    # Parallel compression using ProcessPoolExecutor with asyncio
-    compressed_files: Dict[Tuple[str, str], bytes] = {}  # (rel_path, filename) -> compressed_data
-    precompressed_files: Set[Tuple[str, str]] = set()  # Track which files were already .br
-    loop = asyncio.get_event_loop()
+    if max_workers is None:
+        max_workers = os.cpu_count() or 4
     
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        # Submit all tasks
-        future_to_args = {
-            loop.run_in_executor(executor, compress_file_task, args): args
-            for args in files_to_compress
-        }
-        
-        completed = 0
-        for coro in asyncio.as_completed(future_to_args.keys()):
-            result = await coro
-            rel_path, filename, file_path, data, original_size, final_size, is_precompressed = result
-            compressed_files[(rel_path, filename)] = data
-            if is_precompressed:
-                precompressed_files.add((rel_path, filename))
-                print(f"  [{completed + 1}/{len(files_to_compress)}] Stored as-is (.br): {rel_path}/{filename} ({original_size} bytes)")
-            else:
-                total_original_size += original_size
-                total_compressed_size += final_size
-                ratio = (final_size / original_size * 100) if original_size > 0 else 0
-                print(f"  [{completed + 1}/{len(files_to_compress)}] Compressed: {rel_path}/{filename} ({original_size} -> {final_size} bytes, {ratio:.1f}%)")
-            completed += 1
-    
-    print(f"\nWriting packed file...")
-    
-    # Write the packed file
-    async with aiofiles.open(output_file, 'wb') as out:
-        for rel_path, files, is_duplicate, source_path in folder_structure:
-            folder_name_bytes = rel_path.encode('utf-8')
+    if block_size > 0 and format_version == ARCHIVE_VERSION_1:
+        raise ValueError("Block-compressed files need archive format v2")
+    check_codec_rules(codecs, format_version)
+    if format_version == ARCHIVE_VERSION_1:
+        store_min_gain = 0.0
+    
+    phases = PackTimings()
+    
+    # Find duplicates if deduplication is enabled
+    folder_duplicates: Dict[str, str] = {}
+    file_duplicates: Dict[Tuple[str, str], Tuple[str, str]] = {}
+    
+    if deduplicate:
+        print("Scanning for duplicates...")
+        with phases.phase('hash'):
+            folder_duplicates, file_duplicates = find_duplicates_across(roots, max_workers)
+        if folder_duplicates or file_duplicates:
+            print(f"Found {len(folder_duplicates)} duplicate folder(s), {len(file_duplicates)} duplicate file(s)")
+        else:
+            print("No duplicates found")
+        print()
+    
+    folder_bytes_saved = 0
+    file_bytes_saved = 0
+    total_original_size = 0
+    total_compressed_size = 0
+    
+    # First pass: collect all files that need compression
+    print("Collecting files for compression...")
+    files_to_compress: List[CompressTask] = []
+    folder_structure: List[Tuple[str, List[str], bool, str]] = []  # (rel_path, files, is_duplicate, source_path)
+    
+    with phases.phase('scan'):
+        for root, dirs, files, rel_path in walk_roots(roots):
+            # Filter out ignored files
+            files = [f for f in files if not should_ignore_file(f)]
+            if not files:
+                continue
             
-            if is_duplicate:
-                source_path_bytes = source_path.encode('utf-8')
-                
-                await out.write(bytes([FOLDER_TYPE_COPY]))
-                await out.write(encode_uleb128(len(folder_name_bytes)))
-                await out.write(folder_name_bytes)
-                await out.write(encode_uleb128(len(source_path_bytes)))
-                await out.write(source_path_bytes)
-                
-                print(f"  Copy folder: {rel_path} -> {source_path}")
-            else:
-                await out.write(bytes([FOLDER_TYPE_NORMAL]))
-                await out.write(encode_uleb128(len(folder_name_bytes)))
-                await out.write(folder_name_bytes)
-                await out.write(encode_uleb128(len(files)))
-                
+            if rel_path in folder_duplicates:
+                source_path = folder_duplicates[rel_path]
+                folder_structure.append((rel_path, list(files), True, source_path))
                 for filename in files:
-                    filename_bytes = filename.encode('utf-8')
-                    
-                    await out.write(encode_uleb128(len(filename_bytes)))
-                    await out.write(filename_bytes)
-                    
+                    file_path = os.path.join(root, filename)
+                    folder_bytes_saved += os.path.getsize(file_path)
+            else:
+                folder_structure.append((rel_path, sorted(files), False, None))
+                for filename in sorted(files):
                     file_key = (rel_path, filename)
-                    if file_key in file_duplicates:
-                        source_folder, source_filename = file_duplicates[file_key]
-                        source_folder_bytes = source_folder.encode('utf-8')
-                        source_filename_bytes = source_filename.encode('utf-8')
-                        
-                        await out.write(bytes([FILE_TYPE_REFERENCE]))
-                        await out.write(encode_uleb128(len(source_folder_bytes)))
-                        await out.write(source_folder_bytes)
-                        await out.write(encode_uleb128(len(source_filename_bytes)))
-                        await out.write(source_filename_bytes)
-                        
-                        print(f"    Ref: {rel_path}/{filename} -> {source_folder}/{source_filename}")
+                    if file_key not in file_duplicates:
+                        file_path = os.path.join(root, filename)
+                        files_to_compress.append(CompressTask(file_path, rel_path, filename, block_size, store_min_gain, None,
+                                                          choose_codec(codecs, rel_path, filename)))
                     else:
-                        # Write compressed file content
-                        compressed_content = compressed_files[(rel_path, filename)]
-                        
-                        await out.write(bytes([FILE_TYPE_CONTENT]))
-                        await out.write(encode_uleb128(len(compressed_content)))
-                        await out.write(compressed_content)
+                        file_path = os.path.join(root, filename)
+                        file_bytes_saved += os.path.getsize(file_path)
+    
+    # Brotli settings per extension from the compression profile
+    if profile is not None:
+        with phases.phase('profile'):
+            profiles = plan_profiles([task for task in files_to_compress if task.codec == CODEC_BROTLI], profile, max_workers)
+        files_to_compress = [task._replace(settings=profiles.get(file_extension(task.filename))) for task in files_to_compress]
+    
+    with (BaseArchiveBlobs(base) if base is not None else nullcontext()) as base_blobs:
+        # Files unchanged since the base archive keep their compressed data
+        reused: Dict[Tuple[str, str], Tuple['FileEntry', bytes]] = {}
+        if base_blobs is not None:
+            with phases.phase('hash'):
+                tasks = files_to_compress
+                files_to_compress, reused = reuse_base_blobs(base_blobs, files_to_compress, max_workers)
+            # Reused files count towards the compression totals like compressed ones
+            for task in tasks:
+                if (task.rel_path, task.filename) in reused and not is_already_brotli(task.filename):
+                    total_original_size += os.path.getsize(task.file_path)
+                    total_compressed_size += reused[(task.rel_path, task.filename)][0].compressed_size
+
+        settings_note = f"profiles from {profile}" if profile is not None else f"Brotli quality {BROTLI_QUALITY}"
+        print(f"Compressing {len(files_to_compress)} files using {max_workers} workers ({settings_note})...")
+        
+        # Files are compressed largest first and written in archive order as they finish
+        writer = ArchiveWriter(format_version)
+        progress = PackProgress()
+        # Written next to output_file and renamed over it once complete, so a
+        # failed pack leaves the previous archive (possibly the base) intact
+        temp_path = f"{output_file}.{os.getpid()}.tmp"
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor, open(temp_path, 'wb') as out, phases.phase('write'):
+                compressed = iter_compressed(executor, files_to_compress, max_workers * PACK_WINDOW_PER_WORKER, progress)
+                completed = 0
+                
+                try:
+                    out.write(writer.header())
+                    for rel_path, files, is_duplicate, source_path in folder_structure:
+                        if is_duplicate:
+                            # Write copy folder entry
+                            out.write(writer.copy_folder(rel_path, source_path))
+                            
+                            print(f"  Copy folder: {rel_path} -> {source_path}")
+                        else:
+                            # Write normal folder entry
+                            out.write(writer.begin_folder(rel_path, len(files)))
+                            
+                            for filename in files:
+                                # Check if this file is a duplicate
+                                file_key = (rel_path, filename)
+                                if file_key in file_duplicates:
+                                    source_folder, source_filename = file_duplicates[file_key]
+                                    
+                                    # Write file reference
+                                    out.write(writer.file_reference(filename, source_folder, source_filename))
+                                    
+                                    print(f"    Ref: {rel_path}/{filename} -> {source_folder}/{source_filename}")
+                                    continue
+                                
+                                if file_key in reused:
+                                    entry, digest = reused[file_key]
+                                    data = base_blobs.read(entry)
+                                else:
+                                    with phases.phase('compress'):
+                                        result = next(compressed)
+                                    data, digest = result.data, result.digest
+                                    completed += 1
+                                    report_compressed(result, completed, len(files_to_compress), progress)
+                                    if not result.is_precompressed:
+                                        total_original_size += result.original_size
+                                        total_compressed_size += result.final_size
+                                
+                                # Write compressed file content
+                                for chunk in writer.file_data(filename, data, digest):
+                                    out.write(chunk)
+                    
+                    # Index and trailer (v2)
+                    out.write(writer.finish())
+                finally:
+                    compressed.close()
+            os.replace(temp_path, output_file)
+        except BaseException:
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            raise
     
     total_size = os.path.getsize(output_file)
     print(f"\nPacked to {output_file} ({total_size} bytes)")
@@ -872,21 +2326,93 @@ async def pack_folder_async(folder_path: str, output_file: str, deduplicate: boo
         print(f"Compression: {total_original_size} -> {total_compressed_size} bytes ({overall_ratio:.1f}%)")
     if folder_bytes_saved > 0 or file_bytes_saved > 0:
         print(f"Deduplication saved: {folder_bytes_saved + file_bytes_saved} bytes (folders: {folder_bytes_saved}, files: {file_bytes_saved})")
+    print(f"Time: {phases.report()}")
+    if timings is not None:
+        phases.save(timings, len(files_to_compress), progress.done_bytes, max_workers)
+        print(f"Timings written to {timings}")
 
 
-async def unpack_file_async(input_file: str, output_dir: str) -> None:
-    """Unpack a packed file back to folder structure (async). Decompresses Brotli-compressed content."""
-    async with aiofiles.open(input_file, 'rb') as f:
-        data = await f.read()
+def pack_folder(folder_path: str, output_file: str, deduplicate: bool = True, max_workers: int = None,
+                format_version: int = ARCHIVE_VERSION, block_size: int = 0,
+                base: Optional[str] = None, store_min_gain: float = STORE_MIN_GAIN,
+                profile: Optional[str] = None, codecs: Optional[List[Tuple[str, str]]] = None,
+                timings: Optional[str] = None) -> None:
+    """
+    Pack all files from folder and subfolders into a single file (sync).
+    Uses parallel Brotli compression for maximum speed with quality 11.
+    See pack_folders() for the arguments.
+    """
+    pack_folders([folder_path], output_file, deduplicate=deduplicate, max_workers=max_workers,
+                 format_version=format_version, block_size=block_size, base=base,
+                 store_min_gain=store_min_gain, profile=profile, codecs=codecs, timings=timings)
+
+
+def copy_late_sources(folder_copies: List[Tuple[str, str]], file_copies: List[Tuple[str, str, str, str]],
+                      unpacked_folders: Dict[str, str], unpacked_files: Dict[Tuple[str, str], str],
+                      output_dir: str) -> None:
+    """
+    Unpack the copy folders and file references whose source comes later in
+    the archive than they do (the packer picks sources in scan order, not in
+    archive order), once everything else is unpacked.
     
-    unpacked_folders: Dict[str, str] = {}
-    unpacked_files: Dict[Tuple[str, str], str] = {}
+    Args:
+        folder_copies: (folder, source folder) of the copy folders not done yet
+        file_copies: (folder, filename, source folder, source filename) of the
+                     file references not done yet
+    """
+    for folder_name, source_name in folder_copies:
+        source_path = unpacked_folders.get(source_name)
+        if source_path is None:
+            print(f"Warning: Source folder not found: {source_name}")
+            continue
+        folder_path = os.path.join(output_dir, folder_name)
+        for filename in os.listdir(source_path):
+            src_file = os.path.join(source_path, filename)
+            if os.path.isfile(src_file):
+                shutil.copy2(src_file, os.path.join(folder_path, filename))
+                unpacked_files[(folder_name, filename)] = os.path.join(folder_path, filename)
+        print(f"Copied folder: {folder_name} <- {source_name}")
     
-    offset = 0
+    # A reference may point at another late one: repeat while references get resolved
+    while file_copies:
+        remaining = []
+        for folder_name, filename, src_folder, src_filename in file_copies:
+            src_file_path = unpacked_files.get((src_folder, src_filename))
+            if src_file_path is None:
+                remaining.append((folder_name, filename, src_folder, src_filename))
+                continue
+            file_path = os.path.join(output_dir, folder_name, filename)
+            shutil.copy2(src_file_path, file_path)
+            unpacked_files[(folder_name, filename)] = file_path
+            print(f"  Copied: {folder_name}/{filename} <- {src_folder}/{src_filename}")
+        if len(remaining) == len(file_copies):
+            for folder_name, filename, src_folder, src_filename in remaining:
+                print(f"  Warning: Source file not found: {src_folder}/{src_filename}")
+            break
+        file_copies = remaining
+
+
+def unpack_file(input_file: str, output_dir: str) -> None:
+    """Unpack a packed file back to folder structure (sync). Decompresses each file with its codec (Brotli or zstd)."""
+    with open(input_file, 'rb') as f:
+        data = f.read()
+    
+    # Track unpacked folders and files for copy references
+    unpacked_folders: Dict[str, str] = {}  # rel_path -> absolute path
+    unpacked_files: Dict[Tuple[str, str], str] = {}  # (folder, filename) -> absolute path
+    # Copies whose source comes later in the archive (see copy_late_sources())
+    folder_copies: List[Tuple[str, str]] = []
+    file_copies: List[Tuple[str, str, str, str]] = []
+    
+    offset = records_start(detect_archive_version(data[:ARCHIVE_HEADER_SIZE]))
     while offset < len(data):
+        # Read folder type
         folder_type = data[offset]
         offset += 1
+        if folder_type == FOLDER_TYPE_END:
+            break
         
+        # Read folder name
         folder_name_len, bytes_read = decode_uleb128(data, offset)
         offset += bytes_read
         folder_name = data[offset:offset + folder_name_len].decode('utf-8')
@@ -897,11 +2423,13 @@ async def unpack_file_async(input_file: str, output_dir: str) -> None:
         unpacked_folders[folder_name] = folder_path
         
         if folder_type == FOLDER_TYPE_COPY:
+            # Read source folder name
             source_name_len, bytes_read = decode_uleb128(data, offset)
             offset += bytes_read
             source_name = data[offset:offset + source_name_len].decode('utf-8')
             offset += source_name_len
             
+            # Copy files from source folder
             source_path = unpacked_folders.get(source_name)
             if source_path and os.path.exists(source_path):
                 for filename in os.listdir(source_path):
@@ -911,7 +2439,10 @@ async def unpack_file_async(input_file: str, output_dir: str) -> None:
                         shutil.copy2(src_file, dst_file)
                         unpacked_files[(folder_name, filename)] = dst_file
                 print(f"Copied folder: {folder_name} <- {source_name}")
+            else:
+                folder_copies.append((folder_name, source_name))
         else:
+            # Normal folder - read files
             num_files, bytes_read = decode_uleb128(data, offset)
             offset += bytes_read
             
@@ -925,10 +2456,12 @@ async def unpack_file_async(input_file: str, output_dir: str) -> None:
                 
                 file_path = os.path.join(folder_path, filename)
                 
+                # Read file type
                 file_type = data[offset]
                 offset += 1
                 
                 if file_type == FILE_TYPE_REFERENCE:
+                    # Read source reference
                     src_folder_len, bytes_read = decode_uleb128(data, offset)
                     offset += bytes_read
                     src_folder = data[offset:offset + src_folder_len].decode('utf-8')
@@ -939,11 +2472,23 @@ async def unpack_file_async(input_file: str, output_dir: str) -> None:
                     src_filename = data[offset:offset + src_filename_len].decode('utf-8')
                     offset += src_filename_len
                     
+                    # Copy from source file
                     src_file_path = unpacked_files.get((src_folder, src_filename))
                     if src_file_path and os.path.exists(src_file_path):
                         shutil.copy2(src_file_path, file_path)
                         unpacked_files[(folder_name, filename)] = file_path
                         print(f"  Copied: {filename} <- {src_folder}/{src_filename}")
+                    else:
+                        file_copies.append((folder_name, filename, src_folder, src_filename))
+                elif file_type == FILE_TYPE_BLOCKS:
+                    # Decompress block by block
+                    table, data_offset, data_size = parse_block_record(data, offset)
+                    offset = data_offset + data_size
+                    with open(file_path, 'wb') as f:
+                        for block in iter_decoded_blocks(data[data_offset:offset], table):
+                            f.write(block)
+                    unpacked_files[(folder_name, filename)] = file_path
+                    print(f"  Unpacked: {filename} ({data_size} -> {table.raw_size} bytes, {len(table)} blocks)")
                 else:
                     # Read content
                     content_len, bytes_read = decode_uleb128(data, offset)
@@ -951,29 +2496,372 @@ async def unpack_file_async(input_file: str, output_dir: str) -> None:
                     content = data[offset:offset + content_len]
                     offset += content_len
                     
-                    # .br files are stored as-is (not brotli-compressed), write directly
-                    if is_already_brotli(filename):
-                        async with aiofiles.open(file_path, 'wb') as f:
-                            await f.write(content)
+                    # .br files and stored files are not compressed, write directly
+                    codec = entry_codec(file_type, filename)
+                    if codec == CODEC_RAW:
+                        with open(file_path, 'wb') as f:
+                            f.write(content)
                         unpacked_files[(folder_name, filename)] = file_path
                         print(f"  Unpacked: {filename} ({content_len} bytes, stored as-is)")
                     else:
-                        # Decompress with Brotli
-                        decompressed = decompress_brotli(content)
-                        async with aiofiles.open(file_path, 'wb') as f:
-                            await f.write(decompressed)
+                        # Decompress with the entry's codec (Brotli or zstd)
+                        decompressed = decompress_codec(codec, content)
+                        with open(file_path, 'wb') as f:
+                            f.write(decompressed)
                         unpacked_files[(folder_name, filename)] = file_path
                         print(f"  Unpacked: {filename} ({content_len} -> {len(decompressed)} bytes)")
     
+    copy_late_sources(folder_copies, file_copies, unpacked_folders, unpacked_files, output_dir)
     print(f"\nUnpacked to {output_dir}")
 
 
-async def stream_unpack_async(
-    chunks: AsyncIterator[bytes]
-) -> AsyncGenerator[Tuple[str, int, int, str, int, AsyncGenerator[bytes, None], Tuple[str, str]], None]:
+def stream_unpack(chunks: Iterator[bytes]) -> Generator[Tuple[str, str, int, Generator[bytes, None, None], Tuple[str, str]], None, None]:
+    """
+    Stream unpack a packed file from an iterable of byte chunks (sync).
+    Decompresses each file with its codec (Brotli, or zstd decoded as it streams in).
+    
+    Yields tuples of: (folder_name, file_name, decompressed_size, file_chunks_generator, source_ref)
+    - For normal files: (folder_name, filename, size, chunks_gen, None)
+    - For file references: (folder_name, filename, -2, None, (src_folder, src_filename))
+    - For folder copies: (folder_name, source_folder, -1, None, None)
+    """
+    buffer = bytearray()
+    chunk_iter = iter(chunks)
+    
+    def read_bytes(n: int) -> bytes:
+        nonlocal buffer
+        while len(buffer) < n:
+            try:
+                chunk = next(chunk_iter)
+                buffer.extend(chunk)
+            except StopIteration:
+                if len(buffer) < n:
+                    raise EOFError(f"Expected {n} bytes, got {len(buffer)}")
+        result = bytes(buffer[:n])
+        del buffer[:n]
+        return result
+    
+    def read_uleb128() -> int:
+        result = 0
+        shift = 0
+        while True:
+            byte_data = read_bytes(1)
+            byte = byte_data[0]
+            result |= (byte & 0x7F) << shift
+            if (byte & 0x80) == 0:
+                break
+            shift += 7
+        return result
+    
+    def skip_header() -> None:
+        # v2 archives start with a header, v1 archives straight with a folder record
+        while len(buffer) < ARCHIVE_HEADER_SIZE:
+            try:
+                buffer.extend(next(chunk_iter))
+            except StopIteration:
+                break
+        if detect_archive_version(bytes(buffer[:ARCHIVE_HEADER_SIZE])) != ARCHIVE_VERSION_1:
+            del buffer[:ARCHIVE_HEADER_SIZE]
+    
+    def file_chunk_generator_decompressed(compressed_size: int) -> Generator[bytes, None, None]:
+        """Read compressed data, decompress, and yield as single chunk."""
+        compressed_data = read_bytes(compressed_size)
+        decompressed = decompress_brotli(compressed_data)
+        yield decompressed
+    
+    def file_chunk_generator_stored(size: int) -> Generator[bytes, None, None]:
+        """Read uncompressed data and yield it as a single chunk."""
+        yield read_bytes(size)
+    
+    def file_chunk_generator_zstd(compressed_size: int) -> Generator[bytes, None, None]:
+        """Read a zstd frame piece by piece, yielding what each piece decodes to."""
+        require_zstd()
+        decoder = zstandard.ZstdDecompressor().decompressobj()
+        remaining = compressed_size
+        while remaining > 0:
+            piece = read_bytes(min(ZSTD_STREAM_READ_SIZE, remaining))
+            remaining -= len(piece)
+            decoded = decoder.decompress(piece)
+            if decoded:
+                yield decoded
+    
+    def read_block_table() -> Tuple[BlockTable, int]:
+        """Read a block-compressed record up to its data. Returns (table, data_size)."""
+        raw_size = read_uleb128()
+        block_size = read_uleb128()
+        num_blocks = read_uleb128()
+        table = BlockTable(raw_size, block_size, [], [])
+        for _ in range(num_blocks):
+            table.offsets.append(read_uleb128())
+            table.sizes.append(read_uleb128())
+        data_size = read_uleb128()
+        lead_padding, = BLOCK_PAD_STRUCT.unpack(read_bytes(BLOCK_PAD_STRUCT.size))
+        read_bytes(lead_padding)
+        return table, data_size
+    
+    def file_chunk_generator_blocks(table: BlockTable) -> Generator[bytes, None, None]:
+        """Read and decompress one block at a time, yielding each as a chunk."""
+        position = 0
+        for block_offset, block_len in zip(table.offsets, table.sizes):
+            read_bytes(block_offset - position)  # alignment padding
+            yield decompress_brotli(read_bytes(block_len))
+            position = block_offset + block_len
+    
+    try:
+        skip_header()
+        while True:
+            try:
+                folder_type = read_bytes(1)[0]
+            except EOFError:
+                break
+            
+            if folder_type == FOLDER_TYPE_END:
+                # Only the index and trailer follow; consume them
+                for _ in chunk_iter:
+                    pass
+                break
+            
+            folder_name_len = read_uleb128()
+            folder_name = read_bytes(folder_name_len).decode('utf-8')
+            
+            if folder_type == FOLDER_TYPE_COPY:
+                source_name_len = read_uleb128()
+                source_name = read_bytes(source_name_len).decode('utf-8')
+                yield (folder_name, source_name, -1, None, None)
+            else:
+                num_files = read_uleb128()
+                
+                for _ in range(num_files):
+                    filename_len = read_uleb128()
+                    filename = read_bytes(filename_len).decode('utf-8')
+                    
+                    file_type = read_bytes(1)[0]
+                    
+                    if file_type == FILE_TYPE_REFERENCE:
+                        src_folder_len = read_uleb128()
+                        src_folder = read_bytes(src_folder_len).decode('utf-8')
+                        src_filename_len = read_uleb128()
+                        src_filename = read_bytes(src_filename_len).decode('utf-8')
+                        yield (folder_name, filename, -2, None, (src_folder, src_filename))
+                    elif file_type == FILE_TYPE_BLOCKS:
+                        table, data_size = read_block_table()
+                        yield (folder_name, filename, data_size, file_chunk_generator_blocks(table), None)
+                    elif file_type == FILE_TYPE_STORED:
+                        stored_len = read_uleb128()
+                        yield (folder_name, filename, stored_len, file_chunk_generator_stored(stored_len), None)
+                    elif file_type == FILE_TYPE_ZSTD:
+                        compressed_len = read_uleb128()
+                        yield (folder_name, filename, compressed_len, file_chunk_generator_zstd(compressed_len), None)
+                    else:
+                        compressed_len = read_uleb128()
+                        # We can't know decompressed size without decompressing,
+                        # so we pass compressed_len and decompress in the generator
+                        yield (folder_name, filename, compressed_len, file_chunk_generator_decompressed(compressed_len), None)
+    except EOFError:
+        pass
+
+
+def stream_unpack_to_disk(chunks: Iterator[bytes], output_dir: str) -> None:
+    """Stream unpack directly to disk (sync)."""
+    unpacked_folders: Dict[str, str] = {}
+    unpacked_files: Dict[Tuple[str, str], str] = {}
+    folder_copies: List[Tuple[str, str]] = []
+    file_copies: List[Tuple[str, str, str, str]] = []
+    
+    for folder_name, filename, file_size, file_chunks, source_ref in stream_unpack(chunks):
+        folder_path = os.path.join(output_dir, folder_name)
+        os.makedirs(folder_path, exist_ok=True)
+        unpacked_folders[folder_name] = folder_path
+        
+        if file_size == -1:
+            # Copy folder
+            source_name = filename
+            source_path = unpacked_folders.get(source_name)
+            if source_path and os.path.exists(source_path):
+                for fname in os.listdir(source_path):
+                    src_file = os.path.join(source_path, fname)
+                    dst_file = os.path.join(folder_path, fname)
+                    if os.path.isfile(src_file):
+                        shutil.copy2(src_file, dst_file)
+                        unpacked_files[(folder_name, fname)] = dst_file
+                print(f"Copied folder: {folder_name} <- {source_name}")
+            else:
+                folder_copies.append((folder_name, source_name))
+        elif file_size == -2:
+            # File reference
+            src_folder, src_filename = source_ref
+            src_file_path = unpacked_files.get((src_folder, src_filename))
+            file_path = os.path.join(folder_path, filename)
+            if src_file_path and os.path.exists(src_file_path):
+                shutil.copy2(src_file_path, file_path)
+                unpacked_files[(folder_name, filename)] = file_path
+                print(f"Copied: {folder_name}/{filename} <- {src_folder}/{src_filename}")
+            else:
+                file_copies.append((folder_name, filename, src_folder, src_filename))
+        else:
+            file_path = os.path.join(folder_path, filename)
+            with open(file_path, 'wb') as f:
+                for chunk in file_chunks:
+                    f.write(chunk)
+            unpacked_files[(folder_name, filename)] = file_path
+            print(f"Unpacked: {folder_name}/{filename} ({file_size} bytes)")
+    
+    copy_late_sources(folder_copies, file_copies, unpacked_folders, unpacked_files, output_dir)
+    print(f"\nStream unpacked to {output_dir}")
+
+
+# ============== ASYNC FUNCTIONS ==============
+
+async def pack_folders_async(folder_paths: List[str], output_file: str, deduplicate: bool = True, max_workers: int = None,
+                             format_version: int = ARCHIVE_VERSION, block_size: int = 0,
+                             base: Optional[str] = None, store_min_gain: float = STORE_MIN_GAIN,
+                             profile: Optional[str] = None, codecs: Optional[List[Tuple[str, str]]] = None,
+                             timings: Optional[str] = None) -> None:
+    """
+    Pack all files from several folders and their subfolders into a single
+    file (async). Runs pack_folders() on a worker thread, so the event loop
+    keeps running; see pack_folders() for the arguments.
+    """
+    await asyncio.get_running_loop().run_in_executor(None, functools.partial(
+        pack_folders, folder_paths, output_file, deduplicate=deduplicate, max_workers=max_workers,
+        format_version=format_version, block_size=block_size, base=base,
+        store_min_gain=store_min_gain, profile=profile, codecs=codecs, timings=timings))
+
+
+async def pack_folder_async(folder_path: str, output_file: str, deduplicate: bool = True, max_workers: int = None,
+                            format_version: int = ARCHIVE_VERSION, block_size: int = 0,
+                            base: Optional[str] = None, store_min_gain: float = STORE_MIN_GAIN,
+                            profile: Optional[str] = None, codecs: Optional[List[Tuple[str, str]]] = None,
+                            timings: Optional[str] = None) -> None:
+    """
+    Pack all files from folder and subfolders into a single file (async).
+    Uses parallel Brotli compression for maximum speed with quality 11.
+    See pack_folders() for the arguments.
+    """
+    await pack_folders_async([folder_path], output_file, deduplicate=deduplicate, max_workers=max_workers,
+                             format_version=format_version, block_size=block_size, base=base,
+                             store_min_gain=store_min_gain, profile=profile, codecs=codecs, timings=timings)
+
+
+async def unpack_file_async(input_file: str, output_dir: str) -> None:
+    """Unpack a packed file back to folder structure (async). Decompresses each file with its codec (Brotli or zstd)."""
+    async with aiofiles.open(input_file, 'rb') as f:
+        data = await f.read()
+    
+    unpacked_folders: Dict[str, str] = {}
+    unpacked_files: Dict[Tuple[str, str], str] = {}
+    folder_copies: List[Tuple[str, str]] = []
+    file_copies: List[Tuple[str, str, str, str]] = []
+    
+    offset = records_start(detect_archive_version(data[:ARCHIVE_HEADER_SIZE]))
+    while offset < len(data):
+        folder_type = data[offset]
+        offset += 1
+        if folder_type == FOLDER_TYPE_END:
+            break
+        
+        folder_name_len, bytes_read = decode_uleb128(data, offset)
+        offset += bytes_read
+        folder_name = data[offset:offset + folder_name_len].decode('utf-8')
+        offset += folder_name_len
+        
+        folder_path = os.path.join(output_dir, folder_name)
+        os.makedirs(folder_path, exist_ok=True)
+        unpacked_folders[folder_name] = folder_path
+        
+        if folder_type == FOLDER_TYPE_COPY:
+            source_name_len, bytes_read = decode_uleb128(data, offset)
+            offset += bytes_read
+            source_name = data[offset:offset + source_name_len].decode('utf-8')
+            offset += source_name_len
+            
+            source_path = unpacked_folders.get(source_name)
+            if source_path and os.path.exists(source_path):
+                for filename in os.listdir(source_path):
+                    src_file = os.path.join(source_path, filename)
+                    dst_file = os.path.join(folder_path, filename)
+                    if os.path.isfile(src_file):
+                        shutil.copy2(src_file, dst_file)
+                        unpacked_files[(folder_name, filename)] = dst_file
+                print(f"Copied folder: {folder_name} <- {source_name}")
+            else:
+                folder_copies.append((folder_name, source_name))
+        else:
+            num_files, bytes_read = decode_uleb128(data, offset)
+            offset += bytes_read
+            
+            print(f"Folder: {folder_name} ({num_files} files)")
+            
+            for _ in range(num_files):
+                filename_len, bytes_read = decode_uleb128(data, offset)
+                offset += bytes_read
+                filename = data[offset:offset + filename_len].decode('utf-8')
+                offset += filename_len
+                
+                file_path = os.path.join(folder_path, filename)
+                
+                file_type = data[offset]
+                offset += 1
+                
+                if file_type == FILE_TYPE_REFERENCE:
+                    src_folder_len, bytes_read = decode_uleb128(data, offset)
+                    offset += bytes_read
+                    src_folder = data[offset:offset + src_folder_len].decode('utf-8')
+                    offset += src_folder_len
+                    
+                    src_filename_len, bytes_read = decode_uleb128(data, offset)
+                    offset += bytes_read
+                    src_filename = data[offset:offset + src_filename_len].decode('utf-8')
+                    offset += src_filename_len
+                    
+                    src_file_path = unpacked_files.get((src_folder, src_filename))
+                    if src_file_path and os.path.exists(src_file_path):
+                        shutil.copy2(src_file_path, file_path)
+                        unpacked_files[(folder_name, filename)] = file_path
+                        print(f"  Copied: {filename} <- {src_folder}/{src_filename}")
+                    else:
+                        file_copies.append((folder_name, filename, src_folder, src_filename))
+                elif file_type == FILE_TYPE_BLOCKS:
+                    # Decompress block by block
+                    table, data_offset, data_size = parse_block_record(data, offset)
+                    offset = data_offset + data_size
+                    async with aiofiles.open(file_path, 'wb') as f:
+                        for block in iter_decoded_blocks(data[data_offset:offset], table):
+                            await f.write(block)
+                    unpacked_files[(folder_name, filename)] = file_path
+                    print(f"  Unpacked: {filename} ({data_size} -> {table.raw_size} bytes, {len(table)} blocks)")
+                else:
+                    # Read content
+                    content_len, bytes_read = decode_uleb128(data, offset)
+                    offset += bytes_read
+                    content = data[offset:offset + content_len]
+                    offset += content_len
+                    
+                    # .br files and stored files are not compressed, write directly
+                    codec = entry_codec(file_type, filename)
+                    if codec == CODEC_RAW:
+                        async with aiofiles.open(file_path, 'wb') as f:
+                            await f.write(content)
+                        unpacked_files[(folder_name, filename)] = file_path
+                        print(f"  Unpacked: {filename} ({content_len} bytes, stored as-is)")
+                    else:
+                        # Decompress with the entry's codec (Brotli or zstd)
+                        decompressed = decompress_codec(codec, content)
+                        async with aiofiles.open(file_path, 'wb') as f:
+                            await f.write(decompressed)
+                        unpacked_files[(folder_name, filename)] = file_path
+                        print(f"  Unpacked: {filename} ({content_len} -> {len(decompressed)} bytes)")
+    
+    copy_late_sources(folder_copies, file_copies, unpacked_folders, unpacked_files, output_dir)
+    print(f"\nUnpacked to {output_dir}")
+
+
+async def stream_unpack_async(
+    chunks: AsyncIterator[bytes]
+) -> AsyncGenerator[Tuple[str, int, int, str, int, AsyncGenerator[bytes, None], Tuple[str, str]], None]:
     """
     Stream unpack a packed file from an async iterable of byte chunks.
-    Decompresses Brotli-compressed content.
+    Decompresses each file with its codec (Brotli, or zstd decoded as it streams in).
     
     Yields tuples of:
     - For normal files: (folder_name, num_files, file_idx, filename, decompressed_size, chunks_gen, None)
@@ -1008,19 +2896,78 @@ async def stream_unpack_async(
             shift += 7
         return result
     
+    async def skip_header() -> None:
+        # v2 archives start with a header, v1 archives straight with a folder record
+        while len(buffer) < ARCHIVE_HEADER_SIZE:
+            try:
+                buffer.extend(await chunk_aiter.__anext__())
+            except StopAsyncIteration:
+                break
+        if detect_archive_version(bytes(buffer[:ARCHIVE_HEADER_SIZE])) != ARCHIVE_VERSION_1:
+            del buffer[:ARCHIVE_HEADER_SIZE]
+    
     async def file_chunk_generator_decompressed(compressed_size: int) -> AsyncGenerator[bytes, None]:
         """Read compressed data, decompress with Brotli, and yield as single chunk."""
         compressed_data = await read_bytes(compressed_size)
         decompressed = decompress_brotli(compressed_data)
         yield decompressed
     
+    async def file_chunk_generator_stored(size: int) -> AsyncGenerator[bytes, None]:
+        """Read uncompressed data and yield it as a single chunk."""
+        yield await read_bytes(size)
+    
+    async def file_chunk_generator_zstd(compressed_size: int) -> AsyncGenerator[bytes, None]:
+        """Read a zstd frame piece by piece, yielding what each piece decodes to."""
+        require_zstd()
+        decoder = zstandard.ZstdDecompressor().decompressobj()
+        remaining = compressed_size
+        while remaining > 0:
+            piece = await read_bytes(min(ZSTD_STREAM_READ_SIZE, remaining))
+            remaining -= len(piece)
+            decoded = decoder.decompress(piece)
+            if decoded:
+                yield decoded
+    
+    async def read_block_table() -> Tuple[BlockTable, int]:
+        """Read a block-compressed record up to its data. Returns (table, data_size)."""
+        raw_size = await read_uleb128()
+        block_size = await read_uleb128()
+        num_blocks = await read_uleb128()
+        table = BlockTable(raw_size, block_size, [], [])
+        for _ in range(num_blocks):
+            table.offsets.append(await read_uleb128())
+            table.sizes.append(await read_uleb128())
+        data_size = await read_uleb128()
+        lead_padding, = BLOCK_PAD_STRUCT.unpack(await read_bytes(BLOCK_PAD_STRUCT.size))
+        await read_bytes(lead_padding)
+        return table, data_size
+    
+    async def file_chunk_generator_blocks(table: BlockTable) -> AsyncGenerator[bytes, None]:
+        """Read and decompress one block at a time, yielding each as a chunk."""
+        position = 0
+        for block_offset, block_len in zip(table.offsets, table.sizes):
+            await read_bytes(block_offset - position)  # alignment padding
+            yield decompress_brotli(await read_bytes(block_len))
+            position = block_offset + block_len
+    
     try:
+        await skip_header()
         while True:
             try:
                 folder_type = (await read_bytes(1))[0]
             except EOFError:
                 break
             
+            if folder_type == FOLDER_TYPE_END:
+                # Only the index and trailer follow; consume them so the
+                # producer (e.g. a download queue) isn't left blocked
+                while True:
+                    try:
+                        await chunk_aiter.__anext__()
+                    except StopAsyncIteration:
+                        break
+                break
+            
             folder_name_len = await read_uleb128()
             folder_name_bytes = await read_bytes(folder_name_len)
             folder_name = folder_name_bytes.decode('utf-8')
@@ -1048,6 +2995,15 @@ async def stream_unpack_async(
                         src_filename_bytes = await read_bytes(src_filename_len)
                         src_filename = src_filename_bytes.decode('utf-8')
                         yield (folder_name, num_files, file_idx, filename, -2, None, (src_folder, src_filename))
+                    elif file_type == FILE_TYPE_BLOCKS:
+                        table, data_size = await read_block_table()
+                        yield (folder_name, num_files, file_idx, filename, data_size, file_chunk_generator_blocks(table), None)
+                    elif file_type == FILE_TYPE_STORED:
+                        stored_len = await read_uleb128()
+                        yield (folder_name, num_files, file_idx, filename, stored_len, file_chunk_generator_stored(stored_len), None)
+                    elif file_type == FILE_TYPE_ZSTD:
+                        compressed_len = await read_uleb128()
+                        yield (folder_name, num_files, file_idx, filename, compressed_len, file_chunk_generator_zstd(compressed_len), None)
                     else:
                         compressed_len = await read_uleb128()
                         # We compress and decompress in the generator
@@ -1060,6 +3016,8 @@ async def stream_unpack_to_disk_async(chunks: AsyncIterator[bytes], output_dir:
     """Stream unpack directly to disk (async)."""
     unpacked_folders: Dict[str, str] = {}
     unpacked_files: Dict[Tuple[str, str], str] = {}
+    folder_copies: List[Tuple[str, str]] = []
+    file_copies: List[Tuple[str, str, str, str]] = []
     
     async for folder_name, num_files, file_idx, filename, file_size, file_chunks, source_ref in stream_unpack_async(chunks):
         folder_path = os.path.join(output_dir, folder_name)
@@ -1078,6 +3036,8 @@ async def stream_unpack_to_disk_async(chunks: AsyncIterator[bytes], output_dir:
                         shutil.copy2(src_file, dst_file)
                         unpacked_files[(folder_name, fname)] = dst_file
                 print(f"Copied folder: {folder_name} <- {source_name}")
+            else:
+                folder_copies.append((folder_name, source_name))
         elif file_size == -2:
             # File reference
             src_folder, src_filename = source_ref
@@ -1087,6 +3047,8 @@ async def stream_unpack_to_disk_async(chunks: AsyncIterator[bytes], output_dir:
                 shutil.copy2(src_file_path, file_path)
                 unpacked_files[(folder_name, filename)] = file_path
                 print(f"Copied: {folder_name}/{filename} <- {src_folder}/{src_filename}")
+            else:
+                file_copies.append((folder_name, filename, src_folder, src_filename))
         else:
             file_path = os.path.join(folder_path, filename)
             async with aiofiles.open(file_path, 'wb') as f:
@@ -1095,6 +3057,7 @@ async def stream_unpack_to_disk_async(chunks: AsyncIterator[bytes], output_dir:
             unpacked_files[(folder_name, filename)] = file_path
             print(f"Unpacked: {folder_name}/{filename} ({file_idx+1}/{num_files}, {file_size} bytes)")
     
+    copy_late_sources(folder_copies, file_copies, unpacked_folders, unpacked_files, output_dir)
     print(f"\nStream unpacked to {output_dir}")
 
 
@@ -1105,21 +3068,28 @@ class FileEntry:
     """Information about a file in the archive."""
     folder: str
     filename: str
-    file_type: int  # FILE_TYPE_CONTENT or FILE_TYPE_REFERENCE
+    file_type: int  # FILE_TYPE_CONTENT, FILE_TYPE_REFERENCE, FILE_TYPE_BLOCKS, FILE_TYPE_STORED or FILE_TYPE_ZSTD
     data_offset: int  # Position of file content/reference data in archive
     compressed_size: int  # Size of compressed data (0 for references)
     # For references:
     ref_folder: Optional[str] = None
     ref_filename: Optional[str] = None
+    # For block-compressed files:
+    blocks: Optional[BlockTable] = None
+    # Content digest of the original file (v2 index), None if not recorded
+    digest: Optional[bytes] = None
 
 
 class PackedArchiveFile:
     """
     A file-like object for reading a single file from a PackedArchive.
     Supports read(), readline(), and async iteration.
+    
+    The data may be a memoryview into the archive mapping (zero-copy);
+    read() and readline() then return memoryview slices as well.
     """
     
-    def __init__(self, data: bytes, keep_brotli: bool = False):
+    def __init__(self, data: Union[bytes, memoryview], keep_brotli: bool = False):
         """
         Initialize with the file data.
         
@@ -1132,11 +3102,11 @@ class PackedArchiveFile:
         self._position = 0
     
     @property
-    def data(self) -> bytes:
+    def data(self) -> Union[bytes, memoryview]:
         """Get all file data."""
         return self._data
     
-    def read(self, size: int = -1) -> bytes:
+    def read(self, size: int = -1) -> Union[bytes, memoryview]:
         """Read up to size bytes. If size is -1, read all remaining data."""
         if size == -1:
             result = self._data[self._position:]
@@ -1146,13 +3116,24 @@ class PackedArchiveFile:
             self._position += len(result)
         return result
     
-    def readline(self, size: int = -1) -> bytes:
+    def _find_newline(self, start: int) -> int:
+        """Find the next newline at or after start, -1 if there is none."""
+        if not isinstance(self._data, memoryview):
+            return self._data.find(b'\n', start)
+        # memoryview has no find(); scan it in small copied windows
+        for window_start in range(start, len(self._data), 65536):
+            pos = bytes(self._data[window_start:window_start + 65536]).find(b'\n')
+            if pos != -1:
+                return window_start + pos
+        return -1
+    
+    def readline(self, size: int = -1) -> Union[bytes, memoryview]:
         """Read a line (up to newline or size bytes)."""
         if self._position >= len(self._data):
             return b''
         
         # Find newline
-        newline_pos = self._data.find(b'\n', self._position)
+        newline_pos = self._find_newline(self._position)
         if newline_pos == -1:
             # No newline, read to end
             end = len(self._data)
@@ -1166,7 +3147,7 @@ class PackedArchiveFile:
         self._position = end
         return result
     
-    def readlines(self) -> List[bytes]:
+    def readlines(self) -> List[Union[bytes, memoryview]]:
         """Read all remaining lines."""
         lines = []
         while True:
@@ -1199,272 +3180,1546 @@ class PackedArchiveFile:
         """Iterate over lines."""
         return self
     
-    def __next__(self) -> bytes:
+    def __next__(self) -> Union[bytes, memoryview]:
         line = self.readline()
         if not line:
             raise StopIteration
         return line
 
 
-class PackedArchive:
+class DecodedEntryCache:
+    """
+    Byte-budgeted LRU cache of decoded archive entries.
+    
+    Entries larger than max_entry_bytes are never admitted, so a single huge
+    file can't flush everything else out of the cache.
+    
+    Usage:
+        cache = DecodedEntryCache(256 * 1024 * 1024)
+        data = cache.get(key)
+        if data is None:
+            data = decode(...)
+            cache.put(key, data)
+    """
+    
+    def __init__(self, max_bytes: int, max_entry_bytes: Optional[int] = None):
+        """
+        Args:
+            max_bytes: Total budget for cached payloads
+            max_entry_bytes: Largest payload admitted (default: a quarter of max_bytes)
+        """
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes if max_entry_bytes is not None else max_bytes // 4
+        self._entries: 'OrderedDict[object, bytes]' = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.rejected = 0
+    
+    def get(self, key) -> Optional[bytes]:
+        """Return the cached payload for key (marking it recently used), or None."""
+        data = self._entries.get(key)
+        if data is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return data
+    
+    def put(self, key, data: bytes) -> bool:
+        """
+        Cache a payload, evicting least recently used ones to stay in budget.
+        
+        Returns:
+            False if the payload is too large to be admitted.
+        """
+        size = len(data)
+        if size > self.max_entry_bytes:
+            self.rejected += 1
+            return False
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._size -= len(old)
+        self._entries[key] = data
+        self._size += size
+        while self._size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= len(evicted)
+            self.evictions += 1
+        return True
+    
+    def __contains__(self, key) -> bool:
+        """Check if a payload is cached, without marking it used or counting a hit."""
+        return key in self._entries
+    
+    def clear(self) -> None:
+        """Drop all cached payloads (counters are kept)."""
+        self._entries.clear()
+        self._size = 0
+    
+    def stats(self) -> Dict[str, int]:
+        """Snapshot of the cache counters."""
+        return {
+            'entries': len(self._entries),
+            'bytes': self._size,
+            'max_bytes': self.max_bytes,
+            'max_entry_bytes': self.max_entry_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'rejected': self.rejected,
+        }
+
+
+def file_identity(fd: int) -> Tuple[int, int]:
+    """(st_dev, st_ino) of an open file: changes when the path is replaced, not when it's rewritten."""
+    st = os.fstat(fd)
+    return st.st_dev, st.st_ino
+
+
+class PreadFilePool:
+    """
+    Positional reads from a few long-lived read-only descriptors.
+    
+    Reads run on a dedicated, bounded thread pool, so concurrent archive
+    reads neither open/close the file per request nor compete with other
+    users of the default executor. os.pread() needs no locking; on platforms
+    without it (Windows) each descriptor is guarded by a lock around
+    lseek()+read().
+    
+    Usage:
+        pool = PreadFilePool('packed.bin', num_fds=4)
+        data = await pool.read(offset, size)
+        print(pool.stats())
+        pool.close()
+    """
+    
+    # Linux transfers at most this many bytes per read() call
+    MAX_READ_CHUNK = 0x7ffff000
+    
+    def __init__(self, path: str, num_fds: int = 4, max_workers: Optional[int] = None):
+        """
+        Args:
+            path: File to read from
+            num_fds: Number of descriptors to keep open
+            max_workers: Reader threads (default: 2 per descriptor)
+        """
+        if num_fds < 1:
+            raise ValueError("num_fds must be at least 1")
+        self._path = path
+        flags = os.O_RDONLY | getattr(os, 'O_BINARY', 0)
+        self._fds: List[int] = []
+        try:
+            for _ in range(num_fds):
+                self._fds.append(os.open(path, flags))
+        except OSError:
+            self.close()
+            raise
+        self._fd_locks = [threading.Lock() for _ in self._fds]
+        self._max_workers = max_workers or num_fds * 2
+        self._executor = ThreadPoolExecutor(max_workers=self._max_workers, thread_name_prefix='packed-pread')
+        self._next_fd = itertools.count()
+        
+        # Metrics (updated from the event loop and reader threads)
+        self._stats_lock = threading.Lock()
+        self._queued = 0  # Submitted, waiting for a reader thread
+        self._active = 0  # Being read right now
+        self._max_queue_depth = 0
+        self._reads = 0
+        self._bytes_read = 0
+    
+    def _read_at(self, offset: int, size: int) -> bytes:
+        """Blocking positional read of exactly size bytes (less only at end of file)."""
+        with self._stats_lock:
+            self._queued -= 1
+            self._active += 1
+        try:
+            fd_idx = next(self._next_fd) % len(self._fds)
+            fd = self._fds[fd_idx]
+            parts = []
+            remaining = size
+            while remaining > 0:
+                want = min(remaining, self.MAX_READ_CHUNK)
+                if hasattr(os, 'pread'):
+                    chunk = os.pread(fd, want, offset)
+                else:
+                    with self._fd_locks[fd_idx]:
+                        os.lseek(fd, offset, os.SEEK_SET)
+                        chunk = os.read(fd, want)
+                if not chunk:
+                    break
+                parts.append(chunk)
+                offset += len(chunk)
+                remaining -= len(chunk)
+            data = parts[0] if len(parts) == 1 else b''.join(parts)
+            with self._stats_lock:
+                self._reads += 1
+                self._bytes_read += len(data)
+            return data
+        finally:
+            with self._stats_lock:
+                self._active -= 1
+    
+    async def read(self, offset: int, size: int) -> bytes:
+        """Read size bytes at offset."""
+        if self._executor is None:
+            raise RuntimeError("PreadFilePool is closed")
+        with self._stats_lock:
+            self._queued += 1
+            self._max_queue_depth = max(self._max_queue_depth, self._queued)
+        future = self._executor.submit(self._read_at, offset, size)
+        future.add_done_callback(self._on_read_done)
+        return await asyncio.wrap_future(future)
+    
+    def _on_read_done(self, future) -> None:
+        # A read cancelled before a reader thread picked it up never ran _read_at
+        if future.cancelled():
+            with self._stats_lock:
+                self._queued -= 1
+    
+    def stats(self) -> Dict[str, int]:
+        """Snapshot of the reader metrics."""
+        with self._stats_lock:
+            return {
+                'fds': len(self._fds),
+                'workers': self._max_workers,
+                'queue_depth': self._queued,
+                'active': self._active,
+                'max_queue_depth': self._max_queue_depth,
+                'reads': self._reads,
+                'bytes_read': self._bytes_read,
+            }
+    
+    def close(self) -> None:
+        """Shut down the reader threads and close all descriptors."""
+        executor = getattr(self, '_executor', None)
+        if executor is not None:
+            executor.shutdown(wait=True)
+            self._executor = None
+        for fd in self._fds:
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+        self._fds = []
+
+
+class RemoteArchiveReader:
+    """
+    Positional reads from an archive on an HTTP server, fetched on demand.
+    
+    The archive is split into fixed-size chunks. A read first fetches the
+    chunks it covers that aren't local yet (runs of missing chunks with one
+    ranged GET each, on a pooled client), then reads them from a local sparse
+    cache file. Concurrent reads of the same chunk share one fetch. Which chunks
+    are present is recorded in a "<cache>.chunks" file, so a restart reuses
+    what was already downloaded as long as the remote file is unchanged
+    (same size and ETag / Last-Modified).
+    
+    Every ranged GET carries If-Range with the validator seen by open(): if
+    the remote file changes, the server answers 200 and the read fails
+    instead of mixing two versions.
+    
+    A reader may be shared by several archives (generations of a reload):
+    each one acquire()s it and release()s it, and the last release closes it.
+    
+    Usage:
+        reader = RemoteArchiveReader('https://example.com/packed.bin', 'cache/packed.bin.cache')
+        size = await reader.open()
+        data = await reader.read(offset, size)
+        print(reader.stats())
+        reader.close()
+    """
+    
+    CHUNK_SIZE = 256 * 1024
+    MAX_FETCH_CHUNKS = 32  # Longest run of chunks fetched with one request (8 MB)
+    MAP_KEY_SIZE = 16
+    
+    def __init__(self, url: str, cache_path: str, chunk_size: int = CHUNK_SIZE,
+                 max_connections: int = 8, timeout: float = 60.0):
+        """
+        Args:
+            url: URL of the archive; the server must answer Range requests
+            cache_path: Local sparse file holding the fetched chunks
+            chunk_size: Granularity of fetches and of the cache
+            max_connections: Connections kept by the HTTP client pool
+            timeout: Timeout of each request in seconds
+        """
+        self._url = url
+        self._cache_path = cache_path
+        self._map_path = cache_path + '.chunks'
+        self._chunk_size = chunk_size
+        self._max_connections = max_connections
+        self._timeout = timeout
+        self._size = 0
+        self._validator: Optional[Tuple[str, str]] = None  # ("ETag" or "Last-Modified", value)
+        self._present = bytearray()  # one byte per chunk, 1 once it's in the cache file
+        self._pending: Dict[int, asyncio.Future] = {}  # chunk -> fetch in progress
+        self._fetches: Set[asyncio.Task] = set()
+        self._cache_fd: Optional[int] = None
+        self._map_fd: Optional[int] = None
+        self._io_lock = threading.Lock()  # lseek()+read()/write() where there is no pread/pwrite
+        self._users = 0
+        self._discard = False  # delete the cache files on close()
+        # The client is bound to the loop it was created on; a reader used from
+        # another loop (e.g. a second asyncio.run() of a tool) gets its own
+        self._client = None
+        self._client_loop: Optional[asyncio.AbstractEventLoop] = None
+        self._requests = 0
+        self._bytes_fetched = 0
+    
+    @property
+    def size(self) -> int:
+        """Size of the remote archive (known after open())."""
+        return self._size
+    
+    def _get_client(self):
+        import httpx  # Only needed for remote archives
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self._timeout),
+                limits=httpx.Limits(max_connections=self._max_connections),
+                follow_redirects=True,
+            )
+            self._client_loop = loop
+        return self._client
+    
+    async def _get_range(self, start: int, end: int, validate: bool = True):
+        """Ranged GET of bytes [start, end); returns the 206 response."""
+        headers = {'Range': f'bytes={start}-{end - 1}'}
+        if validate and self._validator is not None:
+            headers['If-Range'] = self._validator[1]
+        response = await self._get_client().get(self._url, headers=headers)
+        self._requests += 1
+        if response.status_code != 206:
+            if response.status_code == 200:
+                raise IOError(f"Remote archive changed or doesn't support Range requests: {self._url}")
+            response.raise_for_status()
+            raise IOError(f"Unexpected HTTP {response.status_code} for {self._url}")
+        content_range = response.headers.get('content-range', '')
+        if not content_range.startswith(f'bytes {start}-'):
+            raise IOError(f"Unexpected Content-Range '{content_range}' for {self._url}")
+        self._bytes_fetched += len(response.content)
+        return response
+    
+    async def open(self) -> int:
+        """
+        Fetch the first chunk, learn the archive size and validator, and
+        prepare the cache file.
+        
+        Returns:
+            Size of the remote archive in bytes
+        """
+        response = await self._get_range(0, self._chunk_size, validate=False)
+        total = response.headers['content-range'].rpartition('/')[2]
+        if not total.isdigit():
+            raise IOError(f"Remote archive size unknown: {self._url}")
+        self._size = int(total)
+        self._validator = self._response_validator(response)
+        
+        num_chunks = (self._size + self._chunk_size - 1) // self._chunk_size
+        key = hashlib.blake2b(
+            f"{self._url}\n{self._size}\n{self._chunk_size}\n{self._validator}".encode(),
+            digest_size=self.MAP_KEY_SIZE
+        ).digest()
+        self._open_cache(key, num_chunks)
+        self._store(0, response.content[:self._chunk_size])
+        return self._size
+    
+    @staticmethod
+    def _response_validator(response) -> Optional[Tuple[str, str]]:
+        """Strong ETag of a response, else its Last-Modified date (None if it has neither)."""
+        if 'etag' in response.headers and not response.headers['etag'].startswith('W/'):
+            return ('ETag', response.headers['etag'])
+        if 'last-modified' in response.headers:
+            return ('Last-Modified', response.headers['last-modified'])
+        return None
+    
+    async def is_current(self) -> bool:
+        """
+        Check whether the remote file is still the one open() saw (same size
+        and validator), with a one-byte ranged GET.
+        
+        Always False without a validator, as a change couldn't be detected.
+        """
+        if self._validator is None:
+            return False
+        response = await self._get_range(0, 1, validate=False)
+        total = response.headers['content-range'].rpartition('/')[2]
+        return total == str(self._size) and self._response_validator(response) == self._validator
+    
+    def _open_cache(self, key: bytes, num_chunks: int) -> None:
+        """Open the cache and chunk map files, reusing them if they belong to this remote file."""
+        os.makedirs(os.path.dirname(self._cache_path) or '.', exist_ok=True)
+        present = None
+        # Without a validator a changed remote file can't be detected: start over
+        if self._validator is not None and os.path.isfile(self._map_path) and os.path.isfile(self._cache_path):
+            with open(self._map_path, 'rb') as f:
+                data = f.read()
+            if (data[:self.MAP_KEY_SIZE] == key and len(data) == self.MAP_KEY_SIZE + num_chunks
+                    and os.path.getsize(self._cache_path) == self._size):
+                present = bytearray(data[self.MAP_KEY_SIZE:])
+        
+        flags = os.O_RDWR | os.O_CREAT | getattr(os, 'O_BINARY', 0)
+        if present is None:
+            present = bytearray(num_chunks)
+            with open(self._map_path, 'wb') as f:
+                f.write(key + present)
+            # Sparse where the filesystem supports it: only fetched chunks use space
+            with open(self._cache_path, 'wb') as f:
+                f.truncate(self._size)
+        self._present = present
+        self._cache_fd = os.open(self._cache_path, flags)
+        self._map_fd = os.open(self._map_path, flags)
+    
+    def _pwrite(self, fd: int, data: bytes, offset: int) -> None:
+        if hasattr(os, 'pwrite'):
+            os.pwrite(fd, data, offset)
+            return
+        with self._io_lock:
+            os.lseek(fd, offset, os.SEEK_SET)
+            os.write(fd, data)
+    
+    def _pread(self, offset: int, size: int) -> bytes:
+        if hasattr(os, 'pread'):
+            return os.pread(self._cache_fd, size, offset)
+        with self._io_lock:
+            os.lseek(self._cache_fd, offset, os.SEEK_SET)
+            return os.read(self._cache_fd, size)
+    
+    def _store(self, first_chunk: int, data: bytes) -> None:
+        """Write fetched chunks to the cache file, then mark them present."""
+        self._pwrite(self._cache_fd, data, first_chunk * self._chunk_size)
+        count = (len(data) + self._chunk_size - 1) // self._chunk_size
+        self._pwrite(self._map_fd, b'\x01' * count, self.MAP_KEY_SIZE + first_chunk)
+        self._present[first_chunk:first_chunk + count] = b'\x01' * count
+    
+    async def _fetch(self, first_chunk: int, count: int) -> None:
+        """Fetch a run of chunks into the cache file."""
+        start = first_chunk * self._chunk_size
+        end = min((first_chunk + count) * self._chunk_size, self._size)
+        response = await self._get_range(start, end)
+        if len(response.content) != end - start:
+            raise IOError(f"Short read from {self._url}: {len(response.content)} of {end - start} bytes")
+        await asyncio.get_running_loop().run_in_executor(None, self._store, first_chunk, response.content)
+    
+    def _start_fetch(self, first_chunk: int, count: int) -> asyncio.Future:
+        """
+        Start fetching a run of chunks.
+        
+        The chunks are marked pending right away, so concurrent readers of
+        them wait for this fetch instead of starting their own.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        for chunk in range(first_chunk, first_chunk + count):
+            self._pending[chunk] = future
+        
+        async def run():
+            try:
+                await self._fetch(first_chunk, count)
+                future.set_result(None)
+            except Exception as e:
+                future.set_exception(e)
+            finally:
+                for chunk in range(first_chunk, first_chunk + count):
+                    del self._pending[chunk]
+        
+        task = loop.create_task(run())
+        self._fetches.add(task)
+        task.add_done_callback(self._fetches.discard)
+        return future
+    
+    async def read(self, offset: int, size: int) -> bytes:
+        """Read size bytes at offset, fetching the chunks not cached yet."""
+        if self._cache_fd is None:
+            raise RuntimeError("RemoteArchiveReader is not open")
+        size = max(0, min(size, self._size - offset))
+        if size == 0:
+            return b''
+        first = offset // self._chunk_size
+        last = (offset + size - 1) // self._chunk_size
+        
+        waits = set()
+        run_start = None
+        for chunk in range(first, last + 2):
+            missing = chunk <= last and not self._present[chunk] and chunk not in self._pending
+            if run_start is not None and (not missing or chunk - run_start == self.MAX_FETCH_CHUNKS):
+                waits.add(self._start_fetch(run_start, chunk - run_start))
+                run_start = None
+            if missing and run_start is None:
+                run_start = chunk
+            elif chunk <= last and chunk in self._pending:
+                waits.add(self._pending[chunk])
+        if waits:
+            await asyncio.gather(*waits)
+        return await asyncio.get_running_loop().run_in_executor(None, self._pread, offset, size)
+    
+    def stats(self) -> Dict[str, object]:
+        """Snapshot of the cache and fetch metrics."""
+        return {
+            'url': self._url,
+            'cache': self._cache_path,
+            'size': self._size,
+            'chunks': len(self._present),
+            'chunks_cached': self._present.count(1),
+            'fetching': len(set(map(id, self._pending.values()))),
+            'requests': self._requests,
+            'bytes_fetched': self._bytes_fetched,
+        }
+    
+    def acquire(self) -> 'RemoteArchiveReader':
+        """Count one more archive using the reader (see release())."""
+        self._users += 1
+        return self
+    
+    def release(self) -> None:
+        """Drop one archive using the reader; the last one closes it."""
+        self._users -= 1
+        if self._users <= 0:
+            self.close()
+    
+    def discard_cache(self) -> None:
+        """Delete the cache files when the reader is closed (they belong to a replaced remote file)."""
+        self._discard = True
+    
+    def close(self) -> None:
+        """Close the cache files and the HTTP client."""
+        for fd in (self._cache_fd, self._map_fd):
+            if fd is not None:
+                try:
+                    os.close(fd)
+                except OSError:
+                    pass
+        self._cache_fd = self._map_fd = None
+        if self._discard:
+            for path in (self._cache_path, self._map_path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+        client, self._client = self._client, None
+        if client is not None:
+            try:
+                if asyncio.get_running_loop() is self._client_loop:
+                    asyncio.get_running_loop().create_task(client.aclose())
+            except RuntimeError:
+                pass  # No running loop: the connections go with the process
+
+
+def remote_cache_name(url: str, generation: int = 0) -> str:
+    """
+    Default cache file of a remote archive: the URL's file name plus ".cache",
+    in the current directory.
+    
+    Reloads that find the remote file replaced cache the new one under a name
+    of its own ("<name>.<generation>.cache"), as the previous generation may
+    still be reading its cache.
+    """
+    url_name = os.path.basename(url.split('?', 1)[0].rstrip('/')) or 'packed.bin'
+    return f"{url_name}.{generation}.cache" if generation else url_name + '.cache'
+
+
+_archive_tags = itertools.count()
+
+# Prewarm (PackedArchive.prewarm): entries closer than this are read ahead as one region
+PREWARM_MERGE_GAP = 256 * 1024
+# Remote regions are fetched in pieces of this size, one at a time
+PREWARM_READ_SIZE = 8 * 1024 * 1024
+# Files every game start requests, prewarmed when no manifest is given
+PREWARM_DEFAULT_SUFFIXES = ('.wasm.br', '.data.br')
+PREWARM_DEFAULT_NAMES = ('sha256sums.txt',)
+
+
+def default_prewarm_paths(paths: Iterable[str]) -> List[str]:
+    """Select the files every game start requests: the game binaries and data, and the checksum lists."""
+    return [path for path in paths
+            if path.endswith(PREWARM_DEFAULT_SUFFIXES) or path.rpartition('/')[2] in PREWARM_DEFAULT_NAMES]
+
+
+class PackedArchive:
+    """
+    Async class to read files from a packed archive as if it were a folder.
+    
+    Usage:
+        archive = PackedArchive('packed.bin')
+        await archive.init()
+        
+        async with archive.open('vcsky/fetched/model.txd') as f:
+            data = f.read()  # Read all
+            # or
+            chunk = f.read(1024)  # Read 1024 bytes
+            # or
+            for line in f:
+                print(line)
+        
+        # With keep_brotli=True to get compressed data
+        async with archive.open('vcsky/fetched/model.txd', keep_brotli=True) as f:
+            compressed_data = f.read()
+        
+        # List files
+        files = archive.list_files()
+        folders = archive.list_folders()
+    
+    Both v1 archives (index built by scanning the records) and v2 archives
+    (index loaded from the trailing index block) are supported.
+    
+    Backends:
+        "mmap" (default): the archive is memory-mapped once in init(). The index
+            is parsed straight from the mapping and open() yields zero-copy
+            memoryview slices, so stored entries cost no allocation and no
+            syscall per read. The page cache is shared by every process that
+            maps the same file.
+        "pread": a PreadFilePool keeps a few descriptors open and open() does
+            positional reads on its dedicated thread pool; stats() reports
+            the reader queue depth.
+        "aiofiles": every open() re-opens the file, seeks and reads the entry.
+            Reads fail with IOError once the file is replaced (e.g. by a
+            reload), rather than reading the new file at the old offsets.
+        "http": archive_path is a URL. Only the index is fetched in init();
+            entries are fetched on demand with Range requests and kept in a
+            local sparse cache file (see RemoteArchiveReader). v2 archives only.
+    """
+    
+    BACKENDS = ("mmap", "pread", "aiofiles", "http")
+    
+    def __init__(self, archive_path: str, backend: str = "mmap", index_cache: bool = True,
+                 pread_fds: int = 4, decoded_cache_bytes: int = 0,
+                 decoded_cache: Optional[DecodedEntryCache] = None,
+                 remote_cache_path: Optional[str] = None,
+                 index: Optional[Tuple[List[Tuple[str, Optional[str]]], List['FileEntry']]] = None,
+                 remote: Optional[RemoteArchiveReader] = None):
+        """
+        Initialize the archive reader.
+        
+        Args:
+            archive_path: Path to the .bin archive file
+            backend: How entry data is read, "mmap" (default), "pread" or "aiofiles"
+            index_cache: For v1 archives, load the index from the "<archive>.idx"
+                         sidecar when it is up to date, and (re)write it after
+                         a scan otherwise
+            pread_fds: Number of descriptors kept open by the "pread" backend
+            decoded_cache_bytes: Budget of the LRU cache of decoded entries
+                                 (0 disables it)
+            decoded_cache: Cache shared with other archives, used instead of
+                           one of decoded_cache_bytes
+            remote_cache_path: Local cache file of the "http" backend (default:
+                               the URL's file name plus ".cache", in the
+                               current directory)
+            index: (folders, entries) already read from the archive file
+                   (e.g. while verifying a download), used by init() instead
+                   of reading the index again; local backends only
+            remote: Open reader of the same URL used by another archive (a
+                    reload of an unchanged remote file), shared instead of
+                    opening one on a new cache; "http" backend only
+        """
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown backend: {backend} (expected one of {', '.join(self.BACKENDS)})")
+        self._path = archive_path
+        self._backend = backend
+        self._index_cache = index_cache
+        self._index_source: Optional[str] = None  # "trailer", "sidecar", "scan" or "preloaded"
+        self._preloaded_index = index
+        self._file: Optional[BinaryIO] = None
+        self._mmap: Optional[mmap.mmap] = None
+        self._view: Optional[memoryview] = None
+        self._pread_fds = pread_fds
+        self._pool: Optional[PreadFilePool] = None
+        self._file_id: Optional[Tuple[int, int]] = None  # (st_dev, st_ino) read by "aiofiles"
+        self._remote: Optional[RemoteArchiveReader] = None
+        self._shared_remote = remote
+        self._remote_release: Optional[weakref.finalize] = None
+        if backend == "http":
+            self._remote_cache_path = remote_cache_path or remote_cache_name(archive_path)
+        if decoded_cache is not None:
+            self._decoded_cache: Optional[DecodedEntryCache] = decoded_cache
+            self._owns_decoded_cache = False
+        else:
+            self._decoded_cache = DecodedEntryCache(decoded_cache_bytes) if decoded_cache_bytes > 0 else None
+            self._owns_decoded_cache = True
+        # Prefix of this archive's decoded cache keys, which may share the cache
+        self._cache_tag = next(_archive_tags)
+        # Compact index: stored entries are numbered by id and their fields kept
+        # in columns; folders map filenames to ids, copy folders share the
+        # mapping of their source folder
+        self._offsets = array('Q')  # entry id -> data offset
+        self._sizes = array('Q')  # entry id -> stored size
+        self._digests = bytearray()  # DIGEST_SIZE bytes per entry id (empty if the index has none)
+        self._block_tables: Dict[int, BlockTable] = {}  # entry id -> table, block-compressed entries only
+        self._stored_entries: Set[int] = set()  # ids of entries stored uncompressed (FILE_TYPE_STORED)
+        self._zstd_entries: Set[int] = set()  # ids of entries compressed with zstd (FILE_TYPE_ZSTD)
+        self._folder_files: Dict[str, Dict[str, int]] = {}  # folder -> {filename: entry id}
+        self._folder_copies: Dict[str, str] = {}  # copy_folder -> source_folder
+        self._computed_digests: Dict[int, bytes] = {}  # entry id -> digest, for entries without one
+        self._initialized = False
+    
+    @property
+    def path(self) -> str:
+        """Path of the archive file."""
+        return self._path
+    
+    @property
+    def backend(self) -> str:
+        """Name of the backend used to read entry data."""
+        return self._backend
+    
+    @property
+    def remote_reader(self) -> Optional[RemoteArchiveReader]:
+        """Reader of the "http" backend (None before init() and for local backends)."""
+        return self._remote
+    
+    @property
+    def index_source(self) -> Optional[str]:
+        """Where the index came from: "trailer" (v2), "remote" (v2 over HTTP), "sidecar" or "scan" (v1), or "preloaded"."""
+        return self._index_source
+    
+    async def init(self) -> None:
+        """
+        Initialize the archive by reading the index.
+        Must be called before using open().
+        """
+        if self._initialized:
+            return
+        
+        if self._backend == "http":
+            await self._open_remote()
+            self._initialized = True
+        elif self._backend == "mmap":
+            self.load()
+        else:
+            # Index reads (or a v1 scan) run on a worker thread
+            await asyncio.get_running_loop().run_in_executor(None, self.load)
+    
+    def load(self) -> None:
+        """
+        Blocking version of init() for the local backends, e.g. to index
+        archives on a worker thread while the event loop keeps serving.
+        """
+        if self._initialized:
+            return
+        
+        if self._backend == "http":
+            raise ValueError("Remote archives are loaded with init()")
+        if self._backend == "mmap":
+            self._load_mapped()
+        else:
+            with open(self._path, 'rb') as f:
+                def read(offset: int, size: int) -> bytes:
+                    f.seek(offset)
+                    return f.read(size)
+                
+                head = f.read(SIDECAR_HEAD_SIZE)
+                if self._preloaded_index is not None:
+                    self._load_preloaded_index(head)
+                elif detect_archive_version(head[:ARCHIVE_HEADER_SIZE]) != ARCHIVE_VERSION_1:
+                    self._read_index_v2(read, os.fstat(f.fileno()).st_size)
+                elif not self._load_cached_index(head):
+                    # v1 has no index; scan the whole archive
+                    self._parse_index(head + f.read())
+                self._file_id = file_identity(f.fileno())
+            if self._backend == "pread":
+                self._open_pool()
+        
+        self._initialized = True
+    
+    def _load_mapped(self) -> None:
+        """Map the archive and load its index ("mmap" backend)."""
+        self._map_archive()
+        data = self._mmap if self._mmap is not None else b''
+        if self._preloaded_index is not None:
+            self._load_preloaded_index(data[:SIDECAR_HEAD_SIZE])
+        elif not self._load_cached_index(data[:SIDECAR_HEAD_SIZE]):
+            self._parse_index(data)
+    
+    def _open_pool(self) -> None:
+        """Open the reader descriptors of the "pread" backend."""
+        self._pool = PreadFilePool(self._path, num_fds=self._pread_fds)
+        # Archives replaced by a reload are dropped, not closed (requests
+        # may still be reading them): release the descriptors with them
+        weakref.finalize(self, self._pool.close)
+    
+    def _sidecar_key(self, head: bytes) -> bytes:
+        st = os.stat(self._path)
+        return sidecar_key(head, st.st_size, st.st_mtime_ns)
+    
+    def _load_cached_index(self, head: bytes) -> bool:
+        """Load a v1 archive's index from its sidecar. Returns False if it must be scanned."""
+        if not self._index_cache or detect_archive_version(head[:ARCHIVE_HEADER_SIZE]) != ARCHIVE_VERSION_1:
+            return False
+        cached = read_index_sidecar(sidecar_path(self._path), self._sidecar_key(head))
+        if cached is None:
+            return False
+        self._load_index(*cached)
+        self._index_source = "sidecar"
+        return True
+    
+    def _load_preloaded_index(self, head: bytes) -> None:
+        """Load the index given to __init__ (for v1, also writing the sidecar a scan would)."""
+        folders, entries = self._preloaded_index
+        self._preloaded_index = None
+        if self._index_cache and head and detect_archive_version(head[:ARCHIVE_HEADER_SIZE]) == ARCHIVE_VERSION_1:
+            write_index_sidecar(sidecar_path(self._path), self._sidecar_key(head), folders, entries)
+        self._load_index(folders, entries)
+        self._index_source = "preloaded"
+    
+    def _map_archive(self) -> None:
+        """Memory-map the archive file read-only."""
+        with open(self._path, 'rb') as f:
+            # Empty files can't be mapped; they simply have no entries
+            if os.fstat(f.fileno()).st_size == 0:
+                self._view = memoryview(b'')
+                return
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._mmap)
+    
+    def stats(self) -> Dict[str, object]:
+        """Archive metrics, plus reader ("pread" backend), remote ("http" backend) and decoded cache metrics."""
+        stats: Dict[str, object] = {
+            'path': self._path,
+            'backend': self._backend,
+            'index': self._index_source,
+            'files': self.file_count(),
+        }
+        if self._pool is not None:
+            stats['reader'] = self._pool.stats()
+        if self._remote is not None:
+            stats['remote'] = self._remote.stats()
+        if self._decoded_cache is not None:
+            stats['decoded_cache'] = self._decoded_cache.stats()
+        return stats
+    
+    def close(self) -> None:
+        """
+        Release the archive mapping and reader descriptors.
+        
+        Slices handed out by open() keep the mapping alive; if any are still
+        referenced, the mapping is released once they are garbage collected.
+        """
+        if self._pool is not None:
+            self._pool.close()
+            self._pool = None
+        if self._remote is not None:
+            self._remote_release()
+            self._remote = self._remote_release = None
+        if self._decoded_cache is not None and self._owns_decoded_cache:
+            self._decoded_cache.clear()
+        self._computed_digests.clear()
+        if self._view is not None:
+            self._view.release()
+            self._view = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass
+            self._mmap = None
+        self._initialized = False
+    
+    def _parse_index(self, data: Union[bytes, mmap.mmap]) -> None:
+        """
+        Build the file index from the whole archive (raw bytes or the mapping).
+        
+        v2 archives only need their trailer and index block; v1 archives are
+        scanned record by record.
+        """
+        version = detect_archive_version(data[:ARCHIVE_HEADER_SIZE])
+        if version == ARCHIVE_VERSION_1:
+            folders, entries, _ = scan_records(data)
+            self._index_source = "scan"
+            if self._index_cache and len(data) > 0:
+                write_index_sidecar(sidecar_path(self._path), self._sidecar_key(data[:SIDECAR_HEAD_SIZE]),
+                                    folders, entries)
+        else:
+            index_offset, index_size, _, flags = parse_trailer(data[len(data) - TRAILER_STRUCT.size:])
+            folders, entries = decode_index(data[index_offset:index_offset + index_size], flags)
+            self._index_source = "trailer"
+        self._load_index(folders, entries)
+    
+    async def _open_remote(self) -> None:
+        """Fetch the header and index of a remote archive (through the shared reader, if any)."""
+        if self._shared_remote is not None:
+            self._remote, self._shared_remote = self._shared_remote, None
+            size = self._remote.size
+        else:
+            self._remote = RemoteArchiveReader(self._path, self._remote_cache_path)
+            size = None
+        # Release the reader (and close it with its last archive) when an
+        # archive dropped by a reload is collected
+        self._remote_release = weakref.finalize(self, self._remote.acquire().release)
+        if size is None:
+            size = await self._remote.open()
+        if detect_archive_version(await self._remote.read(0, ARCHIVE_HEADER_SIZE)) == ARCHIVE_VERSION_1:
+            raise ValueError(f"Remote archives must be v2 (v1 has no index to fetch): {self._path}")
+        # The index as in _read_index_v2(), over the network
+        tail_start = max(0, size - INDEX_TAIL_READ_SIZE)
+        tail = await self._remote.read(tail_start, size - tail_start)
+        index_offset, index_size, flags, index_data = locate_index(tail, tail_start)
+        if index_data is None:
+            index_data = await self._remote.read(index_offset, index_size)
+        self._load_index(*decode_index(index_data, flags))
+        self._index_source = "remote"
+    
+    def _read_index_v2(self, read: Callable[[int, int], bytes], file_size: int) -> None:
+        """
+        Load a v2 index by reading the tail of the archive (usually a single read).
+        
+        Args:
+            read: Function reading (offset, size) from the archive
+            file_size: Size of the archive
+        """
+        tail_start = max(0, file_size - INDEX_TAIL_READ_SIZE)
+        tail = read(tail_start, file_size - tail_start)
+        index_offset, index_size, flags, index_data = locate_index(tail, tail_start)
+        if index_data is None:
+            # Index larger than the tail read; fetch it in one more read
+            index_data = read(index_offset, index_size)
+        self._load_index(*decode_index(index_data, flags))
+        self._index_source = "trailer"
+    
+    def _load_index(self, folders: List[Tuple[str, Optional[str]]], entries: List[FileEntry]) -> None:
+        """Build the compact lookup tables from decoded folders and entries."""
+        # Folders keep their record order; copy folders are filled in below
+        for folder_name, source_name in folders:
+            folder_name = sys.intern(folder_name)
+            if source_name is None:
+                self._folder_files[folder_name] = {}
+            else:
+                self._folder_copies[folder_name] = sys.intern(source_name)
+                self._folder_files[folder_name] = None
+        
+        store_digests = bool(entries) and index_flags(entries) & INDEX_FLAG_DIGESTS
+        references: Dict[Tuple[str, str], Tuple[str, str]] = {}
+        for entry in entries:
+            files = self._folder_files[entry.folder]
+            if entry.file_type == FILE_TYPE_REFERENCE:
+                files[entry.filename] = MISSING_ENTRY
+                references[(entry.folder, entry.filename)] = (entry.ref_folder, entry.ref_filename)
+                continue
+            entry_id = len(self._offsets)
+            self._offsets.append(entry.data_offset)
+            self._sizes.append(entry.compressed_size)
+            if store_digests:
+                self._digests += entry.digest
+            if entry.blocks is not None:
+                self._block_tables[entry_id] = entry.blocks
+            elif entry.file_type == FILE_TYPE_STORED:
+                self._stored_entries.add(entry_id)
+            elif entry.file_type == FILE_TYPE_ZSTD:
+                self._zstd_entries.add(entry_id)
+            files[entry.filename] = entry_id
+        if self._zstd_entries:
+            # Fail at load rather than on every read of a zstd entry
+            require_zstd()
+        
+        # Copy folders alias their (ultimate) source folder's filename map
+        for folder_name in self._folder_copies:
+            source_name = folder_name
+            seen = set()
+            while source_name in self._folder_copies and source_name not in seen:
+                seen.add(source_name)
+                source_name = self._folder_copies[source_name]
+            files = self._folder_files.get(source_name)
+            if files is None:
+                del self._folder_files[folder_name]
+            else:
+                self._folder_files[folder_name] = files
+        
+        # References point straight at the id of the entry they resolve to
+        for (folder_name, filename), target in references.items():
+            seen = set()
+            while target in references and target not in seen:
+                seen.add(target)
+                target = references[target]
+            files = self._folder_files.get(target[0])
+            if files is not None:
+                self._folder_files[folder_name][filename] = files.get(target[1], MISSING_ENTRY)
+    
+    def list_folders(self) -> List[str]:
+        """List all folders in the archive."""
+        if not self._initialized:
+            raise RuntimeError("Archive not initialized. Call init() first.")
+        return list(self._folder_files.keys())
+    
+    def list_files(self, folder: Optional[str] = None) -> List[str]:
+        """
+        List files in the archive.
+        
+        Args:
+            folder: If provided, list files only in this folder.
+                   If None, list all files with full paths.
+        """
+        if not self._initialized:
+            raise RuntimeError("Archive not initialized. Call init() first.")
+        
+        if folder is not None:
+            return list(self._folder_files.get(folder, ()))
+        else:
+            return [f"{folder_name}/{filename}"
+                    for folder_name, files in self._folder_files.items()
+                    for filename in files]
+    
+    def file_count(self) -> int:
+        """Number of files in the archive, copies included."""
+        return sum(len(files) for files in self._folder_files.values())
+    
+    def exists(self, path: str) -> bool:
+        """Check if a file exists in the archive."""
+        if not self._initialized:
+            raise RuntimeError("Archive not initialized. Call init() first.")
+        folder, _, filename = path.rpartition('/')
+        files = self._folder_files.get(folder)
+        return files is not None and filename in files
+    
+    @asynccontextmanager
+    async def open(self, path: str, keep_brotli: bool = False):
+        """
+        Open a file from the archive.
+        
+        Args:
+            path: Path to the file, e.g., 'vcsky/fetched/model.txd'
+            keep_brotli: If False (default), decompress the data.
+                        If True, return the raw data (for brotli passthrough).
+        
+        Yields:
+            PackedArchiveFile object for reading the file data. On the mmap
+            backend, undecompressed data is a memoryview into the mapping.
+        
+        Raises:
+            FileNotFoundError: If the file doesn't exist in the archive.
+        
+        Note:
+            Files with .br extension are stored without compression in the archive,
+            so they are returned as-is regardless of keep_brotli setting.
+            Block-compressed files have no single brotli stream to pass
+            through, so they are always decompressed (check
+            is_block_compressed() before relying on keep_brotli).
+            Files stored uncompressed have no brotli stream either; their
+            content is returned as-is (check is_stored_uncompressed()).
+            zstd-compressed files are always decoded (check is_zstd_compressed()).
+        """
+        entry_id, original_filename = self._resolve(path)
+        
+        # .br files are stored as-is (not brotli-compressed in archive)
+        # So we return them directly without decompression
+        if entry_id in self._block_tables or entry_id in self._zstd_entries:
+            yield PackedArchiveFile(await self._read_decoded_entry(entry_id), keep_brotli=False)
+        elif entry_id in self._stored_entries or is_already_brotli(original_filename):
+            yield PackedArchiveFile(await self._read_stored(entry_id), keep_brotli=False)
+        elif keep_brotli:
+            # Return raw brotli-compressed data from archive
+            yield PackedArchiveFile(await self._read_stored(entry_id), keep_brotli=True)
+        else:
+            # Decompress brotli data (served from the decoded cache when hot)
+            yield PackedArchiveFile(await self._read_decoded_entry(entry_id), keep_brotli=False)
+    
+    def _resolve(self, path: str) -> Tuple[int, str]:
+        """
+        Look up a path; references were resolved when the index was loaded.
+        
+        Returns:
+            (id of the entry holding the data, filename of the requested path)
+        """
+        if not self._initialized:
+            raise RuntimeError("Archive not initialized. Call init() first.")
+        
+        folder, _, filename = path.rpartition('/')
+        files = self._folder_files.get(folder)
+        if files is None or filename not in files:
+            raise FileNotFoundError(f"File not found in archive: {path}")
+        
+        entry_id = files[filename]
+        if entry_id == MISSING_ENTRY:
+            raise FileNotFoundError(f"Reference target not found for: {path}")
+        return entry_id, filename
+    
+    async def _read_stored(self, entry_id: int) -> Union[bytes, memoryview]:
+        """Read an entry's data exactly as stored in the archive."""
+        return await self._read_at(self._offsets[entry_id], self._sizes[entry_id])
+    
+    async def _read_at(self, offset: int, size: int) -> Union[bytes, memoryview]:
+        """Read size bytes at an absolute archive offset with the configured backend."""
+        if self._view is not None:
+            return self._view[offset:offset + size]
+        if self._pool is not None:
+            return await self._pool.read(offset, size)
+        if self._remote is not None:
+            return await self._remote.read(offset, size)
+        async with aiofiles.open(self._path, 'rb') as f:
+            if file_identity(f.fileno()) != self._file_id:
+                raise IOError(f"Archive replaced since it was loaded: {self._path}")
+            await f.seek(offset)
+            return await f.read(size)
+    
+    async def _read_block(self, entry_id: int, index: int) -> bytes:
+        """Decode one block of a block-compressed entry, going through the decoded cache."""
+        key = (self._cache_tag, entry_id, index)
+        if self._decoded_cache is not None:
+            cached = self._decoded_cache.get(key)
+            if cached is not None:
+                return cached
+        table = self._block_tables[entry_id]
+        decoded = decompress_brotli(await self._read_at(self._offsets[entry_id] + table.offsets[index], table.sizes[index]))
+        if self._decoded_cache is not None:
+            self._decoded_cache.put(key, decoded)
+        return decoded
+    
+    def _decoder(self, entry_id: int) -> Callable[[bytes], bytes]:
+        """Decoding function of a (not block-compressed) entry's codec."""
+        return decompress_zstd if entry_id in self._zstd_entries else decompress_brotli
+    
+    async def _read_decoded_entry(self, entry_id: int) -> Union[bytes, memoryview]:
+        """Decode an entry's stored data with its codec, going through the decoded cache."""
+        table = self._block_tables.get(entry_id)
+        if table is not None:
+            # Cached per block rather than as a whole
+            return b''.join([await self._read_block(entry_id, i) for i in range(len(table))])
+        if entry_id in self._stored_entries:
+            # Nothing to decode (nor to cache)
+            return await self._read_stored(entry_id)
+        
+        # References and copy folders resolve to their source's entry id, so
+        # they share one cache slot with it
+        key = (self._cache_tag, entry_id)
+        if self._decoded_cache is not None:
+            cached = self._decoded_cache.get(key)
+            if cached is not None:
+                return cached
+        decoded = self._decoder(entry_id)(await self._read_stored(entry_id))
+        if self._decoded_cache is not None:
+            self._decoded_cache.put(key, decoded)
+        return decoded
+    
+    async def read_decoded(self, path: str) -> Union[bytes, memoryview]:
+        """
+        Read the fully decoded content of a file.
+        
+        Unlike open(), .br files are brotli-decoded as well, which is what a
+        client without brotli support needs. Results go through the decoded
+        entry cache when one is configured. Files stored uncompressed are
+        returned as stored (a memoryview on the mmap backend).
+        
+        Args:
+            path: Path to the file
+        
+        Returns:
+            Decoded file content.
+        """
+        entry_id, _ = self._resolve(path)
+        return await self._read_decoded_entry(entry_id)
+    
+    async def entry_digest(self, path: str) -> bytes:
+        """
+        Content digest of a file, e.g. for HTTP validators.
+        
+        Archives written with digests (v2) have it in the index, so no entry
+        data is read. Otherwise (v1 archives) it is computed once from the
+        stored data and remembered; references and copies share their
+        source's digest either way.
+        
+        Args:
+            path: Path to the file
+        
+        Returns:
+            DIGEST_SIZE bytes.
+        """
+        entry_id, _ = self._resolve(path)
+        if self._digests:
+            return bytes(self._digests[entry_id * DIGEST_SIZE:(entry_id + 1) * DIGEST_SIZE])
+        digest = self._computed_digests.get(entry_id)
+        if digest is None:
+            data = await self._read_stored(entry_id)
+            digest = await asyncio.get_running_loop().run_in_executor(None, content_digest, data)
+            self._computed_digests[entry_id] = digest
+        return digest
+    
+    def is_block_compressed(self, path: str) -> bool:
+        """Check if a file is stored block-compressed (no brotli passthrough, cheap ranges)."""
+        entry_id, _ = self._resolve(path)
+        return entry_id in self._block_tables
+    
+    def is_stored_uncompressed(self, path: str) -> bool:
+        """Check if a file is stored uncompressed (no brotli passthrough, no decoding, cheap ranges)."""
+        entry_id, _ = self._resolve(path)
+        return entry_id in self._stored_entries
+    
+    def is_zstd_compressed(self, path: str) -> bool:
+        """Check if a file is stored zstd-compressed (no brotli passthrough, fast decoding)."""
+        entry_id, _ = self._resolve(path)
+        return entry_id in self._zstd_entries
+    
+    def decoded_size(self, path: str) -> Optional[int]:
+        """Decoded size of a file if the index records it (block-compressed and uncompressed files), else None."""
+        entry_id, _ = self._resolve(path)
+        if entry_id in self._stored_entries:
+            return self._sizes[entry_id]
+        table = self._block_tables.get(entry_id)
+        return table.raw_size if table is not None else None
+    
+    async def iter_decoded(self, path: str, start: int = 0, end: Optional[int] = None) -> AsyncIterator[bytes]:
+        """
+        Yield the decoded content of a file, or of the byte range [start, end).
+        
+        Block-compressed files are decoded block by block, so only the blocks
+        covering the range are read and the first chunk is available as soon
+        as its block is decoded. Files stored uncompressed are read for just
+        the range. Other files are decoded as a whole.
+        
+        Args:
+            path: Path to the file
+            start: First decoded byte to yield
+            end: End of the range (exclusive), None for the end of the file
+        """
+        entry_id, _ = self._resolve(path)
+        if entry_id in self._stored_entries:
+            size = self._sizes[entry_id]
+            end = size if end is None else min(end, size)
+            if end > start:
+                yield await self._read_at(self._offsets[entry_id] + start, end - start)
+            return
+        table = self._block_tables.get(entry_id)
+        if table is None:
+            data = await self._read_decoded_entry(entry_id)
+            if start > 0 or (end is not None and end < len(data)):
+                data = data[start:end]
+            if data:
+                yield data
+            return
+        
+        end = table.raw_size if end is None else min(end, table.raw_size)
+        for index in table.blocks_for_range(start, end):
+            block = await self._read_block(entry_id, index)
+            block_start = index * table.block_size
+            lo = max(start - block_start, 0)
+            hi = min(end - block_start, len(block))
+            yield block if lo == 0 and hi == len(block) else block[lo:hi]
+    
+    async def read_file(self, path: str, keep_brotli: bool = False) -> Union[bytes, memoryview]:
+        """
+        Read and return the entire file content.
+        
+        Args:
+            path: Path to the file
+            keep_brotli: If False, decompress. If True, return compressed.
+        
+        Returns:
+            File content as bytes (a memoryview for stored data on the mmap backend).
+        """
+        async with self.open(path, keep_brotli=keep_brotli) as f:
+            return f.read()
+    
+    async def prewarm(self, paths: Iterable[str], decode: bool = False) -> Dict[str, int]:
+        """
+        Bring files into memory ahead of their first request.
+        
+        Their stored data is read ahead into the page cache with
+        posix_fadvise(POSIX_FADV_WILLNEED), or read through where that isn't
+        available; on the "http" backend it is fetched into the local cache
+        file instead. With decode, the files are also decoded into the
+        decoded entry cache (off the event loop), as far as its budget allows.
+        
+        Args:
+            paths: Files to prewarm; paths not in the archive are skipped
+            decode: Also fill the decoded entry cache (needs one)
+        
+        Returns:
+            Counts: "entries" prewarmed (paths sharing data count once),
+            "missing" paths, "regions" read ahead, "bytes" of stored data in
+            them, "decoded" entries (or blocks) added to the decoded cache
+        """
+        entry_ids: Dict[int, None] = {}
+        missing = 0
+        for path in paths:
+            try:
+                entry_id, _ = self._resolve(path)
+            except FileNotFoundError:
+                missing += 1
+                continue
+            entry_ids[entry_id] = None
+        
+        regions: List[List[int]] = []
+        for entry_id in sorted(entry_ids, key=self._offsets.__getitem__):
+            start = self._offsets[entry_id]
+            end = start + self._sizes[entry_id]
+            if regions and start - regions[-1][1] <= PREWARM_MERGE_GAP:
+                regions[-1][1] = max(regions[-1][1], end)
+            else:
+                regions.append([start, end])
+        
+        if self._remote is not None:
+            for start, end in regions:
+                for offset in range(start, end, PREWARM_READ_SIZE):
+                    await self._remote.read(offset, min(PREWARM_READ_SIZE, end - offset))
+        elif regions:
+            await asyncio.get_running_loop().run_in_executor(None, self._read_ahead, regions)
+        
+        decoded = 0
+        if decode and self._decoded_cache is not None:
+            for entry_id in entry_ids:
+                if entry_id not in self._stored_entries:
+                    decoded += await self._decode_into_cache(entry_id)
+        
+        return {
+            'entries': len(entry_ids),
+            'missing': missing,
+            'regions': len(regions),
+            'bytes': sum(end - start for start, end in regions),
+            'decoded': decoded,
+        }
+    
+    def _read_ahead(self, regions: List[List[int]]) -> None:
+        """Load regions of the archive file into the page cache (blocking)."""
+        with open(self._path, 'rb') as f:
+            if hasattr(os, 'posix_fadvise'):
+                for start, end in regions:
+                    os.posix_fadvise(f.fileno(), start, end - start, os.POSIX_FADV_WILLNEED)
+                return
+            for start, end in regions:
+                f.seek(start)
+                for offset in range(start, end, PREWARM_READ_SIZE):
+                    f.read(min(PREWARM_READ_SIZE, end - offset))
+    
+    async def _decode_into_cache(self, entry_id: int) -> int:
+        """Decode an entry (each block of a block-compressed one) into the decoded cache; returns payloads added."""
+        loop = asyncio.get_running_loop()
+        table = self._block_tables.get(entry_id)
+        if table is None:
+            parts = [((self._cache_tag, entry_id), self._offsets[entry_id], self._sizes[entry_id])]
+        else:
+            parts = [((self._cache_tag, entry_id, i), self._offsets[entry_id] + offset, size)
+                     for i, (offset, size) in enumerate(zip(table.offsets, table.sizes))]
+        decoder = self._decoder(entry_id)
+        added = 0
+        for key, offset, size in parts:
+            if key in self._decoded_cache:
+                continue
+            data = await self._read_at(offset, size)
+            decoded = await loop.run_in_executor(None, decoder, data)
+            if self._decoded_cache.put(key, decoded):
+                added += 1
+        return added
+
+
+# ============== ARCHIVE OVERLAY ==============
+
+class ArchiveOverlay:
     """
-    Async class to read files from a packed archive as if it were a folder.
+    Several packed archives served as one, e.g. a base archive and small patch
+    archives holding fixed or translated files.
+    
+    Layers are given bottom first: for every path, the last layer holding it
+    wins. The merged index is built once in init(), so a lookup is a single
+    search whatever the number of layers.
     
     Usage:
-        archive = PackedArchive('packed.bin')
-        await archive.init()
-        
-        async with archive.open('vcsky/fetched/model.txd') as f:
-            data = f.read()  # Read all
-            # or
-            chunk = f.read(1024)  # Read 1024 bytes
-            # or
-            for line in f:
-                print(line)
-        
-        # With keep_brotli=True to get compressed data
-        async with archive.open('vcsky/fetched/model.txd', keep_brotli=True) as f:
-            compressed_data = f.read()
+        overlay = ArchiveOverlay([PackedArchive('base.bin'), PackedArchive('patch.bin')])
+        await overlay.init()
         
-        # List files
-        files = archive.list_files()
-        folders = archive.list_folders()
+        found = overlay.find('vcsky/fetched/data/main.scm')
+        if found is not None:
+            layer, archive = found
+            data = await archive.read_decoded('vcsky/fetched/data/main.scm')
     """
     
-    def __init__(self, archive_path: str):
+    def __init__(self, layers: List[PackedArchive], decoded_cache: Optional[DecodedEntryCache] = None):
         """
-        Initialize the archive reader.
-        
         Args:
-            archive_path: Path to the .bin archive file
+            layers: Archives, bottom layer first
+            decoded_cache: Decoded entry cache shared by the layers, if any
+                           (reported once in stats() and cleared in close())
         """
-        self._path = archive_path
-        self._file: Optional[BinaryIO] = None
-        self._entries: Dict[str, FileEntry] = {}  # full_path -> FileEntry
-        self._folders: Dict[str, List[str]] = {}  # folder_path -> list of filenames
-        self._folder_copies: Dict[str, str] = {}  # copy_folder -> source_folder
+        if not layers:
+            raise ValueError("An overlay needs at least one archive")
+        self._layers = list(layers)
+        self._decoded_cache = decoded_cache
+        # folder -> layer holding the whole folder, or {filename: layer} when
+        # several layers provide files of the folder
+        self._index: Dict[str, Union[int, Dict[str, int]]] = {}
+        self._served = [0] * len(self._layers)
         self._initialized = False
     
+    @property
+    def layers(self) -> List[PackedArchive]:
+        """The archives, bottom layer first."""
+        return list(self._layers)
+    
     async def init(self) -> None:
-        """
-        Initialize the archive by reading the index.
-        Must be called before using open().
-        """
+        """Initialize every layer and build the merged index."""
         if self._initialized:
             return
-        
-        async with aiofiles.open(self._path, 'rb') as f:
-            data = await f.read()
-        
-        self._parse_index(data)
-        self._initialized = True
+        for archive in self._layers:
+            await archive.init()
+        self._merge_layers()
     
-    def _parse_index(self, data: bytes) -> None:
-        """Parse the archive to build the file index."""
-        offset = 0
-        
-        while offset < len(data):
-            # Read folder type
-            folder_type = data[offset]
-            offset += 1
-            
-            # Read folder name
-            folder_name_len, bytes_read = decode_uleb128(data, offset)
-            offset += bytes_read
-            folder_name = data[offset:offset + folder_name_len].decode('utf-8')
-            offset += folder_name_len
-            
-            if folder_type == FOLDER_TYPE_COPY:
-                # Read source folder name
-                source_name_len, bytes_read = decode_uleb128(data, offset)
-                offset += bytes_read
-                source_name = data[offset:offset + source_name_len].decode('utf-8')
-                offset += source_name_len
-                
-                self._folder_copies[folder_name] = source_name
-                # Copy entries from source folder
-                if source_name in self._folders:
-                    self._folders[folder_name] = list(self._folders[source_name])
-                    for filename in self._folders[source_name]:
-                        src_path = f"{source_name}/{filename}"
-                        dst_path = f"{folder_name}/{filename}"
-                        if src_path in self._entries:
-                            src_entry = self._entries[src_path]
-                            self._entries[dst_path] = FileEntry(
-                                folder=folder_name,
-                                filename=filename,
-                                file_type=src_entry.file_type,
-                                data_offset=src_entry.data_offset,
-                                compressed_size=src_entry.compressed_size,
-                                ref_folder=src_entry.ref_folder,
-                                ref_filename=src_entry.ref_filename
-                            )
-            else:
-                # Normal folder
-                num_files, bytes_read = decode_uleb128(data, offset)
-                offset += bytes_read
-                
-                self._folders[folder_name] = []
-                
-                for _ in range(num_files):
-                    filename_len, bytes_read = decode_uleb128(data, offset)
-                    offset += bytes_read
-                    filename = data[offset:offset + filename_len].decode('utf-8')
-                    offset += filename_len
-                    
-                    self._folders[folder_name].append(filename)
-                    
-                    file_type = data[offset]
-                    offset += 1
-                    
-                    full_path = f"{folder_name}/{filename}"
-                    
-                    if file_type == FILE_TYPE_REFERENCE:
-                        # Read source reference
-                        src_folder_len, bytes_read = decode_uleb128(data, offset)
-                        offset += bytes_read
-                        src_folder = data[offset:offset + src_folder_len].decode('utf-8')
-                        offset += src_folder_len
-                        
-                        src_filename_len, bytes_read = decode_uleb128(data, offset)
-                        offset += bytes_read
-                        src_filename = data[offset:offset + src_filename_len].decode('utf-8')
-                        offset += src_filename_len
-                        
-                        self._entries[full_path] = FileEntry(
-                            folder=folder_name,
-                            filename=filename,
-                            file_type=FILE_TYPE_REFERENCE,
-                            data_offset=0,
-                            compressed_size=0,
-                            ref_folder=src_folder,
-                            ref_filename=src_filename
-                        )
-                    else:
-                        # Read content length and record position
-                        compressed_len, bytes_read = decode_uleb128(data, offset)
-                        offset += bytes_read
-                        
-                        self._entries[full_path] = FileEntry(
-                            folder=folder_name,
-                            filename=filename,
-                            file_type=FILE_TYPE_CONTENT,
-                            data_offset=offset,
-                            compressed_size=compressed_len
-                        )
-                        
-                        # Skip content
-                        offset += compressed_len
+    def load(self) -> None:
+        """Blocking version of init() for local archives (see PackedArchive.load())."""
+        if self._initialized:
+            return
+        for archive in self._layers:
+            archive.load()
+        self._merge_layers()
     
-    def list_folders(self) -> List[str]:
-        """List all folders in the archive."""
-        if not self._initialized:
-            raise RuntimeError("Archive not initialized. Call init() first.")
-        return list(self._folders.keys())
+    def _merge_layers(self) -> None:
+        """Build the merged index of the initialized layers."""
+        for layer, archive in enumerate(self._layers):
+            for folder in archive.list_folders():
+                current = self._index.get(folder)
+                if current is None:
+                    self._index[folder] = layer
+                    continue
+                if isinstance(current, int):
+                    current = dict.fromkeys(self._layers[current].list_files(folder), current)
+                    self._index[folder] = current
+                current.update(dict.fromkeys(archive.list_files(folder), layer))
+        self._initialized = True
     
-    def list_files(self, folder: Optional[str] = None) -> List[str]:
+    def find(self, path: str) -> Optional[Tuple[int, PackedArchive]]:
         """
-        List files in the archive.
+        Find the layer serving a path.
         
-        Args:
-            folder: If provided, list files only in this folder.
-                   If None, list all files with full paths.
+        Returns:
+            (layer number, archive), or None if no layer holds the path
         """
         if not self._initialized:
-            raise RuntimeError("Archive not initialized. Call init() first.")
-        
-        if folder is not None:
-            return list(self._folders.get(folder, []))
+            raise RuntimeError("Overlay not initialized. Call init() first.")
+        folder, _, filename = path.rpartition('/')
+        layer = self._index.get(folder)
+        if layer is None:
+            return None
+        if isinstance(layer, int):
+            if not self._layers[layer].exists(path):
+                return None
         else:
-            return list(self._entries.keys())
+            layer = layer.get(filename)
+            if layer is None:
+                return None
+        return layer, self._layers[layer]
     
     def exists(self, path: str) -> bool:
-        """Check if a file exists in the archive."""
+        """Check if any layer holds a path."""
+        return self.find(path) is not None
+    
+    def record_served(self, layer: int) -> None:
+        """Count a response served from a layer (reported by stats())."""
+        self._served[layer] += 1
+    
+    def list_folders(self) -> List[str]:
+        """List all folders of all layers."""
         if not self._initialized:
-            raise RuntimeError("Archive not initialized. Call init() first.")
-        return path in self._entries
+            raise RuntimeError("Overlay not initialized. Call init() first.")
+        return list(self._index.keys())
     
-    @asynccontextmanager
-    async def open(self, path: str, keep_brotli: bool = False):
+    def list_files(self, folder: Optional[str] = None) -> List[str]:
         """
-        Open a file from the archive.
+        List the files visible through the overlay.
         
         Args:
-            path: Path to the file, e.g., 'vcsky/fetched/model.txd'
-            keep_brotli: If False (default), decompress the data.
-                        If True, return the raw data (for brotli passthrough).
-        
-        Yields:
-            PackedArchiveFile object for reading the file data.
-        
-        Raises:
-            FileNotFoundError: If the file doesn't exist in the archive.
-        
-        Note:
-            Files with .br extension are stored without compression in the archive,
-            so they are returned as-is regardless of keep_brotli setting.
+            folder: If specified, only list filenames in this folder.
+                    If None, list all full paths.
         """
         if not self._initialized:
-            raise RuntimeError("Archive not initialized. Call init() first.")
-        
-        if path not in self._entries:
-            raise FileNotFoundError(f"File not found in archive: {path}")
-        
-        entry = self._entries[path]
-        original_filename = entry.filename
-        
-        # Resolve references
-        while entry.file_type == FILE_TYPE_REFERENCE:
-            ref_path = f"{entry.ref_folder}/{entry.ref_filename}"
-            if ref_path not in self._entries:
-                raise FileNotFoundError(f"Reference target not found: {ref_path}")
-            entry = self._entries[ref_path]
-        
-        # Read the data
-        async with aiofiles.open(self._path, 'rb') as f:
-            await f.seek(entry.data_offset)
-            data = await f.read(entry.compressed_size)
-        
-        # .br files are stored as-is (not brotli-compressed in archive)
-        # So we return them directly without decompression
-        if is_already_brotli(original_filename):
-            yield PackedArchiveFile(data, keep_brotli=False)
-        elif keep_brotli:
-            # Return raw brotli-compressed data from archive
-            yield PackedArchiveFile(data, keep_brotli=True)
-        else:
-            # Decompress brotli data
-            decompressed_data = decompress_brotli(data)
-            yield PackedArchiveFile(decompressed_data, keep_brotli=False)
+            raise RuntimeError("Overlay not initialized. Call init() first.")
+        if folder is not None:
+            layer = self._index.get(folder)
+            if layer is None:
+                return []
+            if isinstance(layer, int):
+                return self._layers[layer].list_files(folder)
+            return list(layer)
+        return [f"{folder_name}/{filename}"
+                for folder_name in self._index
+                for filename in self.list_files(folder_name)]
     
-    async def read_file(self, path: str, keep_brotli: bool = False) -> bytes:
+    def file_count(self) -> int:
+        """Number of distinct paths visible through the overlay."""
+        return sum(len(self._layers[layer]._folder_files[folder]) if isinstance(layer, int) else len(layer)
+                   for folder, layer in self._index.items())
+    
+    def stats(self) -> Dict[str, object]:
+        """Overlay metrics: per-layer archive stats and responses served, shared cache."""
+        layers = []
+        for archive, served in zip(self._layers, self._served):
+            layer_stats = archive.stats()
+            if self._decoded_cache is not None:
+                layer_stats.pop('decoded_cache', None)
+            layer_stats['served'] = served
+            layers.append(layer_stats)
+        stats: Dict[str, object] = {
+            'files': self.file_count(),
+            'layers': layers,
+        }
+        if self._decoded_cache is not None:
+            stats['decoded_cache'] = self._decoded_cache.stats()
+        return stats
+    
+    async def prewarm(self, paths: Iterable[str], decode: bool = False) -> Dict[str, int]:
         """
-        Read and return the entire file content.
-        
-        Args:
-            path: Path to the file
-            keep_brotli: If False, decompress. If True, return compressed.
+        Prewarm files in the layers serving them (see PackedArchive.prewarm()).
         
         Returns:
-            File content as bytes.
+            The layers' counts added up
         """
-        async with self.open(path, keep_brotli=keep_brotli) as f:
-            return f.read()
+        by_layer: Dict[int, List[str]] = {}
+        missing = 0
+        for path in paths:
+            found = self.find(path)
+            if found is None:
+                missing += 1
+            else:
+                by_layer.setdefault(found[0], []).append(path)
+        totals = {'entries': 0, 'missing': missing, 'regions': 0, 'bytes': 0, 'decoded': 0}
+        for layer, layer_paths in sorted(by_layer.items()):
+            for key, value in (await self._layers[layer].prewarm(layer_paths, decode)).items():
+                totals[key] += value
+        return totals
+    
+    def close(self) -> None:
+        """Close every layer and drop the shared cache."""
+        for archive in self._layers:
+            archive.close()
+        if self._decoded_cache is not None:
+            self._decoded_cache.clear()
 
 
 # ============== ADD FOLDER FUNCTION ==============
+#
+# add_folder() writes the new folder records over the end marker, index and
+# trailer of a v2 archive (ArchiveWriter.for_append() keeps those bytes) and
+# writes the index back after them. If anything fails on the way, the bytes
+# written are cut off and the old tail is restored, so the archive never
+# stays without its trailer.
 
-def add_folder(archive_path: str, folder_path: str, max_workers: int = None) -> None:
+
+def restore_tail(out: BinaryIO, writer: ArchiveWriter) -> None:
+    """Undo a failed append: cut what it wrote and put back the bytes it replaced."""
+    out.seek(writer.append_start)
+    out.truncate()
+    out.write(writer.tail)
+    out.flush()
+
+
+def add_folder(archive_path: str, folder_path: str, max_workers: int = None, block_size: int = 0,
+               store_min_gain: float = STORE_MIN_GAIN, codecs: Optional[List[Tuple[str, str]]] = None,
+               timings: Optional[str] = None) -> None:
     """
     Add a folder to an existing archive by appending to the end.
     
     Note: This appends to the archive without deduplication against existing content.
     The new folder will be added as a top-level folder in the archive.
+    The archive keeps its format version; for v2 the index is rewritten.
     
     Args:
         archive_path: Path to existing .bin archive
         folder_path: Path to folder to add
         max_workers: Number of parallel compression workers
+        block_size: If > 0, block-compress files larger than this (ignored
+                    for v1 archives)
+        store_min_gain: Files brotli shrinks by less than this fraction are
+                        stored uncompressed (0 disables; ignored for v1 archives)
+        codecs: (pattern, codec) rules choosing each file's codec (see CODEC
+                RULES; ignored for v1 archives)
+        timings: JSON file to write the time spent per phase to (see PackTimings)
     """
     folder_path = folder_path.rstrip('/\\')
     parent_dir = os.path.dirname(folder_path) or '.'
@@ -1478,196 +4733,406 @@ def add_folder(archive_path: str, folder_path: str, max_workers: int = None) ->
     if not os.path.isdir(folder_path):
         raise NotADirectoryError(f"Not a directory: {folder_path}")
     
+    if archive_version(archive_path) == ARCHIVE_VERSION_1:
+        if block_size > 0:
+            print("Note: v1 archive, block compression disabled")
+        if codecs:
+            print("Note: v1 archive, every file is brotli-compressed")
+        block_size = 0
+        store_min_gain = 0.0
+        codecs = None
+    check_codec_rules(codecs, ARCHIVE_VERSION)
+    
+    phases = PackTimings()
+    
     # Collect files to compress
     print(f"Adding {folder_path} to {archive_path}")
     print("Collecting files for compression...")
     
-    files_to_compress: List[Tuple[str, str, str]] = []
+    files_to_compress: List[CompressTask] = []
     folder_structure: List[Tuple[str, List[str]]] = []
     
-    for root, dirs, files in os.walk(folder_path):
-        # Filter out ignored files
-        files = [f for f in files if not should_ignore_file(f)]
-        if not files:
-            continue
-        
-        rel_path = os.path.relpath(root, parent_dir)
-        folder_structure.append((rel_path, sorted(files)))
-        
-        for filename in sorted(files):
-            file_path = os.path.join(root, filename)
-            files_to_compress.append((file_path, rel_path, filename))
+    with phases.phase('scan'):
+        for root, dirs, files in os.walk(folder_path):
+            # Filter out ignored files
+            files = [f for f in files if not should_ignore_file(f)]
+            if not files:
+                continue
+            
+            rel_path = os.path.relpath(root, parent_dir)
+            folder_structure.append((rel_path, sorted(files)))
+            
+            for filename in sorted(files):
+                file_path = os.path.join(root, filename)
+                files_to_compress.append(CompressTask(file_path, rel_path, filename, block_size, store_min_gain, None,
+                                                  choose_codec(codecs, rel_path, filename)))
     
     print(f"Compressing {len(files_to_compress)} files using {max_workers} workers...")
     
-    # Parallel compression
-    compressed_files: Dict[Tuple[str, str], bytes] = {}
     total_original = 0
     total_compressed = 0
     
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        futures = {executor.submit(compress_file_task, args): args for args in files_to_compress}
+    # Files are compressed largest first and appended in archive order as they finish
+    # (v2: index and trailer are rewritten after the new folders)
+    writer = ArchiveWriter.for_append(archive_path)
+    progress = PackProgress()
+    with ProcessPoolExecutor(max_workers=max_workers) as executor, open(archive_path, 'r+b') as out, phases.phase('write'):
+        compressed = iter_compressed(executor, files_to_compress, max_workers * PACK_WINDOW_PER_WORKER, progress)
         completed = 0
         
-        for future in as_completed(futures):
-            rel_path, filename, file_path, data, original_size, final_size, is_precompressed = future.result()
-            compressed_files[(rel_path, filename)] = data
-            if is_precompressed:
-                print(f"  [{completed + 1}/{len(files_to_compress)}] Stored as-is (.br): {rel_path}/{filename} ({original_size} bytes)")
-            else:
-                total_original += original_size
-                total_compressed += final_size
-                ratio = (final_size / original_size * 100) if original_size > 0 else 0
-                print(f"  [{completed + 1}/{len(files_to_compress)}] Compressed: {rel_path}/{filename} ({original_size} -> {final_size} bytes, {ratio:.1f}%)")
-            completed += 1
-    
-    print(f"\nAppending to archive...")
-    
-    # Append to archive
-    with open(archive_path, 'ab') as out:
-        for rel_path, files in folder_structure:
-            folder_name_bytes = rel_path.encode('utf-8')
-            
-            out.write(bytes([FOLDER_TYPE_NORMAL]))
-            out.write(encode_uleb128(len(folder_name_bytes)))
-            out.write(folder_name_bytes)
-            out.write(encode_uleb128(len(files)))
-            
-            for filename in files:
-                filename_bytes = filename.encode('utf-8')
+        out.seek(writer.append_start)
+        try:
+            for rel_path, files in folder_structure:
+                out.write(writer.begin_folder(rel_path, len(files)))
                 
-                out.write(encode_uleb128(len(filename_bytes)))
-                out.write(filename_bytes)
-                
-                compressed_content = compressed_files[(rel_path, filename)]
-                
-                out.write(bytes([FILE_TYPE_CONTENT]))
-                out.write(encode_uleb128(len(compressed_content)))
-                out.write(compressed_content)
+                for filename in files:
+                    with phases.phase('compress'):
+                        result = next(compressed)
+                    data, digest = result.data, result.digest
+                    completed += 1
+                    report_compressed(result, completed, len(files_to_compress), progress)
+                    if not result.is_precompressed:
+                        total_original += result.original_size
+                        total_compressed += result.final_size
+                    
+                    for chunk in writer.file_data(filename, data, digest):
+                        out.write(chunk)
+            
+            out.write(writer.finish())
+            out.truncate()
+        except BaseException:
+            restore_tail(out, writer)
+            raise
+        finally:
+            compressed.close()
     
     new_size = os.path.getsize(archive_path)
     print(f"\nAdded to {archive_path} (total size: {new_size} bytes)")
     if total_original > 0:
         ratio = total_compressed / total_original * 100
         print(f"Compression: {total_original} -> {total_compressed} bytes ({ratio:.1f}%)")
+    print(f"Time: {phases.report()}")
+    if timings is not None:
+        phases.save(timings, len(files_to_compress), progress.done_bytes, max_workers)
+        print(f"Timings written to {timings}")
 
 
-async def add_folder_async(archive_path: str, folder_path: str, max_workers: int = None) -> None:
+async def add_folder_async(archive_path: str, folder_path: str, max_workers: int = None, block_size: int = 0,
+                           store_min_gain: float = STORE_MIN_GAIN, codecs: Optional[List[Tuple[str, str]]] = None,
+                           timings: Optional[str] = None) -> None:
     """
-    Add a folder to an existing archive (async version).
+    Add a folder to an existing archive (async version). Runs add_folder()
+    on a worker thread, so the event loop keeps running.
     """
-    folder_path = folder_path.rstrip('/\\')
-    parent_dir = os.path.dirname(folder_path) or '.'
+    await asyncio.get_running_loop().run_in_executor(None, functools.partial(
+        add_folder, archive_path, folder_path, max_workers=max_workers, block_size=block_size,
+        store_min_gain=store_min_gain, codecs=codecs, timings=timings))
+
+
+# ============== REPACK (ACCESS-TRACE LAYOUT) ==============
+#
+# pack_folder() stores files in os.walk order, so the files a game boot asks
+# for are scattered over the whole archive. repack_archive() rewrites an
+# archive with the entries in the order a recorded trace first requested
+# them (see --packed_trace in server.py), so they sit contiguously and
+# kernel read-ahead brings in the next ones with each read. Compressed data
+# is copied as-is; nothing is recompressed.
+
+REPACK_COPY_SIZE = 1024 * 1024  # Stored data is copied in chunks of this size
+
+
+def read_access_trace(trace_file: str) -> List[str]:
+    """
+    Read an access trace: one archive path per line, in request order.
     
-    if max_workers is None:
-        max_workers = os.cpu_count() or 4
+    Blank lines and lines starting with '#' are skipped, a leading '/' is
+    ignored, and only the first occurrence of a path counts.
+    """
+    paths: List[str] = []
+    seen: Set[str] = set()
+    with open(trace_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            path = line.strip().lstrip('/')
+            if not path or path.startswith('#') or path in seen:
+                continue
+            seen.add(path)
+            paths.append(path)
+    return paths
+
+
+def read_archive_index(data: Union[bytes, mmap.mmap]) -> Tuple[int, List[Tuple[str, Optional[str]]], List['FileEntry']]:
+    """
+    Load the index of a whole archive (raw bytes or a mapping).
     
-    if not os.path.isfile(archive_path):
-        raise FileNotFoundError(f"Archive not found: {archive_path}")
+    Returns:
+        (version, folders, entries) - folders and entries as for encode_index()
+    """
+    version = detect_archive_version(data[:ARCHIVE_HEADER_SIZE])
+    if version == ARCHIVE_VERSION_1:
+        folders, entries, _ = scan_records(data)
+        return version, folders, entries
+    index_offset, index_size, _, flags = parse_trailer(data[len(data) - TRAILER_STRUCT.size:])
+    folders, entries = decode_index(data[index_offset:index_offset + index_size], flags)
+    return version, folders, entries
+
+
+def trace_layout(folders: List[Tuple[str, Optional[str]]], entries: List['FileEntry'],
+                 trace: List[str]) -> Tuple[List[int], int, int]:
+    """
+    Order the stored entries of an archive by first access in a trace.
     
-    if not os.path.isdir(folder_path):
-        raise NotADirectoryError(f"Not a directory: {folder_path}")
+    A traced path in a copy folder or naming a reference counts as an access
+    to the stored entry it resolves to.
     
-    print(f"Adding {folder_path} to {archive_path}")
-    print("Collecting files for compression...")
+    Returns:
+        (order, traced, unmatched) - indices into entries of every content or
+        block entry, the traced ones first in first-access order and the rest
+        in their original order; how many of them were traced; how many trace
+        paths matched nothing in the archive
+    """
+    entry_ids = {(entry.folder, entry.filename): i for i, entry in enumerate(entries)}
+    copy_sources = {name: source for name, source in folders if source is not None}
     
-    files_to_compress: List[Tuple[str, str, str]] = []
-    folder_structure: List[Tuple[str, List[str]]] = []
+    def resolve(path: str) -> Optional[int]:
+        folder, _, filename = path.rpartition('/')
+        seen_folders = set()
+        while folder in copy_sources and folder not in seen_folders:
+            seen_folders.add(folder)
+            folder = copy_sources[folder]
+        entry_id = entry_ids.get((folder, filename))
+        seen_ids = set()
+        while entry_id is not None and entries[entry_id].file_type == FILE_TYPE_REFERENCE:
+            if entry_id in seen_ids:
+                return None
+            seen_ids.add(entry_id)
+            entry = entries[entry_id]
+            entry_id = entry_ids.get((entry.ref_folder, entry.ref_filename))
+        return entry_id
     
-    for root, dirs, files in os.walk(folder_path):
-        # Filter out ignored files
-        files = [f for f in files if not should_ignore_file(f)]
-        if not files:
-            continue
-        
-        rel_path = os.path.relpath(root, parent_dir)
-        folder_structure.append((rel_path, sorted(files)))
-        
-        for filename in sorted(files):
-            file_path = os.path.join(root, filename)
-            files_to_compress.append((file_path, rel_path, filename))
+    order: List[int] = []
+    placed: Set[int] = set()
+    unmatched = 0
+    for path in trace:
+        entry_id = resolve(path)
+        if entry_id is None:
+            unmatched += 1
+        elif entry_id not in placed:
+            placed.add(entry_id)
+            order.append(entry_id)
+    traced = len(order)
+    order.extend(i for i, entry in enumerate(entries)
+                 if entry.file_type != FILE_TYPE_REFERENCE and i not in placed)
+    return order, traced, unmatched
+
+
+def repack_archive(input_file: str, trace_file: str, output_file: str,
+                   format_version: Optional[int] = None) -> None:
+    """
+    Rewrite an archive with its entries laid out in first-access order of a trace.
     
-    print(f"Compressing {len(files_to_compress)} files using {max_workers} workers...")
+    Layout of the output: the traced entries, then the remaining stored
+    entries in their original order, then the file references, then the copy
+    folders. A folder whose entries end up apart is split over several
+    records, which every reader merges. References and copy folders follow
+    the data they point to, so the result still unpacks as a stream.
     
-    compressed_files: Dict[Tuple[str, str], bytes] = {}
-    total_original = 0
-    total_compressed = 0
-    loop = asyncio.get_event_loop()
+    Args:
+        input_file: Archive to repack (v1 or v2)
+        trace_file: Access trace (see read_access_trace())
+        output_file: Output archive path (must differ from input_file)
+        format_version: Archive format to write (default: that of input_file)
+    """
+    if os.path.abspath(input_file) == os.path.abspath(output_file):
+        raise ValueError("repack needs a different output file")
+    trace = read_access_trace(trace_file)
     
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        future_to_args = {
-            loop.run_in_executor(executor, compress_file_task, args): args
-            for args in files_to_compress
-        }
+    with open(input_file, 'rb') as src:
+        if os.fstat(src.fileno()).st_size == 0:
+            version, folders, entries = read_archive_index(b'')
+        else:
+            with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                version, folders, entries = read_archive_index(data)
+        if format_version is None:
+            format_version = version
+        if format_version == ARCHIVE_VERSION_1 and any(e.file_type in (FILE_TYPE_BLOCKS, FILE_TYPE_STORED, FILE_TYPE_ZSTD)
+                                                       for e in entries):
+            raise ValueError("Archive has block-compressed, uncompressed or zstd files, which need format v2")
         
-        completed = 0
-        for coro in asyncio.as_completed(future_to_args.keys()):
-            result = await coro
-            rel_path, filename, file_path, data, original_size, final_size, is_precompressed = result
-            compressed_files[(rel_path, filename)] = data
-            if is_precompressed:
-                print(f"  [{completed + 1}/{len(files_to_compress)}] Stored as-is (.br): {rel_path}/{filename} ({original_size} bytes)")
-            else:
-                total_original += original_size
-                total_compressed += final_size
-                ratio = (final_size / original_size * 100) if original_size > 0 else 0
-                print(f"  [{completed + 1}/{len(files_to_compress)}] Compressed: {rel_path}/{filename} ({original_size} -> {final_size} bytes, {ratio:.1f}%)")
-            completed += 1
-    
-    print(f"\nAppending to archive...")
-    
-    async with aiofiles.open(archive_path, 'ab') as out:
-        for rel_path, files in folder_structure:
-            folder_name_bytes = rel_path.encode('utf-8')
-            
-            await out.write(bytes([FOLDER_TYPE_NORMAL]))
-            await out.write(encode_uleb128(len(folder_name_bytes)))
-            await out.write(folder_name_bytes)
-            await out.write(encode_uleb128(len(files)))
-            
-            for filename in files:
-                filename_bytes = filename.encode('utf-8')
-                
-                await out.write(encode_uleb128(len(filename_bytes)))
-                await out.write(filename_bytes)
-                
-                compressed_content = compressed_files[(rel_path, filename)]
-                
-                await out.write(bytes([FILE_TYPE_CONTENT]))
-                await out.write(encode_uleb128(len(compressed_content)))
-                await out.write(compressed_content)
+        order, traced, unmatched = trace_layout(folders, entries, trace)
+        traced_bytes = sum(entries[i].compressed_size for i in order[:traced])
+        print(f"Trace: {len(trace)} paths, {traced} stored entries ({traced_bytes} bytes) placed first"
+              f"{f', {unmatched} not in the archive' if unmatched else ''}")
+        
+        references = [i for i, entry in enumerate(entries) if entry.file_type == FILE_TYPE_REFERENCE]
+        used_folders = {entry.folder for entry in entries}
+        empty_folders = [name for name, source in folders if source is None and name not in used_folders]
+        
+        def read_at(offset: int, size: int) -> bytes:
+            src.seek(offset)
+            return src.read(size)
+        
+        writer = ArchiveWriter(format_version)
+        with open(output_file, 'wb') as out:
+            out.write(writer.header())
+            for run in (order, references):
+                for folder, group in itertools.groupby(run, key=lambda i: entries[i].folder):
+                    group = list(group)
+                    out.write(writer.begin_folder(folder, len(group)))
+                    for i in group:
+                        entry = entries[i]
+                        if entry.file_type == FILE_TYPE_REFERENCE:
+                            out.write(writer.file_reference(entry.filename, entry.ref_folder, entry.ref_filename))
+                        elif entry.file_type == FILE_TYPE_BLOCKS:
+                            table = entry.blocks
+                            blocks = [read_at(entry.data_offset + offset, size)
+                                      for offset, size in zip(table.offsets, table.sizes)]
+                            compressed = BlockCompressed(table.raw_size, table.block_size, blocks)
+                            for chunk in writer.file_blocks(entry.filename, compressed, entry.digest):
+                                out.write(chunk)
+                        else:
+                            out.write(writer.file_content(entry.filename, entry.compressed_size,
+                                                          entry.file_type, entry.digest))
+                            for start in range(0, entry.compressed_size, REPACK_COPY_SIZE):
+                                out.write(read_at(entry.data_offset + start,
+                                                  min(REPACK_COPY_SIZE, entry.compressed_size - start)))
+            for folder in empty_folders:
+                out.write(writer.begin_folder(folder, 0))
+            for folder, source in folders:
+                if source is not None:
+                    out.write(writer.copy_folder(folder, source))
+            out.write(writer.finish())
     
-    new_size = os.path.getsize(archive_path)
-    print(f"\nAdded to {archive_path} (total size: {new_size} bytes)")
-    if total_original > 0:
-        ratio = total_compressed / total_original * 100
-        print(f"Compression: {total_original} -> {total_compressed} bytes ({ratio:.1f}%)")
+    print(f"Repacked to {output_file} ({os.path.getsize(output_file)} bytes, format v{format_version})")
 
 
 # ============== CLI ==============
 
+def parse_block_size_option() -> int:
+    """Parse the --block-size KB option into bytes (0 if absent)."""
+    if '--block-size' not in sys.argv:
+        return 0
+    try:
+        block_size_kb = int(sys.argv[sys.argv.index('--block-size') + 1])
+        if block_size_kb <= 0:
+            raise ValueError
+    except (IndexError, ValueError):
+        print("Error: --block-size requires a positive size in KB")
+        sys.exit(1)
+    return block_size_kb * 1024
+
+
+def parse_store_min_gain_option() -> float:
+    """Parse the --store-min-gain PERCENT option into a fraction (STORE_MIN_GAIN if absent)."""
+    if '--store-min-gain' not in sys.argv:
+        return STORE_MIN_GAIN
+    try:
+        percent = float(sys.argv[sys.argv.index('--store-min-gain') + 1])
+        if not 0 <= percent < 100:
+            raise ValueError
+    except (IndexError, ValueError):
+        print("Error: --store-min-gain requires a percentage from 0 to 100")
+        sys.exit(1)
+    return percent / 100
+
+
+def parse_timings_option() -> Optional[str]:
+    """Parse the --timings FILE option (None if absent)."""
+    if '--timings' not in sys.argv:
+        return None
+    try:
+        return sys.argv[sys.argv.index('--timings') + 1]
+    except IndexError:
+        print("Error: --timings requires a file path")
+        sys.exit(1)
+
+
+def parse_codec_option() -> Optional[List[Tuple[str, str]]]:
+    """Parse the (repeatable) --codec CODEC[:PATTERN,...] option, then --target, into codec rules (None if absent)."""
+    rules: List[Tuple[str, str]] = []
+    for i, arg in enumerate(sys.argv):
+        if arg != '--codec':
+            continue
+        try:
+            rules += parse_codec_rules(sys.argv[i + 1])
+        except IndexError:
+            print(f"Error: --codec requires CODEC or CODEC:PATTERN[,PATTERN...] ({', '.join(CODECS)})")
+            sys.exit(1)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+    if '--target' in sys.argv:
+        try:
+            rules += CODEC_TARGETS[sys.argv[sys.argv.index('--target') + 1]]
+        except (IndexError, KeyError):
+            print(f"Error: --target requires one of {', '.join(CODEC_TARGETS)}")
+            sys.exit(1)
+    if any(codec == CODEC_ZSTD for pattern, codec in rules) and zstandard is None:
+        print("Error: zstd entries need the zstandard package (pip install zstandard)")
+        sys.exit(1)
+    return rules or None
+
+
 def main():
     if len(sys.argv) < 3:
         print("Usage:")
-        print("  Pack:   python packer_brotli.py pack <folder_path> <output_file> [--no-dedup] [--workers N]")
+        print("  Pack:   python packer_brotli.py pack <folder_path> <output_file> [--no-dedup] [--workers N] [--format 1|2] [--block-size KB] [--base ARCHIVE] [--store-min-gain PCT] [--profile FILE] [--codec CODEC[:PATTERNS]] [--target serve|unpack] [--timings FILE]")
         print("  Unpack: python packer_brotli.py unpack <input_file> <output_dir>")
-        print("  Add:    python packer_brotli.py add <archive_file> <folder_path> [--workers N]")
+        print("  Add:    python packer_brotli.py add <archive_file> <folder_path> [--workers N] [--block-size KB] [--store-min-gain PCT] [--codec CODEC[:PATTERNS]] [--target serve|unpack] [--timings FILE]")
+        print("  Repack: python packer_brotli.py repack <input_file> <trace_file> <output_file> [--format 1|2]")
         print()
         print("Options:")
         print("  --no-dedup    Disable folder and file deduplication during packing")
         print("  --workers N   Number of parallel compression workers (default: CPU count)")
+        print(f"  --format N    Archive format version to write (default: {ARCHIVE_VERSION})")
+        print("                1 = legacy headerless stream, 2 = trailing index for instant loading")
+        print("  --block-size KB  Compress files larger than KB kilobytes in independent blocks of")
+        print("                that size, so byte ranges decode without the whole file (format 2 only;")
+        print("                such files can't be passed through to clients as brotli). The blocks of")
+        print("                files over 8 MB are compressed in parallel by all workers, so e.g.")
+        print("                --block-size 4096 splits giant files without a single-core tail")
+        print("  --base ARCHIVE  Copy the compressed data of files whose content is unchanged from a")
+        print("                previous archive; only new or changed files are compressed")
+        print("  --store-min-gain PCT  Store files uncompressed when brotli saves less than PCT")
+        print(f"                percent of their size (default: {STORE_MIN_GAIN * 100:g}, 0 compresses every")
+        print("                file; format 2 only). Such files are served without decoding")
+        print("  --profile FILE  Compression profile (JSON): brotli quality and mode are chosen per")
+        print("                file extension by trial compression and saved there; later packs")
+        print("                with the same file reuse them and only try new extensions")
+        print("  --codec CODEC[:PATTERNS]  Codec (brotli, zstd or raw) of all files, or of the files whose")
+        print("                archive path matches one of the comma-separated PATTERNS (e.g. '*.dat');")
+        print("                repeatable, first match wins, default brotli (format 2 only). zstd")
+        print("                decodes several times faster but can't be passed through to browsers:")
+        print("                use it for files decoded server-side or for archives that are unpacked")
+        print("                (needs the zstandard package)")
+        print("  --target serve|unpack  Default codec rules for what the archive is for, after any")
+        print("                --codec rules: serve (default) keeps brotli for browsers, unpack")
+        print("                zstd-compresses every file, as all of them are decoded")
+        print("  --timings FILE  Write the seconds spent scanning, hashing, waiting for compression")
+        print("                and writing to FILE (JSON). Files are compressed largest first and")
+        print("                each progress line shows the throughput and an ETA")
         print()
         print("Example:")
         print("  python packer_brotli.py pack vcsky packed.bin")
         print("  python packer_brotli.py pack vcsky packed.bin --workers 8")
+        print("  python packer_brotli.py pack vcsky packed.bin --block-size 1024")
+        print("  python packer_brotli.py pack vcsky packed-new.bin --base packed.bin")
+        print("  python packer_brotli.py pack vcsky packed.bin --profile vcsky.profile.json")
+        print("  python packer_brotli.py pack vcsky packed.bin --codec 'zstd:*.dat,*.img'")
+        print("  python packer_brotli.py pack vcsky vcsky-download.bin --target unpack")
+        print("  python packer_brotli.py pack vcsky packed.bin --timings pack-times.json")
         print("  python packer_brotli.py unpack packed.bin unpacked/")
         print("  python packer_brotli.py add packed.bin vcbr  # Add vcbr folder to existing archive")
+        print("  python packer_brotli.py repack packed.bin boot.trace packed-boot.bin")
         print()
         print("Features:")
         print("  - Brotli compression with quality 11 (maximum compression)")
-        print("  - Parallel file compression for maximum speed")
+        print("  - zstd for files decoded server-side or unpacked, which decodes faster")
+        print("  - Parallel file compression for maximum speed, largest files first")
         print("  - Folder and file deduplication to reduce archive size")
         print("  - PackedArchive class for reading files directly from archive")
+        print("  - Trailing index (format v2) so the archive index loads without a scan")
+        print("  - Repack in the order files were first requested (a trace recorded with")
+        print("    server.py --packed_trace), so boot-time files are read contiguously")
         print()
         print("Deduplication: Identical folders and files are detected by comparing")
         print("content hashes. Duplicates reference the original instead of storing")
@@ -1685,7 +5150,7 @@ def main():
     
     if command == 'pack':
         if len(sys.argv) < 4:
-            print("Usage: python packer_brotli.py pack <folder_path> <output_file> [--no-dedup] [--workers N]")
+            print("Usage: python packer_brotli.py pack <folder_path> <output_file> [--no-dedup] [--workers N] [--format 1|2] [--block-size KB] [--base ARCHIVE] [--store-min-gain PCT] [--profile FILE] [--codec CODEC[:PATTERNS]] [--target serve|unpack] [--timings FILE]")
             sys.exit(1)
         folder_path = sys.argv[2]
         output_file = sys.argv[3]
@@ -1701,11 +5166,57 @@ def main():
                 print("Error: --workers requires a numeric argument")
                 sys.exit(1)
         
+        # Parse --format option
+        format_version = ARCHIVE_VERSION
+        if '--format' in sys.argv:
+            try:
+                format_idx = sys.argv.index('--format')
+                format_version = int(sys.argv[format_idx + 1])
+                archive_header(format_version)
+            except (IndexError, ValueError):
+                print("Error: --format requires 1 or 2")
+                sys.exit(1)
+        
+        block_size = parse_block_size_option()
+        if block_size > 0 and format_version == ARCHIVE_VERSION_1:
+            print("Error: --block-size requires --format 2")
+            sys.exit(1)
+        
+        codecs = parse_codec_option()
+        if codecs and format_version == ARCHIVE_VERSION_1:
+            print("Error: --codec and --target unpack require --format 2")
+            sys.exit(1)
+        
+        base = None
+        if '--base' in sys.argv:
+            try:
+                base = sys.argv[sys.argv.index('--base') + 1]
+            except IndexError:
+                print("Error: --base requires an archive path")
+                sys.exit(1)
+            if not os.path.isfile(base):
+                print(f"Error: {base} is not a file")
+                sys.exit(1)
+            if os.path.abspath(base) == os.path.abspath(output_file):
+                print("Error: --base must differ from the output file")
+                sys.exit(1)
+        
+        profile = None
+        if '--profile' in sys.argv:
+            try:
+                profile = sys.argv[sys.argv.index('--profile') + 1]
+            except IndexError:
+                print("Error: --profile requires a file path")
+                sys.exit(1)
+        
         if not os.path.isdir(folder_path):
             print(f"Error: {folder_path} is not a directory")
             sys.exit(1)
         
-        pack_folder(folder_path, output_file, deduplicate=deduplicate, max_workers=max_workers)
+        pack_folder(folder_path, output_file, deduplicate=deduplicate, max_workers=max_workers,
+                    format_version=format_version, block_size=block_size, base=base,
+                    store_min_gain=parse_store_min_gain_option(), profile=profile, codecs=codecs,
+                    timings=parse_timings_option())
     
     elif command == 'unpack':
         if len(sys.argv) < 4:
@@ -1722,7 +5233,7 @@ def main():
     
     elif command == 'add':
         if len(sys.argv) < 4:
-            print("Usage: python packer_brotli.py add <archive_file> <folder_path> [--workers N]")
+            print("Usage: python packer_brotli.py add <archive_file> <folder_path> [--workers N] [--block-size KB] [--store-min-gain PCT] [--codec CODEC[:PATTERNS]] [--target serve|unpack] [--timings FILE]")
             sys.exit(1)
         archive_path = sys.argv[2]
         folder_path = sys.argv[3]
@@ -1745,11 +5256,35 @@ def main():
             print(f"Error: {folder_path} is not a directory")
             sys.exit(1)
         
-        add_folder(archive_path, folder_path, max_workers=max_workers)
+        add_folder(archive_path, folder_path, max_workers=max_workers, block_size=parse_block_size_option(),
+                   store_min_gain=parse_store_min_gain_option(), codecs=parse_codec_option(),
+                   timings=parse_timings_option())
+    
+    elif command == 'repack':
+        if len(sys.argv) < 5:
+            print("Usage: python packer_brotli.py repack <input_file> <trace_file> <output_file> [--format 1|2]")
+            sys.exit(1)
+        input_file, trace_file, output_file = sys.argv[2:5]
+        
+        format_version = None
+        if '--format' in sys.argv:
+            try:
+                format_version = int(sys.argv[sys.argv.index('--format') + 1])
+                archive_header(format_version)
+            except (IndexError, ValueError):
+                print("Error: --format requires 1 or 2")
+                sys.exit(1)
+        
+        for path in (input_file, trace_file):
+            if not os.path.isfile(path):
+                print(f"Error: {path} is not a file")
+                sys.exit(1)
+        
+        repack_archive(input_file, trace_file, output_file, format_version=format_version)
     
     else:
         print(f"Unknown command: {command}")
-        print("Use 'pack', 'unpack', or 'add'")
+        print("Use 'pack', 'unpack', 'add', or 'repack'")
         sys.exit(1)
 
 